@@ -7,7 +7,10 @@ import sqlite3
 from datetime import datetime, timedelta
 import random
 
-DB_PATH = "../develper/fieldtrack.db"
+from calprotrack_config import DATABASE_PATH
+
+# Same database as the Node server: set DATABASE_PATH to use another one
+DB_PATH = DATABASE_PATH
 
 def add_test_shifts():
     """Add some test shifts with realistic data"""
@@ -0,0 +1,354 @@
+"""
+CalProTrack API Benchmarks
+Builds throwaway databases of several sizes and times every API endpoint
+in-process (no server needed)
+
+Reports p50/p95/p99 latency and rows/sec per endpoint and can write the
+results as JSON. Given a baseline JSON from an earlier commit, it fails
+when an endpoint got slower than the threshold allows.
+
+Run:
+    python bench_calprotrack.py                                  # small + medium datasets
+    python bench_calprotrack.py --sizes large --output after.json
+    python bench_calprotrack.py --baseline before.json --threshold 20
+    python bench_calprotrack.py --db big.db                      # an existing database
+    python bench_calprotrack.py --active                         # /active vs open shift count
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from fastapi.testclient import TestClient
+
+import calprotrack_api_fixed as api
+from calprotrack_cache import response_cache
+from calprotrack_generate import generate
+
+# The demo DB in the repo root doubles as an empty-schema template
+TEMPLATE_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "fieldtrack.db")
+
+RUNS = 20
+
+# Dataset sizes built with calprotrack_generate (seeded, so every run gets the same shape)
+DATASETS = {
+    "small": dict(companies=2, users=25, sites=8, days=30, shifts_per_day=15),
+    "medium": dict(companies=10, users=100, sites=20, days=90, shifts_per_day=60),
+    "large": dict(companies=20, users=200, sites=40, days=180, shifts_per_day=150),
+}
+DEFAULT_SIZES = ("small", "medium")
+
+# (name, method, path, JSON body); {company_id}, {user_id} and {since} are filled per dataset
+ENDPOINTS = [
+    ("root", "GET", "/", None),
+    ("active", "GET", "/active", None),
+    ("payroll_7d", "GET", "/payroll?days=7", None),
+    ("payroll_30d", "GET", "/payroll?days=30", None),
+    ("employee_hours", "GET", "/employee/{user_id}/hours?days=30", None),
+    ("payroll_detailed_7d", "GET", "/payroll/detailed?days=7", None),
+    ("payroll_detailed_30d_sites", "GET", "/payroll/detailed?days=30&by_site=true", None),
+    ("employee_payroll", "GET", "/employee/{user_id}/payroll?days=30", None),
+    ("sites_busy", "GET", "/sites/busy", None),
+    ("sites", "GET", "/sites", None),
+    ("sites_page", "GET", "/sites?limit=100", None),
+    ("employees", "GET", "/employees", None),
+    ("employees_page", "GET", "/employees?limit=100", None),
+    ("today", "GET", "/today", None),
+    ("export_7d", "GET", "/export/shifts?start={since}", None),
+    ("batch", "POST", "/batch", {"actions": [
+        {"action": "get_today_summary"},
+        {"action": "get_active_employees"},
+        {"action": "get_payroll", "parameters": {"days": 7}},
+    ]}),
+    ("state_check", "GET", "/state/check", None),
+    ("company_root", "GET", "/companies/{company_id}", None),
+    ("company_active", "GET", "/companies/{company_id}/active", None),
+    ("company_payroll_7d", "GET", "/companies/{company_id}/payroll?days=7", None),
+    ("company_employee_hours", "GET", "/companies/{company_id}/employee/{user_id}/hours?days=30", None),
+    ("company_payroll_detailed_7d", "GET", "/companies/{company_id}/payroll/detailed?days=7", None),
+    ("company_sites_busy", "GET", "/companies/{company_id}/sites/busy", None),
+    ("company_sites", "GET", "/companies/{company_id}/sites", None),
+    ("company_employees", "GET", "/companies/{company_id}/employees", None),
+    ("company_today", "GET", "/companies/{company_id}/today", None),
+    ("company_export_7d", "GET", "/companies/{company_id}/export/shifts?start={since}", None),
+    ("stats", "GET", "/stats", None),
+]
+
+# Slowdowns smaller than this are noise between runs, whatever the percentage
+MIN_REGRESSION_MS = 2.0
+
+# How long to wait for the activity watcher to seed the on-site state
+ONSITE_WAIT = 60
+
+
+def build_db(path, open_shifts, sites=25, seed=42):
+    """Create a DB with one clocked-in user per open shift, each with closed and open segments"""
+    rng = random.Random(seed)
+    shutil.copy(TEMPLATE_DB, path)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    for table in ("sessions", "shift_segments", "shifts", "job_sites", "users", "companies"):
+        conn.execute(f"DELETE FROM {table}")
+    conn.execute("INSERT INTO companies (id, name) VALUES (1, 'Bench Co')")
+
+    conn.executemany(
+        "INSERT INTO job_sites (id, company_id, name, address) VALUES (?, 1, ?, ?)",
+        [(i, f"Site {i}", f"{i} Bench Rd") for i in range(1, sites + 1)],
+    )
+    conn.executemany(
+        "INSERT INTO users (id, company_id, email, name, pass_hash, role, hourly_rate) "
+        "VALUES (?, 1, ?, ?, 'x', 'employee', ?)",
+        [(i, f"user{i}@bench.test", f"User {i}", rng.choice((20, 25, 30))) for i in range(1, open_shifts + 1)],
+    )
+
+    now = datetime.now(timezone.utc)
+    shifts = []
+    segments = []
+    for user_id in range(1, open_shifts + 1):
+        clock_in = now - timedelta(minutes=rng.randint(30, 600))
+        switch = clock_in + timedelta(minutes=rng.randint(5, 25))
+        shifts.append((user_id, user_id, clock_in.strftime("%Y-%m-%d %H:%M:%S")))
+        # One finished segment, then the site they are on now
+        segments.append((user_id, rng.randint(1, sites), clock_in.strftime("%Y-%m-%d %H:%M:%S"),
+                         switch.strftime("%Y-%m-%d %H:%M:%S")))
+        segments.append((user_id, rng.randint(1, sites), switch.strftime("%Y-%m-%d %H:%M:%S"), None))
+
+    conn.executemany(
+        "INSERT INTO shifts (id, company_id, user_id, clock_in_at) VALUES (?, 1, ?, ?)", shifts)
+    conn.executemany(
+        "INSERT INTO shift_segments (company_id, shift_id, job_site_id, start_at, end_at) VALUES (1, ?, ?, ?, ?)",
+        segments,
+    )
+    conn.commit()
+    conn.close()
+
+
+def time_endpoint(client, url, runs=RUNS):
+    """Call an endpoint `runs` times and return latencies in milliseconds"""
+    client.get(url)  # warm up the pool and page cache
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        response = client.get(url)
+        timings.append((time.perf_counter() - start) * 1000)
+        response.raise_for_status()
+    return timings
+
+
+def bench_active():
+    """GET /active latency at 10, 1,000 and 10,000 open shifts"""
+    print("GET /active")
+    print(f"   {'open shifts':>12} {'rows':>7} {'p50 ms':>9} {'max ms':>9}")
+    tmp = tempfile.mkdtemp(prefix="calprotrack-bench-")
+    try:
+        for open_shifts in (10, 1_000, 10_000):
+            path = os.path.join(tmp, f"active_{open_shifts}.db")
+            build_db(path, open_shifts)
+            api.DB_PATH = path
+            with TestClient(api.app) as client:
+                rows = len(client.get("/active").json())
+                timings = time_endpoint(client, "/active")
+            print(f"   {open_shifts:>12,} {rows:>7,} {statistics.median(timings):>9.2f} {max(timings):>9.2f}")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of latencies"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))]
+
+
+def count_rows(response):
+    """Rows in a response: list length, the list inside a page, or NDJSON lines"""
+    if response.headers.get("content-type", "").startswith("application/x-ndjson"):
+        return response.text.count("\n")
+    payload = response.json()
+    if isinstance(payload, list):
+        return len(payload)
+    if isinstance(payload, dict):
+        if "results" in payload:
+            return sum(len(r["result"]) if isinstance(r.get("result"), list) else 1 for r in payload["results"])
+        for value in payload.values():
+            if isinstance(value, list):
+                return len(value)
+    return 1
+
+
+def dataset_params(path):
+    """A company and employee that have recent shifts, and the start of the last 7 days"""
+    conn = sqlite3.connect(path)
+    try:
+        company_id, user_id = conn.execute(
+            "SELECT company_id, user_id FROM shifts ORDER BY id DESC LIMIT 1").fetchone()
+        shifts, segments = (conn.execute("SELECT COUNT(*) FROM shifts").fetchone()[0],
+                            conn.execute("SELECT COUNT(*) FROM shift_segments").fetchone()[0])
+    finally:
+        conn.close()
+    since = (datetime.now(timezone.utc) - timedelta(days=7)).strftime("%Y-%m-%d")
+    return {"company_id": company_id, "user_id": user_id, "since": since}, {"shifts": shifts, "segments": segments}
+
+
+def time_request(client, method, url, body, runs, use_cache):
+    """Latencies (ms) of `runs` calls plus the row count of the last response"""
+    response = client.request(method, url, json=body)  # warm up the pool and page cache
+    response.raise_for_status()
+    timings = []
+    for _ in range(runs):
+        if not use_cache:
+            response_cache.clear()
+        start = time.perf_counter()
+        response = client.request(method, url, json=body)
+        timings.append((time.perf_counter() - start) * 1000)
+        response.raise_for_status()
+    return timings, count_rows(response)
+
+
+def bench_database(path, runs=RUNS, use_cache=False):
+    """Time every endpoint against one database; returns {endpoint: stats}"""
+    params, _ = dataset_params(path)
+    api.DB_PATH = path
+    results = {}
+    with TestClient(api.app) as client:
+        deadline = time.monotonic() + ONSITE_WAIT
+        while not api.app.state.onsite.ready and time.monotonic() < deadline:
+            time.sleep(0.1)
+        for name, method, path_template, body in ENDPOINTS:
+            timings, rows = time_request(client, method, path_template.format(**params), body, runs, use_cache)
+            mean = statistics.mean(timings)
+            results[name] = {
+                "p50_ms": round(percentile(timings, 50), 3),
+                "p95_ms": round(percentile(timings, 95), 3),
+                "p99_ms": round(percentile(timings, 99), 3),
+                "mean_ms": round(mean, 3),
+                "max_ms": round(max(timings), 3),
+                "rows": rows,
+                "rows_per_sec": round(rows / (mean / 1000), 1) if mean else 0,
+            }
+    return results
+
+
+def print_results(label, sizes, results):
+    print(f"\n📊 {label}: {sizes['shifts']:,} shifts, {sizes['segments']:,} segments")
+    print(f"   {'endpoint':<24} {'rows':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'rows/sec':>12}")
+    for name, r in results.items():
+        print(f"   {name:<24} {r['rows']:>7,} {r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f} {r['p99_ms']:>9.2f} "
+              f"{r['rows_per_sec']:>12,.0f}")
+
+
+def compare(results, baseline, threshold, metric="p50_ms", min_delta=MIN_REGRESSION_MS):
+    """Endpoints whose `metric` grew more than `threshold` percent over the baseline"""
+    regressions = []
+    print(f"\n🔍 Compared with baseline ({baseline['meta'].get('commit') or 'unknown commit'}), "
+          f"{metric}, threshold {threshold:g}%")
+    for dataset, current in results["datasets"].items():
+        before = baseline["datasets"].get(dataset)
+        if before is None:
+            print(f"   ⚠️  {dataset}: not in baseline, skipped")
+            continue
+        for name, r in current["endpoints"].items():
+            old = before["endpoints"].get(name)
+            if old is None:
+                continue
+            change = (r[metric] - old[metric]) / old[metric] * 100 if old[metric] else 0
+            slower = change > threshold and r[metric] - old[metric] >= min_delta
+            if slower:
+                regressions.append({"dataset": dataset, "endpoint": name, "before": old[metric],
+                                    "after": r[metric], "change_pct": round(change, 1)})
+            marker = "❌" if slower else "  "
+            print(f"   {marker} {dataset:<8} {name:<24} {old[metric]:>9.2f} → {r[metric]:>9.2f} ms ({change:+.1f}%)")
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every CalProTrack API endpoint")
+    parser.add_argument("--sizes", default=",".join(DEFAULT_SIZES),
+                        help=f"Comma-separated datasets to build ({', '.join(DATASETS)})")
+    parser.add_argument("--db", help="Benchmark this existing database instead of building datasets")
+    parser.add_argument("--runs", type=int, default=RUNS, help="Timed calls per endpoint")
+    parser.add_argument("--cache", action="store_true", help="Leave the response cache on (default: time every call cold)")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--baseline", help="Results JSON from an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=20.0, help="Allowed slowdown in percent (with --baseline)")
+    parser.add_argument("--metric", default="p50_ms", choices=["p50_ms", "p95_ms", "p99_ms", "mean_ms"],
+                        help="Latency compared against the baseline")
+    parser.add_argument("--min-delta", type=float, default=MIN_REGRESSION_MS,
+                        help="Ignore slowdowns smaller than this many ms (with --baseline)")
+    parser.add_argument("--active", action="store_true", help="Only run the /active open-shift scaling benchmark")
+    args = parser.parse_args()
+
+    if args.active:
+        bench_active()
+        return 0
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "created_at": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "runs": args.runs,
+            "cache": args.cache,
+        },
+        "datasets": {},
+    }
+
+    if args.db:
+        targets = [("custom", args.db, None)]
+    else:
+        sizes = [size.strip() for size in args.sizes.split(",") if size.strip()]
+        unknown = [size for size in sizes if size not in DATASETS]
+        if unknown:
+            parser.error(f"unknown dataset size: {', '.join(unknown)}")
+        targets = [(size, None, DATASETS[size]) for size in sizes]
+
+    tmp = tempfile.mkdtemp(prefix="calprotrack-bench-")
+    try:
+        for label, path, spec in targets:
+            if path is None:
+                path = os.path.join(tmp, f"{label}.db")
+                print(f"🏗️  Building {label} dataset...")
+                generate(path, **spec, drop_indexes=True, log=lambda *a: None)
+            _, sizes = dataset_params(path)
+            endpoints = bench_database(path, args.runs, args.cache)
+            results["datasets"][label] = {**sizes, "endpoints": endpoints}
+            print_results(label, sizes, endpoints)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n💾 Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.metric, args.min_delta)
+        if regressions:
+            print(f"\n❌ {len(regressions)} endpoint(s) slower than the {args.threshold:g}% threshold")
+            return 1
+        print("\n✅ No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
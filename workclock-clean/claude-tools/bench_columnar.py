@@ -0,0 +1,142 @@
+"""
+CalProTrack Columnar Store Benchmark
+Times long-range analytics two ways on the same database: SQL over the
+shift_segments table (epoch columns and their indexes) and numpy over the
+memory-mapped columnar store (calprotrack_columnar). Both must return the
+same hours and segment counts. Also times the store's build and an
+incremental refresh.
+
+Run:
+    python bench_columnar.py                          # builds a throwaway ~3M-segment dataset
+    python bench_columnar.py --segments 6000000
+    python bench_columnar.py --db big.db --days 365   # an existing database
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from calprotrack_generate import generate
+from calprotrack_migrations import run_migrations
+from calprotrack_pool import open_connection
+from calprotrack_columnar import ColumnarStore
+from calprotrack_time import utc_now, db_time, db_epoch, since_days
+
+SEGMENTS = 3_000_000
+RUNS = 5
+
+# Generated dataset: 25 companies x 150 shifts a day, ~2 segments per shift
+COMPANIES = 25
+SHIFTS_PER_DAY = 150
+SEGMENTS_PER_SHIFT = 2
+
+# Closed segments that started in [:since, :until), the store's definition
+SQL_TOTALS = """
+    SELECT {key}, SUM(COALESCE(ss.end_epoch, s.clock_out_epoch) - ss.start_epoch) / 3600.0, COUNT(*)
+    FROM shift_segments ss JOIN shifts s ON s.id = ss.shift_id
+    WHERE ss.start_epoch >= :since AND ss.start_epoch < :until {filter}
+      AND COALESCE(ss.end_epoch, s.clock_out_epoch) IS NOT NULL
+    GROUP BY +{key}
+"""
+
+
+def timed(fn, runs):
+    """(median ms, result) of fn() over `runs` calls"""
+    timings = []
+    result = None
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), result
+
+
+def from_store(totals):
+    return {key: (hours, count) for key, hours, count in
+            zip(totals["id"].tolist(), totals["hours"].tolist(), totals["segments"].tolist())}
+
+
+def same_totals(a, b):
+    """Per-group hours agree to within a second and segment counts exactly"""
+    return a.keys() == b.keys() and all(abs(a[k][0] - b[k][0]) < 1 / 3600 and a[k][1] == b[k][1] for k in a)
+
+
+def bench(path, store_dir, days, runs):
+    run_migrations(path)
+    conn = open_connection(path)
+    conn.row_factory = None
+
+    store = ColumnarStore(store_dir)
+    started = time.perf_counter()
+    stats = store.build(path)
+    build_s = time.perf_counter() - started
+    started = time.perf_counter()
+    store.refresh(path)
+    refresh_ms = (time.perf_counter() - started) * 1000
+    size = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(store_dir) for name in names)
+
+    now = utc_now()
+    since, until = db_epoch(since_days(days, now)), db_epoch(db_time(now))
+    # A company and site that are still clocking hours
+    company_id, site_id = conn.execute(
+        "SELECT company_id, job_site_id FROM shift_segments ORDER BY id DESC LIMIT 1").fetchone()
+    params = {"since": since, "until": until, "company_id": company_id, "site_id": site_id}
+
+    def sql(key, filter=""):
+        return lambda: {row[0]: (row[1], row[2]) for row in
+                        conn.execute(SQL_TOTALS.format(key=key, filter=filter), params)}
+
+    cases = {
+        "hours per user": (sql("s.user_id"), lambda: from_store(store.totals("user_id", since, until))),
+        "hours per site": (sql("ss.job_site_id"), lambda: from_store(store.totals("site_id", since, until))),
+        "one company, per user": (sql("s.user_id", "AND ss.company_id = :company_id"),
+                                  lambda: from_store(store.totals("user_id", since, until, company_id=company_id))),
+        "one site, per user": (sql("s.user_id", "AND ss.job_site_id = :site_id"),
+                               lambda: from_store(store.totals("user_id", since, until, site_id=site_id))),
+    }
+
+    print(f"\n📦 {stats['rows']:,} closed segments in {stats['runs']} run(s), {size / 1e6:.0f} MB on disk")
+    print(f"   🏗️  Build {build_s:.1f}s, empty incremental refresh {refresh_ms:.0f} ms; window = last {days} days")
+    print(f"   {'aggregate':<26} {'SQL ms':>9} {'columnar ms':>12} {'speedup':>8}")
+    ok = True
+    for name, (sql_fn, store_fn) in cases.items():
+        sql_ms, sql_rows = timed(sql_fn, runs)
+        store_ms, store_rows = timed(store_fn, runs)
+        match = same_totals(sql_rows, store_rows)
+        ok = ok and match
+        print(f"   {name:<26} {sql_ms:>9.1f} {store_ms:>12.1f} {sql_ms / store_ms:>7.1f}x"
+              f"{'' if match else '   ❌ totals differ'}")
+    conn.close()
+    print("   ✅ Both return the same hours" if ok else "   ❌ Results differ")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark SQL vs the columnar store for long-range analytics")
+    parser.add_argument("--db", help="Benchmark this existing database instead of generating one")
+    parser.add_argument("--days", type=int, default=365, help="Analytics window in days")
+    parser.add_argument("--segments", type=int, default=SEGMENTS, help="Segments to generate (without --db)")
+    parser.add_argument("--runs", type=int, default=RUNS, help="Timed runs per aggregate")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="calprotrack-columnar-")
+    try:
+        path = args.db
+        if path is None:
+            path = os.path.join(tmp, "columnar.db")
+            history = max(1, args.segments // (COMPANIES * SHIFTS_PER_DAY * SEGMENTS_PER_SHIFT))
+            print(f"🏗️  Generating ~{args.segments:,} segments ({history} days)...")
+            generate(path, companies=COMPANIES, users=SHIFTS_PER_DAY, sites=25, days=history,
+                     shifts_per_day=SHIFTS_PER_DAY, drop_indexes=True, log=lambda *a: None)
+        ok = bench(path, os.path.join(tmp, "store"), args.days, args.runs)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+"""
+CalProTrack Epoch Column Benchmark
+Times the report aggregates two ways on the same database: duration math on
+the TEXT timestamps with julianday() (how the queries used to read) and on
+the integer *_epoch columns the epoch_columns migration adds. Both versions
+must return the same totals.
+
+Run:
+    python bench_epochs.py                          # builds a throwaway ~3M-segment dataset
+    python bench_epochs.py --segments 6000000
+    python bench_epochs.py --db big.db --days 30    # an existing database
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from calprotrack_generate import generate
+from calprotrack_migrations import run_migrations
+from calprotrack_pool import open_connection
+from calprotrack_time import utc_now, db_time, since_days, epoch_params
+
+SEGMENTS = 3_000_000
+RUNS = 5
+
+# Generated dataset: 25 companies x 150 shifts a day, ~2 segments per shift
+COMPANIES = 25
+SHIFTS_PER_DAY = 150
+SEGMENTS_PER_SHIFT = 2
+
+# name -> (julianday version, epoch version); each returns (group, hours) rows.
+# GROUP BY +column keeps SQLite seeking on the time window, as the reports do,
+# instead of walking a whole group-by index.
+QUERIES = {
+    "shift hours per user (window)": (
+        """SELECT user_id, SUM((julianday(COALESCE(clock_out_at, :now)) - julianday(clock_in_at)) * 24)
+           FROM shifts WHERE clock_in_at >= :since GROUP BY +user_id""",
+        """SELECT user_id, SUM(COALESCE(clock_out_epoch, :now_epoch) - clock_in_epoch) / 3600.0
+           FROM shifts WHERE clock_in_epoch >= :since_epoch GROUP BY +user_id""",
+    ),
+    "segment hours per site (window)": (
+        """SELECT job_site_id, SUM((julianday(COALESCE(end_at, :now)) - julianday(start_at)) * 24)
+           FROM shift_segments WHERE start_at >= :since GROUP BY +job_site_id""",
+        """SELECT job_site_id, SUM(COALESCE(end_epoch, :now_epoch) - start_epoch) / 3600.0
+           FROM shift_segments WHERE start_epoch >= :since_epoch GROUP BY +job_site_id""",
+    ),
+    "shift hours per company (all)": (
+        """SELECT company_id, SUM((julianday(COALESCE(clock_out_at, :now)) - julianday(clock_in_at)) * 24)
+           FROM shifts GROUP BY company_id""",
+        """SELECT company_id, SUM(COALESCE(clock_out_epoch, :now_epoch) - clock_in_epoch) / 3600.0
+           FROM shifts GROUP BY company_id""",
+    ),
+}
+
+
+def timed(conn, sql, params, runs):
+    """(median ms, rows) of a query over `runs` executions"""
+    timings = []
+    rows = None
+    for _ in range(runs):
+        started = time.perf_counter()
+        rows = conn.execute(sql, params).fetchall()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), rows
+
+
+def same_totals(a, b):
+    """Per-group hours agree to within a second"""
+    a, b = dict(a), dict(b)
+    return a.keys() == b.keys() and all(abs(a[k] - b[k]) < 1 / 3600 for k in a)
+
+
+def bench(path, days, runs):
+    run_migrations(path)
+    conn = open_connection(path)
+    conn.row_factory = None
+    now = utc_now()
+    params = epoch_params({"since": since_days(days, now), "now": db_time(now)}, "since", "now")
+    shifts, segments = (conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                        for table in ("shifts", "shift_segments"))
+
+    print(f"\n📦 {shifts:,} shifts, {segments:,} segments; window = last {days} days")
+    print(f"   {'query':<32} {'julianday ms':>13} {'epoch ms':>10} {'speedup':>8}")
+    ok = True
+    for name, (text_sql, epoch_sql) in QUERIES.items():
+        text_ms, text_rows = timed(conn, text_sql, params, runs)
+        epoch_ms, epoch_rows = timed(conn, epoch_sql, params, runs)
+        match = same_totals(text_rows, epoch_rows)
+        ok = ok and match
+        print(f"   {name:<32} {text_ms:>13.1f} {epoch_ms:>10.1f} {text_ms / epoch_ms:>7.1f}x"
+              f"{'' if match else '   ❌ totals differ'}")
+    conn.close()
+    print("   ✅ Both versions return the same hours" if ok else "   ❌ Results differ")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark julianday() vs integer epoch duration math")
+    parser.add_argument("--db", help="Benchmark this existing database instead of generating one")
+    parser.add_argument("--days", type=int, default=30, help="Report window in days")
+    parser.add_argument("--segments", type=int, default=SEGMENTS, help="Segments to generate (without --db)")
+    parser.add_argument("--runs", type=int, default=RUNS, help="Timed runs per query")
+    args = parser.parse_args()
+
+    tmp = None
+    try:
+        path = args.db
+        if path is None:
+            tmp = tempfile.mkdtemp(prefix="calprotrack-epochs-")
+            path = os.path.join(tmp, "epochs.db")
+            history = max(1, args.segments // (COMPANIES * SHIFTS_PER_DAY * SEGMENTS_PER_SHIFT))
+            print(f"🏗️  Generating ~{args.segments:,} segments ({history} days)...")
+            generate(path, companies=COMPANIES, users=SHIFTS_PER_DAY, sites=25, days=history,
+                     shifts_per_day=SHIFTS_PER_DAY, drop_indexes=True, log=lambda *a: None)
+        ok = bench(path, args.days, args.runs)
+    finally:
+        if tmp:
+            shutil.rmtree(tmp, ignore_errors=True)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+"""
+CalProTrack Payroll Engine Benchmark
+Times the NumPy payroll engine on a window of ~1M segments, phase by phase,
+and checks its hours against a plain per-segment Python implementation of the
+same overtime rules (which is also timed, for comparison).
+
+Run:
+    python bench_payroll.py                       # builds a throwaway 1M-segment dataset
+    python bench_payroll.py --segments 3000000
+    python bench_payroll.py --db big.db --days 40 # an existing database
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+import numpy as np
+
+from calprotrack_generate import generate
+from calprotrack_payroll import DEFAULT_RULES, EPOCH_WEEKDAY, load_segments, pay_hours, payroll
+from calprotrack_pool import open_connection, read_snapshot
+from calprotrack_time import utc_now, db_time, db_epoch
+
+SEGMENTS = 1_000_000
+RUNS = 5
+
+# Generated dataset: 20 companies x 100 shifts a day, ~2 segments per shift
+COMPANIES = 20
+SHIFTS_PER_DAY = 100
+SEGMENTS_PER_SHIFT = 2
+
+
+def reference_hours(users, sites, workdays, starts, ends, since, until, rules=DEFAULT_RULES):
+    """The same rules, one segment at a time: {(user, site): [regular, overtime, double]}"""
+    day_cap = min(rules.daily_overtime or float("inf"), rules.daily_double_time or float("inf"))
+    pieces = []
+    for user, site, workday, start, end in zip(users.tolist(), sites.tolist(), workdays.tolist(),
+                                               starts.tolist(), ends.tolist()):
+        end = min(end, until)
+        if start >= end:
+            continue
+        if start < since < end:
+            pieces.append((user, workday, start, since, site))
+            pieces.append((user, workday, since, end, site))
+        else:
+            pieces.append((user, workday, start, end, site))
+    pieces.sort()
+
+    totals = {}
+    day_key = week_key = None
+    day_hours = week_regular = 0.0
+    for user, workday, start, end, site in pieces:
+        if (user, workday) != day_key:
+            day_key, day_hours = (user, workday), 0.0
+        week = (workday + EPOCH_WEEKDAY) // 7
+        if (user, week) != week_key:
+            week_key, week_regular = (user, week), 0.0
+        hours = (end - start) / 3600
+        regular = max(0.0, min(day_hours + hours, day_cap) - min(day_hours, day_cap))
+        double = 0.0
+        if rules.daily_double_time:
+            double = max(0.0, day_hours + hours - max(day_hours, rules.daily_double_time))
+        overtime = hours - regular - double
+        day_hours += hours
+        if rules.weekly_overtime:
+            weekly = max(0.0, week_regular + regular - max(week_regular, rules.weekly_overtime))
+            week_regular += regular
+            regular -= weekly
+            overtime += weekly
+        if start >= since:
+            entry = totals.setdefault((user, site), [0.0, 0.0, 0.0])
+            entry[0] += regular
+            entry[1] += overtime
+            entry[2] += double
+    return totals
+
+
+def timed(fn, runs):
+    """(median ms, last result) of fn() over `runs` calls"""
+    timings = []
+    result = None
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), result
+
+
+def bench(path, days, runs):
+    conn = open_connection(path)
+    now = utc_now()
+    since, until, now_text = db_time(now - timedelta(days=days)), db_time(now), db_time(now)
+    since_s, until_s, now_s = db_epoch(since), db_epoch(until), db_epoch(now_text)
+
+    def load():
+        with read_snapshot(conn):
+            return load_segments(conn, since_s, until_s, now_s)
+
+    load_ms, arrays = timed(load, runs)
+    segments = len(arrays[0])
+    compute_ms, (user_ids, site_ids, hours) = timed(lambda: pay_hours(*arrays, since_s, until_s), runs)
+    report_ms, report = timed(lambda: payroll(conn, since, until, now_text, by_site=True), runs)
+
+    print(f"\n📦 {segments:,} segments loaded for a {days}-day window ({len(report):,} employees paid)")
+    print(f"   {'phase':<28} {'median ms':>10} {'segments/s':>14}")
+    for name, ms in (("load (SQL -> arrays)", load_ms), ("classify + aggregate", compute_ms),
+                     ("full report (by site)", report_ms)):
+        print(f"   {name:<28} {ms:>10.1f} {segments / (ms / 1000):>14,.0f}")
+
+    started = time.perf_counter()
+    expected = reference_hours(*arrays, since_s, until_s)
+    python_ms = (time.perf_counter() - started) * 1000
+    print(f"   {'per-segment Python (1 run)':<28} {python_ms:>10.1f} {segments / (python_ms / 1000):>14,.0f}")
+    print(f"   ⚡ classify + aggregate is {python_ms / compute_ms:.0f}x faster than the per-segment loop")
+
+    got = {(u, s): h for u, s, h in zip(user_ids.tolist(), site_ids.tolist(), hours.T.tolist())}
+    mismatches = [key for key in expected.keys() | got.keys()
+                  if not np.allclose(expected.get(key, [0, 0, 0]), got.get(key, [0, 0, 0]), atol=1e-6)]
+    conn.close()
+    if mismatches:
+        print(f"   ❌ {len(mismatches)} (user, site) pairs differ from the reference, e.g. {mismatches[:3]}")
+        return False
+    totals = hours.sum(axis=1)
+    print(f"   ✅ Matches the reference: {totals[0]:,.0f} regular, {totals[1]:,.0f} overtime, "
+          f"{totals[2]:,.0f} double-time hours")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the CalProTrack payroll engine")
+    parser.add_argument("--db", help="Benchmark this existing database instead of generating one")
+    parser.add_argument("--days", type=int, help="Window length in days (default: the whole generated history)")
+    parser.add_argument("--segments", type=int, default=SEGMENTS, help="Segments to generate (without --db)")
+    parser.add_argument("--runs", type=int, default=RUNS, help="Timed runs per phase")
+    args = parser.parse_args()
+
+    tmp = None
+    try:
+        path = args.db
+        days = args.days
+        if path is None:
+            tmp = tempfile.mkdtemp(prefix="calprotrack-payroll-")
+            path = os.path.join(tmp, "payroll.db")
+            history = max(1, args.segments // (COMPANIES * SHIFTS_PER_DAY * SEGMENTS_PER_SHIFT))
+            days = days or history
+            print(f"🏗️  Generating ~{args.segments:,} segments ({history} days)...")
+            generate(path, companies=COMPANIES, users=SHIFTS_PER_DAY, sites=25, days=history,
+                     shifts_per_day=SHIFTS_PER_DAY, drop_indexes=True, log=lambda *a: None)
+        ok = bench(path, days or 30, args.runs)
+    finally:
+        if tmp:
+            shutil.rmtree(tmp, ignore_errors=True)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
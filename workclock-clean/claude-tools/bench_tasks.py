@@ -0,0 +1,89 @@
+"""
+Task Store Benchmark
+Times the Task Manager's log-backed store (task_store.py) at scale: writing
+a million tasks, replaying the log on startup before and after compaction,
+and deleting a task - against the old in-memory list, whose delete
+renumbered every task after it.
+
+Run:
+    python bench_tasks.py                    # 1,000,000 tasks
+    python bench_tasks.py --tasks 200000
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from task_store import TaskStore
+
+TASKS = 1_000_000
+
+
+def seconds(fn):
+    started = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - started, result
+
+
+def list_delete(tasks, task_id):
+    """server.py's old delete: pop the list entry, then renumber every task"""
+    deleted = tasks.pop(task_id)
+    for i, task in enumerate(tasks):
+        task["id"] = i
+    return deleted
+
+
+def bench(path, count):
+    store = TaskStore(path)
+    write_s, _ = seconds(lambda: [store.create(f"Task {i}", "Generated by bench_tasks.py") for i in range(count)])
+    complete_s, _ = seconds(lambda: [store.complete(i) for i in range(0, count, 2)])
+    store.close()
+    size = os.path.getsize(path)
+    print(f"\n📝 {count:,} creates in {write_s:.1f}s ({count / write_s:,.0f}/s), "
+          f"{count // 2:,} completes in {complete_s:.1f}s")
+
+    replay_s, store = seconds(lambda: TaskStore(path))
+    print(f"   🔁 Replay {store.lines:,} lines ({size / 1e6:.0f} MB): {replay_s:.2f}s -> {len(store):,} tasks")
+
+    # Deleting three in four tasks leaves the log mostly dead lines; the store compacts itself
+    delete_s, _ = seconds(lambda: [store.delete(i) for i in range(count) if i % 4])
+    print(f"   🗑️  {count - len(store):,} deletes in {delete_s:.1f}s, compactions included")
+    timings = []
+    for task_id in range(0, count, max(4, count // 100 // 4 * 4)):
+        if store.get(task_id) is not None:
+            started = time.perf_counter()
+            store.delete(task_id)
+            timings.append((time.perf_counter() - started) * 1e6)
+    store.close()
+    size = os.path.getsize(path)
+
+    replay_s, store = seconds(lambda: TaskStore(path))
+    print(f"   🗜️  After deletes: replay {store.lines:,} lines ({size / 1e6:.0f} MB): {replay_s:.2f}s "
+          f"-> {len(store):,} tasks, next id {store.next_id:,}")
+    store.close()
+
+    tasks = [{"id": i, "title": f"Task {i}", "description": None, "done": False} for i in range(count)]
+    list_s, _ = seconds(lambda: list_delete(tasks, 0))
+    print(f"   🗑️  Delete one task: store {statistics.median(timings):.1f} µs (median), "
+          f"old list {list_s * 1e3:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Task Manager's log-backed task store")
+    parser.add_argument("--tasks", type=int, default=TASKS, help="Tasks to create")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="task-store-")
+    try:
+        bench(os.path.join(tmp, "tasks.log"), args.tasks)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,297 @@
+"""
+CalProTrack Activity Feed
+One background thread watches the database for clock-ins, clock-outs and
+site changes, and fans each batch of changes out to every /stream/activity
+subscriber. N dashboards cost one watcher instead of N pollers.
+
+The watcher checks PRAGMA data_version (which moves whenever another
+connection commits) and only then looks for:
+  - new shifts / segments: ids above the highest one it has seen
+  - closed shifts / segments: ids that were open last time and aren't now
+
+Other in-process consumers (see calprotrack_onsite.py) can register as
+listeners to get the same deltas, read in the same snapshot.
+"""
+
+import asyncio
+import json
+import threading
+import time
+
+from calprotrack_pool import open_connection
+
+POLL_INTERVAL = 1.0         # seconds between data_version checks
+KEEPALIVE_INTERVAL = 15.0   # seconds between SSE comments on a quiet stream
+MAX_PENDING = 256           # batches a subscriber may fall behind before it is dropped
+
+SHIFTS_SELECT = """
+    SELECT s.id, s.company_id, s.user_id, u.name as user_name, s.clock_in_at, s.clock_out_at
+    FROM shifts s
+    LEFT JOIN users u ON u.id = s.user_id
+"""
+
+SEGMENTS_SELECT = """
+    SELECT ss.id, ss.company_id, ss.shift_id, s.user_id, ss.job_site_id, js.name as site_name,
+           ss.start_at, ss.end_at
+    FROM shift_segments ss
+    JOIN shifts s ON s.id = ss.shift_id
+    LEFT JOIN job_sites js ON js.id = ss.job_site_id
+"""
+
+NEW_SHIFTS_QUERY = SHIFTS_SELECT + "WHERE s.id > ? ORDER BY s.id"
+NEW_SEGMENTS_QUERY = SEGMENTS_SELECT + "WHERE ss.id > ? ORDER BY ss.id"
+
+
+def _rows_by_id(conn, select, alias, ids):
+    """Rows of `select` for a set of ids, in id order"""
+    ids = sorted(ids)
+    marks = ",".join("?" * len(ids))
+    return conn.execute(f"{select}WHERE {alias}.id IN ({marks}) ORDER BY {alias}.id", ids).fetchall()
+
+
+def _shift_event(kind, row):
+    return {
+        "type": kind,
+        "shift_id": row["id"],
+        "company_id": row["company_id"],
+        "user_id": row["user_id"],
+        "user_name": row["user_name"],
+        "at": row["clock_in_at"] if kind == "clock_in" else row["clock_out_at"],
+    }
+
+
+def _segment_event(kind, row):
+    return {
+        "type": kind,
+        "segment_id": row["id"],
+        "shift_id": row["shift_id"],
+        "company_id": row["company_id"],
+        "user_id": row["user_id"],
+        "job_site_id": row["job_site_id"],
+        "site_name": row["site_name"],
+        "at": row["start_at"] if kind == "segment_start" else row["end_at"],
+    }
+
+
+class Subscriber:
+    """One SSE client: a queue of event batches, optionally limited to one company"""
+
+    def __init__(self, company_id=None):
+        self.company_id = company_id
+        self.queue = asyncio.Queue()
+
+    def wants(self, event):
+        return self.company_id is None or event["company_id"] == self.company_id
+
+
+class ActivityWatcher:
+    """Background thread that turns database changes into activity events"""
+
+    def __init__(self, db_path, interval=POLL_INTERVAL):
+        self.db_path = db_path
+        self.interval = interval
+        self.last_error = None
+        self._loop = None
+        self._subscribers = set()
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="activity-watcher", daemon=True)
+
+        # What the watcher has seen so far
+        self._data_version = None
+        self._max_shift_id = 0
+        self._max_segment_id = 0
+        self._open_shifts = set()
+        self._open_segments = set()
+
+        # Metrics
+        self._sequence = 0
+        self._events = 0
+        self._peak_subscribers = 0
+        self._dropped = 0
+        self._deliveries = 0
+        self._total_latency = 0.0
+        self._max_latency = 0.0
+
+    # ---- lifecycle (event loop side) ----
+
+    def start(self, loop):
+        self._loop = loop
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout=5)
+
+    def add_listener(self, listener):
+        """
+        Feed database changes to `listener` on the watcher thread
+
+        listener.seed(conn) is called when the watcher (re)starts and
+        listener.update(conn, events) whenever data_version moves, both inside
+        the read transaction the watcher used, so they see exactly its snapshot.
+        """
+        self._listeners.append(listener)
+
+    def subscribe(self, company_id=None):
+        subscriber = Subscriber(company_id)
+        with self._lock:
+            self._subscribers.add(subscriber)
+            self._peak_subscribers = max(self._peak_subscribers, len(self._subscribers))
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def delivered(self, detected_at):
+        """Called by a subscriber after writing a batch, to track fan-out latency"""
+        latency = time.perf_counter() - detected_at
+        with self._lock:
+            self._deliveries += 1
+            self._total_latency += latency
+            self._max_latency = max(self._max_latency, latency)
+
+    # ---- watcher thread ----
+
+    def _run(self):
+        conn = None
+        while not self._stop.is_set():
+            try:
+                if conn is None:
+                    conn = open_connection(self.db_path)
+                    self._seed(conn)
+                events = self._poll(conn)
+                if events:
+                    self._publish(events)
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                if conn is not None:
+                    conn.close()
+                    conn = None
+            self._stop.wait(self.interval)
+        if conn is not None:
+            conn.close()
+
+    def _seed(self, conn):
+        """Start from the current state without emitting anything for it"""
+        self._data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        conn.execute("BEGIN")
+        try:
+            self._max_shift_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM shifts").fetchone()[0]
+            self._max_segment_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM shift_segments").fetchone()[0]
+            self._open_shifts = {row[0] for row in conn.execute("SELECT id FROM shifts WHERE clock_out_at IS NULL")}
+            self._open_segments = {row[0] for row in conn.execute("SELECT id FROM shift_segments WHERE end_at IS NULL")}
+            for listener in self._listeners:
+                listener.seed(conn)
+        finally:
+            conn.commit()
+
+    def _poll(self, conn):
+        """Events for everything that changed since the last poll"""
+        version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._data_version:
+            return []
+        self._data_version = version
+
+        events = []
+        conn.execute("BEGIN")
+        try:
+            # Closes first: a shift opened and closed between polls is handled below
+            open_shifts = {row[0] for row in conn.execute("SELECT id FROM shifts WHERE clock_out_at IS NULL")}
+            closed = self._open_shifts - open_shifts
+            open_segments = {row[0] for row in conn.execute("SELECT id FROM shift_segments WHERE end_at IS NULL")}
+            ended = self._open_segments - open_segments
+
+            if ended:
+                rows = _rows_by_id(conn, SEGMENTS_SELECT, "ss", ended)
+                events.extend(_segment_event("segment_end", row) for row in rows if row["end_at"] is not None)
+            if closed:
+                rows = _rows_by_id(conn, SHIFTS_SELECT, "s", closed)
+                events.extend(_shift_event("clock_out", row) for row in rows if row["clock_out_at"] is not None)
+
+            for row in conn.execute(NEW_SHIFTS_QUERY, (self._max_shift_id,)).fetchall():
+                events.append(_shift_event("clock_in", row))
+                if row["clock_out_at"] is not None:
+                    events.append(_shift_event("clock_out", row))
+                self._max_shift_id = row["id"]
+            for row in conn.execute(NEW_SEGMENTS_QUERY, (self._max_segment_id,)).fetchall():
+                events.append(_segment_event("segment_start", row))
+                if row["end_at"] is not None:
+                    events.append(_segment_event("segment_end", row))
+                self._max_segment_id = row["id"]
+
+            for listener in self._listeners:
+                listener.update(conn, events)
+        finally:
+            conn.commit()
+
+        self._open_shifts = open_shifts
+        self._open_segments = open_segments
+        return events
+
+    def _publish(self, events):
+        detected_at = time.perf_counter()
+        with self._lock:
+            self._events += len(events)
+            self._sequence += 1
+            sequence = self._sequence
+        # One hop onto the event loop per batch, however many subscribers there are
+        self._loop.call_soon_threadsafe(self._fan_out, sequence, events, detected_at)
+
+    def _fan_out(self, sequence, events, detected_at):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            batch = [event for event in events if subscriber.wants(event)]
+            if not batch:
+                continue
+            if subscriber.queue.qsize() >= MAX_PENDING:
+                # Too far behind: end its stream so the client reconnects fresh
+                self.unsubscribe(subscriber)
+                with self._lock:
+                    self._dropped += 1
+                while not subscriber.queue.empty():
+                    subscriber.queue.get_nowait()
+                subscriber.queue.put_nowait(None)
+                continue
+            subscriber.queue.put_nowait((sequence, batch, detected_at))
+
+    def stats(self):
+        """Subscriber count and fan-out latency"""
+        with self._lock:
+            return {
+                "subscribers": len(self._subscribers),
+                "peak_subscribers": self._peak_subscribers,
+                "dropped_subscribers": self._dropped,
+                "batches": self._sequence,
+                "events": self._events,
+                "deliveries": self._deliveries,
+                "avg_fan_out_ms": round(self._total_latency / self._deliveries * 1000, 3) if self._deliveries else 0,
+                "max_fan_out_ms": round(self._max_latency * 1000, 3),
+                "last_error": self.last_error,
+            }
+
+
+async def sse_stream(watcher, company_id=None, keepalive=KEEPALIVE_INTERVAL):
+    """Server-Sent Events body for one subscriber"""
+    subscriber = watcher.subscribe(company_id)
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                item = await asyncio.wait_for(subscriber.queue.get(), timeout=keepalive)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if item is None:
+                yield "event: lagged\ndata: {}\n\n"
+                return
+            sequence, batch, detected_at = item
+            yield f"id: {sequence}\nevent: activity\ndata: {json.dumps(batch)}\n\n"
+            watcher.delivered(detected_at)
+    finally:
+        watcher.unsubscribe(subscriber)
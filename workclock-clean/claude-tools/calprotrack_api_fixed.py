@@ -1,12 +1,106 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Depends, Request
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from starlette.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, ValidationError
 from typing import List, Optional
 from datetime import datetime, timedelta
+from contextlib import asynccontextmanager
+import asyncio
+import functools
 import sqlite3
-import os
 
-app = FastAPI(title="CalProTrack API", description="API to manage your time tracking business")
+from calprotrack_config import DATABASE_PATH, REPORT_SNAPSHOT_PATH, COLUMNAR_DIR, EXPORT_POOL_SIZE, EXPORT_POOL_TIMEOUT
+from calprotrack_pool import ConnectionPool, PoolTimeout, DatabaseUnavailable, read_snapshot
+from calprotrack_migrations import run_migrations
+from calprotrack_time import utc_now, db_time, db_epoch, since_days, day_start, day_window, ceil_day, epoch_params
+from calprotrack_rollup import RollupRefresher, rollup_window
+from calprotrack_cache import response_cache, cached
+from calprotrack_executor import DBLanes, QueryTimeout
+from calprotrack_export import export_shifts, CONTENT_TYPES
+from calprotrack_paging import keyset_page, check_limit, parse_fields, etag_for, etag_response
+from calprotrack_tenants import tenant_metrics
+from calprotrack_activity import ActivityWatcher, sse_stream
+from calprotrack_onsite import OnSiteState
+from calprotrack_profiling import query_profiler, current_endpoint
+from calprotrack_timing import TimedRoute, RequestTimingMiddleware, request_metrics, slow_request_profiler
+from calprotrack_json import model_query, model_response, check_model_queries
+from calprotrack_snapshot import ReportSnapshot
+from calprotrack_payroll import payroll
+from calprotrack_archive import ArchiveError, archive_snapshot, archive_dir_for
+from calprotrack_columnar import ColumnarStore, ColumnarRefresher, user_rates
+
+# Path to your CalProTrack database (DATABASE_PATH, the same setting db.js reads)
+DB_PATH = DATABASE_PATH
+# Per-month history files moved out of it by calprotrack_archive.py
+ARCHIVE_DIR = archive_dir_for(DB_PATH)
+# Longest report window (in days) /batch actions and payroll windows accept
+MAX_REPORT_DAYS = 366
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Migrate the database, then open the pools and lanes and start the background refreshers"""
+    try:
+        applied = run_migrations(DB_PATH)
+        if applied:
+            print(f"🛠️  Applied migrations: {', '.join(applied)}")
+    except sqlite3.OperationalError as e:
+        print(f"⚠️  Skipping migrations: {e}")
+    app.state.db_pool = ConnectionPool(DB_PATH)
+    app.state.export_pool = ConnectionPool(DB_PATH, size=EXPORT_POOL_SIZE, timeout=EXPORT_POOL_TIMEOUT)
+    try:
+        with app.state.db_pool.connection() as conn:
+            check_model_queries(conn)
+    except (sqlite3.OperationalError, DatabaseUnavailable) as e:
+        print(f"⚠️  Skipping response schema check: {e}")
+    app.state.snapshot = None
+    if REPORT_SNAPSHOT_PATH:
+        snapshot = ReportSnapshot(DB_PATH, REPORT_SNAPSHOT_PATH)
+        try:
+            snapshot.ensure()
+            snapshot.pool = ConnectionPool(snapshot.path, immutable=True)
+            snapshot.start()
+            app.state.snapshot = snapshot
+            print(f"📸 Payroll and hours reports read the snapshot at {REPORT_SNAPSHOT_PATH}")
+        except (sqlite3.Error, OSError) as e:
+            print(f"⚠️  Report snapshot unavailable, reports read the live database: {e}")
+    snapshot_pool = app.state.snapshot.pool if app.state.snapshot is not None else None
+    app.state.db_lanes = DBLanes(app.state.db_pool, snapshot_pool=snapshot_pool)
+    app.state.rollup = RollupRefresher(DB_PATH)
+    app.state.rollup.start()
+    app.state.columnar = None
+    if COLUMNAR_DIR:
+        # Built in the background on first start; /analytics answers 503 until then
+        app.state.columnar = ColumnarRefresher(DB_PATH, ColumnarStore(COLUMNAR_DIR).open(), archive_dir=ARCHIVE_DIR)
+        app.state.columnar.start()
+        print(f"🧮 Analytics read the columnar store in {COLUMNAR_DIR}")
+    response_cache.open(DB_PATH)
+    app.state.onsite = OnSiteState()
+    app.state.activity = ActivityWatcher(DB_PATH)
+    app.state.activity.add_listener(app.state.onsite)
+    app.state.activity.start(asyncio.get_running_loop())
+    yield
+    app.state.activity.stop()
+    response_cache.close()
+    if app.state.columnar is not None:
+        app.state.columnar.stop()
+    app.state.rollup.stop()
+    app.state.db_lanes.shutdown()
+    if app.state.snapshot is not None:
+        app.state.snapshot.stop()
+        app.state.snapshot.pool.close()
+    app.state.export_pool.close()
+    app.state.db_pool.close()
+
+async def tag_endpoint(request: Request):
+    """Label this request's SQL with its route, for query profiling (/metrics)"""
+    current_endpoint.set(request.scope["route"].path)
+
+app = FastAPI(title="CalProTrack API", description="API to manage your time tracking business", lifespan=lifespan,
+              dependencies=[Depends(tag_endpoint)])
+# Routes report their validation/serialization time; the middleware adds Server-Timing
+app.router.route_class = TimedRoute
+app.add_middleware(RequestTimingMiddleware)
 
 # Enable CORS so your website can call this API
 app.add_middleware(
@@ -17,18 +111,59 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Path to your CalProTrack database
-DB_PATH = "../develper/fieldtrack.db"
+def get_lanes(request: Request):
+    """The DB lanes endpoints hand their queries to"""
+    return request.app.state.db_lanes
 
-def get_db():
-    """Connect to the CalProTrack database"""
-    if not os.path.exists(DB_PATH):
-        raise HTTPException(status_code=500, detail=f"Database not found at {DB_PATH}")
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row  # Return rows as dictionaries
-    return conn
+def check_company(conn, company_id):
+    """404 unless the company exists"""
+    if conn.execute("SELECT 1 FROM companies WHERE id = ?", (company_id,)).fetchone() is None:
+        raise HTTPException(status_code=404, detail=f"Company {company_id} not found")
+
+def get_onsite(request: Request):
+    """The in-memory on-site state, or None until the activity watcher has seeded it"""
+    onsite = request.app.state.onsite
+    return onsite if onsite.ready else None
+
+def check_onsite_company(onsite, company_id):
+    """404 unless the company exists, answered from the on-site state"""
+    if not onsite.has_company(company_id):
+        raise HTTPException(status_code=404, detail=f"Company {company_id} not found")
+
+def get_columnar(request: Request):
+    """The columnar analytics store; 503 until it is configured and built"""
+    refresher = request.app.state.columnar
+    if refresher is None:
+        raise HTTPException(status_code=503, detail="Analytics need the columnar store: set CALPROTRACK_COLUMNAR_DIR")
+    if not refresher.store.ready:
+        raise HTTPException(status_code=503, detail="The columnar store is still being built")
+    return refresher.store
+
+async def run_for_company(lane, company_id, endpoint, fn, *args):
+    """Run fn(conn, *args, company_id=...) in `lane`, recording its query time against the tenant"""
+    def fetch(conn, *args):
+        check_company(conn, company_id)
+        return fn(conn, *args, company_id=company_id)
+    return await lane.run(tenant_metrics.timed(company_id, endpoint, fetch), *args)
+
+@app.exception_handler(DatabaseUnavailable)
+async def database_unavailable(request: Request, exc: DatabaseUnavailable):
+    return JSONResponse(status_code=500, content={"detail": str(exc)})
+
+@app.exception_handler(PoolTimeout)
+async def pool_timeout(request: Request, exc: PoolTimeout):
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
+
+@app.exception_handler(QueryTimeout)
+async def query_timeout(request: Request, exc: QueryTimeout):
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
+
+@app.exception_handler(ArchiveError)
+async def archive_error(request: Request, exc: ArchiveError):
+    return JSONResponse(status_code=400, content={"detail": str(exc)})
 
-# Pydantic models for response validation
+# Pydantic models for the API docs. Report rows are checked against them once,
+# at startup (calprotrack_json.check_model_queries), not on every response.
 class ActiveEmployee(BaseModel):
     user_id: int
     name: str
@@ -49,7 +184,7 @@ class PayrollEntry(BaseModel):
 class SiteBusyness(BaseModel):
     site_id: int
     site_name: str
-    site_address: str
+    site_address: Optional[str]
     active_employees: int
     total_hours_today: float
 
@@ -61,163 +196,289 @@ class EmployeeHours(BaseModel):
     total_pay: float
     shift_count: int
 
+class SitePay(BaseModel):
+    site_id: int
+    site_name: str
+    regular_hours: float
+    overtime_hours: float
+    double_time_hours: float
+    total_hours: float
+    total_pay: float
+
+class PayrollDetail(BaseModel):
+    user_id: int
+    name: str
+    email: str
+    hourly_rate: float
+    regular_hours: float
+    overtime_hours: float
+    double_time_hours: float
+    total_hours: float
+    total_pay: float
+    sites: Optional[List[SitePay]] = None
+
+class AnalyticsTotal(BaseModel):
+    id: int
+    name: str
+    total_hours: float
+    total_pay: float
+    segment_count: int
+
+class TrendPoint(BaseModel):
+    date: str
+    total_hours: float
+    segment_count: int
+
+class BatchAction(BaseModel):
+    action: str
+    parameters: dict = {}
+
+class BatchRequest(BaseModel):
+    actions: List[BatchAction]
+    company_id: Optional[int] = None
+
 # ==================== ENDPOINTS ====================
 
-@app.get("/")
-def root():
-    """Check if API is running"""
-    conn = get_db()
+# Every query below comes in two variants: across all companies, and scoped to
+# one company (the /companies/{company_id}/... endpoints). Scoped variants lead
+# each WHERE clause with company_id so they seek on the (company_id, ...) indexes.
+def company_filter(scoped, column="company_id"):
+    """`column = :company_id AND ` for a tenant-scoped query, nothing otherwise"""
+    return f"{column} = :company_id AND " if scoped else ""
+
+# Shared by / and /today so "currently clocked in" is defined in one place
+def open_shifts_count(scoped=False):
+    return f"(SELECT COUNT(*) FROM shifts WHERE {company_filter(scoped)}clock_out_at IS NULL)"
+
+def root_stats_query(scoped=False):
+    return f"""
+    SELECT
+        (SELECT COUNT(*) FROM users WHERE {company_filter(scoped)}is_active = 1) as active_users,
+        (SELECT COUNT(*) FROM job_sites WHERE {company_filter(scoped)}is_active = 1) as active_sites,
+        {open_shifts_count(scoped)} as currently_clocked_in
+"""
+
+ROOT_STATS_QUERY = root_stats_query()
+COMPANY_ROOT_STATS_QUERY = root_stats_query(scoped=True)
+
+def fetch_root_stats(conn, company_id=None):
+    """Headline counts for the / health check"""
     cursor = conn.cursor()
     
     # Get some stats
-    cursor.execute("SELECT COUNT(*) as count FROM users WHERE is_active = 1")
-    active_users = cursor.fetchone()['count']
-    
-    cursor.execute("SELECT COUNT(*) as count FROM job_sites WHERE is_active = 1")
-    active_sites = cursor.fetchone()['count']
-    
-    cursor.execute("""
-        SELECT COUNT(*) as count 
-        FROM shifts 
-        WHERE clock_out_at IS NULL
-    """)
-    currently_clocked_in = cursor.fetchone()['count']
-    
-    conn.close()
+    if company_id is None:
+        cursor.execute(ROOT_STATS_QUERY)
+    else:
+        cursor.execute(COMPANY_ROOT_STATS_QUERY, {"company_id": company_id})
+    stats = cursor.fetchone()
     
+    return root_payload({
+        "active_employees": stats['active_users'],
+        "active_sites": stats['active_sites'],
+        "currently_clocked_in": stats['currently_clocked_in']
+    })
+
+def root_payload(stats):
     return {
         "message": "CalProTrack API is running!",
-        "stats": {
-            "active_employees": active_users,
-            "active_sites": active_sites,
-            "currently_clocked_in": currently_clocked_in
-        }
+        "stats": stats
     }
 
-@app.get("/active", response_model=List[ActiveEmployee])
-def get_active_employees():
-    """Get all employees currently clocked in"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # First get active shifts
-    query = """
+@app.get("/")
+async def root(lanes: DBLanes = Depends(get_lanes), onsite: OnSiteState = Depends(get_onsite)):
+    """Check if API is running"""
+    if onsite is not None:
+        return root_payload(onsite.root_stats())
+    return await lanes.status.run(fetch_root_stats)
+
+# One query: open shifts joined to the site of their most recent open segment.
+# The segment lookup runs inside SQLite on idx_segments_shift, so there is
+# no extra round trip per clocked-in employee.
+def active_employees_query(scoped=False):
+    return f"""
         SELECT 
             u.id as user_id,
             u.name,
             u.email,
-            s.id as shift_id,
+            js.name as site_name,
+            COALESCE(NULLIF(js.address, ''), 'No address') as site_address,
             s.clock_in_at as clocked_in_at,
-            ROUND((julianday('now') - julianday(s.clock_in_at)) * 24, 2) as hours_today
+            ROUND((strftime('%s', 'now') - s.clock_in_epoch) / 3600.0, 2) as hours_today
         FROM shifts s
         JOIN users u ON s.user_id = u.id
-        WHERE s.clock_out_at IS NULL
+        JOIN shift_segments ss ON ss.id = (
+            SELECT id
+            FROM shift_segments
+            WHERE shift_id = s.id AND end_at IS NULL
+            ORDER BY start_at DESC
+            LIMIT 1
+        )
+        JOIN job_sites js ON ss.job_site_id = js.id
+        WHERE {company_filter(scoped, "s.company_id")}s.clock_out_at IS NULL
         ORDER BY s.clock_in_at DESC
     """
+
+ACTIVE_EMPLOYEES_QUERY = model_query(ActiveEmployee, active_employees_query())
+COMPANY_ACTIVE_EMPLOYEES_QUERY = model_query(ActiveEmployee, active_employees_query(scoped=True))
+
+def fetch_active_employees(conn, company_id=None):
+    """Open shifts with the site each employee is on now"""
+    cursor = conn.cursor()
     
-    cursor.execute(query)
-    shifts = cursor.fetchall()
-    
-    results = []
-    for shift in shifts:
-        # Get current site from most recent segment
-        cursor.execute("""
-            SELECT js.name as site_name, js.address as site_address
-            FROM shift_segments ss
-            JOIN job_sites js ON ss.job_site_id = js.id
-            WHERE ss.shift_id = ? AND ss.end_at IS NULL
-            ORDER BY ss.start_at DESC
-            LIMIT 1
-        """, (shift['shift_id'],))
-        
-        site = cursor.fetchone()
-        if site:
-            results.append({
-                'user_id': shift['user_id'],
-                'name': shift['name'],
-                'email': shift['email'],
-                'site_name': site['site_name'],
-                'site_address': site['site_address'] or 'No address',
-                'clocked_in_at': shift['clocked_in_at'],
-                'hours_today': shift['hours_today']
-            })
+    if company_id is None:
+        cursor.execute(ACTIVE_EMPLOYEES_QUERY)
+    else:
+        cursor.execute(COMPANY_ACTIVE_EMPLOYEES_QUERY, {"company_id": company_id})
+    rows = cursor.fetchall()
     
-    conn.close()
-    return results
+    return [dict(row) for row in rows]
 
-@app.get("/payroll", response_model=List[PayrollEntry])
-def get_payroll(days: int = 7):
+@app.get("/active", response_model=List[ActiveEmployee])
+async def get_active_employees(lanes: DBLanes = Depends(get_lanes), onsite: OnSiteState = Depends(get_onsite)):
+    """Get all employees currently clocked in"""
+    if onsite is not None:
+        return model_response(List[ActiveEmployee], onsite.active_employees())
+    return model_response(List[ActiveEmployee], await lanes.status.run(fetch_active_employees))
+
+def window_totals(row_filter="", archives=()):
     """
-    Get payroll summary for the last N days
-    Default: 7 days (last week)
+    CTEs giving hours and shift count per user for a report window
+
+    `row_filter` is an "... AND" prefix applied to both shifts and rollup rows,
+    so it may only use columns they share (user_id, company_id).
+
+    Closed days come from daily_user_site_rollup; the partial first day, the
+    days after the rollup and shifts that were still open at its last refresh
+    are aggregated live. Parameters come from calprotrack_rollup.rollup_window.
+    The live part reads the integer *_epoch columns, so each shift's hours are
+    one subtraction instead of two julianday() text parses.
+
+    `archives` are attached archive months (calprotrack_archive) holding part
+    of the partial first day; everything else they hold is in the rollup.
+    """
+    archived = "".join(f"""
+        UNION ALL
+        SELECT user_id, clock_in_epoch, clock_out_epoch FROM {schema}.shifts
+        WHERE {row_filter}clock_in_epoch >= :since_epoch AND clock_in_epoch < :rollup_start_epoch"""
+        for schema in archives)
+    return f"""
+    live AS (
+        SELECT user_id, clock_in_epoch, clock_out_epoch FROM shifts
+        WHERE {row_filter}clock_in_epoch >= :since_epoch AND clock_in_epoch < :rollup_start_epoch
+        UNION ALL
+        SELECT user_id, clock_in_epoch, clock_out_epoch FROM shifts
+        WHERE {row_filter}clock_in_epoch >= :rollup_end_epoch
+        UNION ALL
+        SELECT user_id, clock_in_epoch, clock_out_epoch FROM shifts
+        WHERE {row_filter}clock_out_epoch IS NULL
+          AND clock_in_epoch >= :rollup_start_epoch AND clock_in_epoch < :rollup_end_epoch
+        UNION ALL
+        SELECT user_id, clock_in_epoch, clock_out_epoch FROM shifts
+        WHERE {row_filter}clock_out_epoch >= :watermark_epoch
+          -- unary + keeps SQLite seeking on clock_out: few shifts closed since the watermark
+          AND +clock_in_epoch >= :rollup_start_epoch AND +clock_in_epoch < :rollup_end_epoch{archived}
+    ),
+    totals AS (
+        SELECT user_id, SUM(hours) as hours, SUM(shifts) as shift_count
+        FROM (
+            SELECT 
+                user_id,
+                (COALESCE(clock_out_epoch, :now_epoch) - clock_in_epoch) / 3600.0 as hours,
+                1 as shifts
+            FROM live
+            UNION ALL
+            SELECT user_id, hours, shift_count
+            FROM daily_user_site_rollup
+            WHERE {row_filter}day >= :rollup_start_day AND day < :rollup_end_day
+        )
+        GROUP BY user_id
+    )
+    """
+
+@functools.lru_cache(maxsize=64)
+def payroll_query(scoped=False, archives=()):
+    return f"""
+    WITH {window_totals(company_filter(scoped), archives)}
+    SELECT 
+        u.id as user_id,
+        u.name,
+        u.email,
+        u.hourly_rate,
+        ROUND(t.hours, 2) as total_hours,
+        ROUND(t.hours * u.hourly_rate, 2) as total_pay
+    FROM totals t
+    JOIN users u ON t.user_id = u.id
+    ORDER BY total_hours DESC
+"""
+
+PAYROLL_QUERY = model_query(PayrollEntry, payroll_query())
+COMPANY_PAYROLL_QUERY = model_query(PayrollEntry, payroll_query(scoped=True))
+
+def first_day_archives(conn, since):
     """
-    conn = get_db()
+    archive_snapshot() for a report window starting at `since`: the only
+    archived rows window_totals can need are those of its partial first day
+    """
+    return archive_snapshot(conn, ARCHIVE_DIR, [(since, ceil_day(since))])
+
+def fetch_payroll(conn, days, company_id=None):
+    """Hours and pay per employee for the last N days"""
     cursor = conn.cursor()
     
-    query = """
-        SELECT 
-            u.id as user_id,
-            u.name,
-            u.email,
-            u.hourly_rate,
-            ROUND(SUM(
-                (julianday(COALESCE(s.clock_out_at, datetime('now'))) - 
-                 julianday(s.clock_in_at)) * 24
-            ), 2) as total_hours,
-            ROUND(SUM(
-                (julianday(COALESCE(s.clock_out_at, datetime('now'))) - 
-                 julianday(s.clock_in_at)) * 24 * u.hourly_rate
-            ), 2) as total_pay
-        FROM shifts s
-        JOIN users u ON s.user_id = u.id
-        WHERE s.clock_in_at >= datetime('now', '-' || ? || ' days')
-        GROUP BY u.id, u.name, u.email, u.hourly_rate
-        ORDER BY total_hours DESC
-    """
+    now = utc_now()
+    since = since_days(days, now)
     
-    cursor.execute(query, (days,))
-    rows = cursor.fetchall()
-    conn.close()
+    # Read the rollup state and rows from one snapshot
+    with first_day_archives(conn, since) as archives:
+        params = rollup_window(conn, since, db_time(now))
+        cursor.execute(payroll_query(company_id is not None, tuple(archives)), {**params, "company_id": company_id})
+        rows = cursor.fetchall()
     
     return [dict(row) for row in rows]
 
-@app.get("/employee/{user_id}/hours", response_model=EmployeeHours)
-def get_employee_hours(user_id: int, days: int = 30):
-    """Get hours worked for a specific employee"""
-    conn = get_db()
+@app.get("/payroll", response_model=List[PayrollEntry])
+async def get_payroll(days: int = 7, lanes: DBLanes = Depends(get_lanes)):
+    """
+    Get payroll summary for the last N days
+    Default: 7 days (last week)
+    """
+    return model_response(List[PayrollEntry], await lanes.history.run(fetch_payroll, days))
+
+@functools.lru_cache(maxsize=64)
+def employee_hours_query(archives=()):
+    return f"""
+    WITH {window_totals("user_id = :user_id AND ", archives)}
+    SELECT 
+        u.id as user_id,
+        u.name,
+        u.email,
+        ROUND(t.hours, 2) as total_hours,
+        ROUND(t.hours * u.hourly_rate, 2) as total_pay,
+        t.shift_count
+    FROM totals t
+    JOIN users u ON t.user_id = u.id
+"""
+
+EMPLOYEE_HOURS_QUERY = model_query(EmployeeHours, employee_hours_query())
+
+def fetch_employee_hours(conn, user_id, days, company_id=None):
+    """Hours, pay and shift count for one employee over the last N days"""
     cursor = conn.cursor()
     
-    # Check if user exists
+    # Check if user exists (in this company, for the scoped endpoint). A user's
+    # shifts all belong to their company, so the query itself needs no tenant filter.
     cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
     user = cursor.fetchone()
-    if not user:
-        conn.close()
+    if not user or (company_id is not None and user['company_id'] != company_id):
         raise HTTPException(status_code=404, detail=f"Employee {user_id} not found")
     
-    query = """
-        SELECT 
-            u.id as user_id,
-            u.name,
-            u.email,
-            ROUND(SUM(
-                (julianday(COALESCE(s.clock_out_at, datetime('now'))) - 
-                 julianday(s.clock_in_at)) * 24
-            ), 2) as total_hours,
-            ROUND(SUM(
-                (julianday(COALESCE(s.clock_out_at, datetime('now'))) - 
-                 julianday(s.clock_in_at)) * 24 * u.hourly_rate
-            ), 2) as total_pay,
-            COUNT(s.id) as shift_count
-        FROM shifts s
-        JOIN users u ON s.user_id = u.id
-        WHERE u.id = ?
-          AND s.clock_in_at >= datetime('now', '-' || ? || ' days')
-        GROUP BY u.id, u.name, u.email
-    """
+    now = utc_now()
+    since = since_days(days, now)
     
-    cursor.execute(query, (user_id, days))
-    row = cursor.fetchone()
-    conn.close()
+    with first_day_archives(conn, since) as archives:
+        params = rollup_window(conn, since, db_time(now))
+        cursor.execute(employee_hours_query(tuple(archives)), {**params, "user_id": user_id})
+        row = cursor.fetchone()
     
     if row and row['total_hours'] is not None:
         return dict(row)
@@ -227,140 +488,609 @@ def get_employee_hours(user_id: int, days: int = 30):
             "user_id": user['id'],
             "name": user['name'],
             "email": user['email'],
-            "total_hours": 0,
-            "total_pay": 0,
+            "total_hours": 0.0,
+            "total_pay": 0.0,
             "shift_count": 0
         }
 
-@app.get("/sites/busy", response_model=List[SiteBusyness])
-def get_busy_sites():
-    """Get sites ranked by current activity and hours worked today"""
-    conn = get_db()
-    cursor = conn.cursor()
+@app.get("/employee/{user_id}/hours", response_model=EmployeeHours)
+async def get_employee_hours(user_id: int, days: int = 30, lanes: DBLanes = Depends(get_lanes)):
+    """Get hours worked for a specific employee"""
+    return model_response(EmployeeHours, await lanes.history.run(fetch_employee_hours, user_id, days))
+
+# ---- Payroll engine: segment-accurate pay with overtime (calprotrack_payroll) ----
+
+def check_days(days):
+    if not 1 <= days <= MAX_REPORT_DAYS:
+        raise HTTPException(status_code=400, detail=f"days must be between 1 and {MAX_REPORT_DAYS}")
+
+def payroll_window(days, start=None, end=None):
+    """(since, until, now) for a payroll request: the last N days, or whole UTC days from start through end"""
+    now = utc_now()
+    if start is None:
+        check_days(days)
+        return since_days(days, now), db_time(now), db_time(now)
+    try:
+        first_day = datetime.strptime(start, "%Y-%m-%d")
+        last_day = datetime.strptime(end, "%Y-%m-%d") if end else day_start(now)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start and end must be dates like 2024-01-31")
+    if first_day > last_day:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    if (last_day - first_day).days >= MAX_REPORT_DAYS:
+        raise HTTPException(status_code=400, detail=f"start through end can cover at most {MAX_REPORT_DAYS} days")
+    return db_time(first_day), db_time(min(last_day + timedelta(days=1), now)), db_time(now)
+
+def fetch_payroll_detail(conn, window, by_site, company_id=None):
+    """Regular, overtime and double-time hours and pay per employee"""
+    return payroll(conn, *window, company_id=company_id, by_site=by_site, archive_dir=ARCHIVE_DIR)
+
+def fetch_employee_payroll(conn, user_id, window, company_id=None):
+    """One employee's payroll entry, with hours per job site"""
+    user = conn.execute("SELECT id, name, email, hourly_rate, company_id FROM users WHERE id = ?", (user_id,)).fetchone()
+    if not user or (company_id is not None and user['company_id'] != company_id):
+        raise HTTPException(status_code=404, detail=f"Employee {user_id} not found")
     
-    query = """
-        SELECT 
-            js.id as site_id,
-            js.name as site_name,
-            js.address as site_address,
-            COUNT(DISTINCT CASE 
-                WHEN ss.end_at IS NULL AND s.clock_out_at IS NULL THEN s.user_id 
-            END) as active_employees,
-            ROUND(SUM(
-                CASE 
-                    WHEN date(ss.start_at) = date('now')
-                    THEN (julianday(COALESCE(ss.end_at, datetime('now'))) - 
-                          julianday(ss.start_at)) * 24
-                    ELSE 0
-                END
-            ), 2) as total_hours_today
-        FROM job_sites js
-        LEFT JOIN shift_segments ss ON js.id = ss.job_site_id
-        LEFT JOIN shifts s ON ss.shift_id = s.id
-        WHERE js.is_active = 1
-        GROUP BY js.id, js.name, js.address
-        ORDER BY active_employees DESC, total_hours_today DESC
+    entries = payroll(conn, *window, user_id=user_id, by_site=True, archive_dir=ARCHIVE_DIR)
+    if entries:
+        return entries[0]
+    # User exists but worked no hours in this period
+    return {
+        "user_id": user['id'],
+        "name": user['name'],
+        "email": user['email'],
+        "hourly_rate": user['hourly_rate'],
+        "regular_hours": 0.0,
+        "overtime_hours": 0.0,
+        "double_time_hours": 0.0,
+        "total_hours": 0.0,
+        "total_pay": 0.0,
+        "sites": []
+    }
+
+@app.get("/payroll/detailed", response_model=List[PayrollDetail])
+async def get_payroll_detail(days: int = 7, start: Optional[str] = None, end: Optional[str] = None,
+                             by_site: bool = False, lanes: DBLanes = Depends(get_lanes)):
+    """
+    Get segment-accurate payroll with daily/weekly overtime and double time
+    The last N days by default, or whole UTC days from start through end (YYYY-MM-DD).
+    by_site=true adds each employee's hours and pay per job site.
+    """
+    window = payroll_window(days, start, end)
+    return model_response(List[PayrollDetail], await lanes.history.run(fetch_payroll_detail, window, by_site))
+
+@app.get("/employee/{user_id}/payroll", response_model=PayrollDetail)
+async def get_employee_payroll(user_id: int, days: int = 7, start: Optional[str] = None, end: Optional[str] = None,
+                               lanes: DBLanes = Depends(get_lanes)):
+    """Get one employee's segment-accurate payroll, per job site (window as /payroll/detailed)"""
+    window = payroll_window(days, start, end)
+    return model_response(PayrollDetail, await lanes.history.run(fetch_employee_payroll, user_id, window))
+
+# ---- Long-range analytics from the columnar store (calprotrack_columnar) ----
+# Segments count in the window their start falls in; the store lags the live
+# data by up to CALPROTRACK_COLUMNAR_INTERVAL and holds closed segments only.
+
+ANALYTICS_GROUPS = {"user": "users", "site": "job_sites"}
+TREND_BUCKETS = {"day": 1, "week": 7}
+
+def fetch_analytics_totals(conn, store, window, group, company_id=None):
+    """Hours, straight-time pay and segment count per employee or job site"""
+    since, until, _ = window
+    scope = " WHERE company_id = ?" if company_id is not None else ""
+    names = dict(conn.execute(f"SELECT id, name FROM {ANALYTICS_GROUPS[group]}{scope}",
+                              () if company_id is None else (company_id,)).fetchall())
+    totals = store.totals(f"{group}_id", db_epoch(since), db_epoch(until), rates=user_rates(conn),
+                          company_id=company_id)
+    rows = [{"id": key, "name": names[key], "total_hours": round(hours, 2), "total_pay": round(pay, 2),
+             "segment_count": count}
+            for key, hours, pay, count in zip(totals["id"].tolist(), totals["hours"].tolist(),
+                                              totals["pay"].tolist(), totals["segments"].tolist())
+            if key in names]
+    rows.sort(key=lambda row: row["total_hours"], reverse=True)
+    return rows
+
+def fetch_site_trend(conn, store, site_id, days, bucket, company_id=None):
+    """Hours and segment count at one job site per day or week, oldest first"""
+    site = conn.execute("SELECT id, company_id FROM job_sites WHERE id = ?", (site_id,)).fetchone()
+    if not site or (company_id is not None and site['company_id'] != company_id):
+        raise HTTPException(status_code=404, detail=f"Job site {site_id} not found")
+    now = utc_now()
+    first = day_start(now) - timedelta(days=days - 1)
+    step = timedelta(days=TREND_BUCKETS[bucket])
+    hours, segments = store.trend(db_epoch(db_time(first)), db_epoch(db_time(now)),
+                                  step // timedelta(seconds=1), site_id=site_id)
+    return [{"date": (first + step * i).strftime("%Y-%m-%d"), "total_hours": round(total, 2), "segment_count": count}
+            for i, (total, count) in enumerate(zip(hours.tolist(), segments.tolist()))]
+
+def check_choice(name, value, choices):
+    if value not in choices:
+        raise HTTPException(status_code=400, detail=f"{name} must be one of: {', '.join(choices)}")
+
+@app.get("/analytics/hours", response_model=List[AnalyticsTotal])
+async def get_analytics_hours(days: int = 365, start: Optional[str] = None, end: Optional[str] = None,
+                              group: str = "user", lanes: DBLanes = Depends(get_lanes),
+                              store: ColumnarStore = Depends(get_columnar)):
+    """
+    Get hours, straight-time pay and segments per employee (group=user) or job site (group=site)
+    The last N days by default, or whole UTC days from start through end (YYYY-MM-DD).
     """
+    check_choice("group", group, ANALYTICS_GROUPS)
+    window = payroll_window(days, start, end)
+    return model_response(List[AnalyticsTotal],
+                          await lanes.history.run(fetch_analytics_totals, store, window, group))
+
+@app.get("/analytics/sites/{site_id}/trend", response_model=List[TrendPoint])
+async def get_site_trend(site_id: int, days: int = 90, bucket: str = "day", lanes: DBLanes = Depends(get_lanes),
+                         store: ColumnarStore = Depends(get_columnar)):
+    """Get a job site's hours per day (bucket=day) or week (bucket=week) over the last N days"""
+    check_choice("bucket", bucket, TREND_BUCKETS)
+    check_days(days)
+    return model_response(List[TrendPoint],
+                          await lanes.history.run(fetch_site_trend, store, site_id, days, bucket))
+
+# Only segments that started today or are still open can affect this report,
+# so history is never read
+def sites_busy_query(scoped=False):
+    return f"""
+    WITH live AS (
+        SELECT ss.id, ss.job_site_id, ss.start_epoch, ss.end_epoch, s.user_id, s.clock_out_at
+        FROM shift_segments ss
+        JOIN shifts s ON ss.shift_id = s.id
+        WHERE {company_filter(scoped, "ss.company_id")}ss.start_epoch >= :start_epoch AND ss.start_epoch < :end_epoch
+        UNION
+        SELECT ss.id, ss.job_site_id, ss.start_epoch, ss.end_epoch, s.user_id, s.clock_out_at
+        FROM shift_segments ss
+        JOIN shifts s ON ss.shift_id = s.id
+        WHERE {company_filter(scoped, "ss.company_id")}ss.end_at IS NULL
+    )
+    SELECT 
+        js.id as site_id,
+        js.name as site_name,
+        js.address as site_address,
+        COUNT(DISTINCT CASE 
+            WHEN l.end_epoch IS NULL AND l.clock_out_at IS NULL THEN l.user_id 
+        END) as active_employees,
+        ROUND(SUM(
+            CASE 
+                WHEN l.start_epoch >= :start_epoch AND l.start_epoch < :end_epoch
+                THEN (COALESCE(l.end_epoch, :now_epoch) - l.start_epoch) / 3600.0
+                ELSE 0
+            END
+        ), 2) as total_hours_today
+    FROM job_sites js
+    LEFT JOIN live l ON js.id = l.job_site_id
+    WHERE {company_filter(scoped, "js.company_id")}js.is_active = 1
+    GROUP BY js.id, js.name, js.address
+    ORDER BY active_employees DESC, total_hours_today DESC
+"""
+
+SITES_BUSY_QUERY = model_query(SiteBusyness, sites_busy_query())
+COMPANY_SITES_BUSY_QUERY = model_query(SiteBusyness, sites_busy_query(scoped=True))
+
+def fetch_busy_sites(conn, company_id=None):
+    """Active headcount and today's hours per active site"""
+    cursor = conn.cursor()
     
-    cursor.execute(query)
+    now = utc_now()
+    start, end = day_window(now)
+    params = epoch_params({"start": start, "end": end, "now": db_time(now), "company_id": company_id},
+                          "start", "end", "now")
+    cursor.execute(SITES_BUSY_QUERY if company_id is None else COMPANY_SITES_BUSY_QUERY, params)
     rows = cursor.fetchall()
-    conn.close()
     
     return [dict(row) for row in rows]
 
-@app.get("/sites")
-def get_all_sites():
-    """Get list of all active job sites"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT id, name, address, created_at
-        FROM job_sites
-        WHERE is_active = 1
-        ORDER BY name
-    """)
+@app.get("/sites/busy", response_model=List[SiteBusyness])
+async def get_busy_sites(lanes: DBLanes = Depends(get_lanes), onsite: OnSiteState = Depends(get_onsite)):
+    """Get sites ranked by current activity and hours worked today"""
+    if onsite is not None:
+        return model_response(List[SiteBusyness], onsite.busy_sites())
+    return model_response(List[SiteBusyness], await lanes.status.run(fetch_busy_sites))
+
+SITE_FIELDS = ("id", "name", "address", "created_at")
+EMPLOYEE_FIELDS = ("id", "name", "email", "hourly_rate", "role", "created_at")
+
+def fetch_all_sites(conn, limit=None, after=None, fields=SITE_FIELDS, company_id=None):
+    """Active job sites ordered by name, one keyset page at a time"""
+    rows, next_after = keyset_page(conn, "job_sites", fields, limit, after, company_id)
     
-    rows = cursor.fetchall()
-    conn.close()
+    page = {"sites": rows}
+    if limit is not None:
+        page["next_after"] = next_after
+    return page
+
+@cached(ttl=60)
+async def load_sites(lanes, limit, after, fields, company_id=None):
+    """A page of /sites with its ETag, cached until the data changes"""
+    if company_id is None:
+        page = await lanes.status.run(fetch_all_sites, limit, after, fields)
+    else:
+        page = await run_for_company(lanes.status, company_id, "/sites", fetch_all_sites, limit, after, fields)
+    return {"page": page, "etag": etag_for(page)}
+
+@app.get("/sites")
+async def get_all_sites(request: Request, limit: Optional[int] = None, after: Optional[str] = None,
+                        fields: Optional[str] = None, lanes: DBLanes = Depends(get_lanes)):
+    """
+    Get list of all active job sites
+    Pass limit to page through them; each page's next_after goes in the next call's after.
+    fields=id,name returns only those columns. Send If-None-Match to get a 304 when nothing changed.
+    """
+    check_limit(limit)
+    result = await load_sites(lanes=lanes, limit=limit, after=after, fields=parse_fields(fields, SITE_FIELDS))
+    return etag_response(request, result["page"], result["etag"])
+
+def fetch_all_employees(conn, limit=None, after=None, fields=EMPLOYEE_FIELDS, company_id=None):
+    """Active employees ordered by name, one keyset page at a time"""
+    rows, next_after = keyset_page(conn, "users", fields, limit, after, company_id)
     
-    return {"sites": [dict(row) for row in rows]}
+    page = {"employees": rows}
+    if limit is not None:
+        page["next_after"] = next_after
+    return page
+
+@cached(ttl=60)
+async def load_employees(lanes, limit, after, fields, company_id=None):
+    """A page of /employees with its ETag, cached until the data changes"""
+    if company_id is None:
+        page = await lanes.status.run(fetch_all_employees, limit, after, fields)
+    else:
+        page = await run_for_company(lanes.status, company_id, "/employees", fetch_all_employees, limit, after, fields)
+    return {"page": page, "etag": etag_for(page)}
 
 @app.get("/employees")
-def get_all_employees():
-    """Get list of all active employees"""
-    conn = get_db()
+async def get_all_employees(request: Request, limit: Optional[int] = None, after: Optional[str] = None,
+                            fields: Optional[str] = None, lanes: DBLanes = Depends(get_lanes)):
+    """
+    Get list of all active employees
+    Supports the same limit/after paging, fields projection and ETags as /sites.
+    """
+    check_limit(limit)
+    result = await load_employees(lanes=lanes, limit=limit, after=after, fields=parse_fields(fields, EMPLOYEE_FIELDS))
+    return etag_response(request, result["page"], result["etag"])
+
+# All four /today metrics in one pass over today's shifts; each shift's
+# duration is computed once and reused for hours and pay
+def today_summary_query(scoped=False):
+    return f"""
+    WITH today AS (
+        SELECT 
+            s.user_id,
+            (COALESCE(s.clock_out_epoch, :now_epoch) - s.clock_in_epoch) / 3600.0 as hours,
+            u.hourly_rate
+        FROM shifts s
+        LEFT JOIN users u ON s.user_id = u.id
+        WHERE {company_filter(scoped, "s.company_id")}s.clock_in_epoch >= :start_epoch AND s.clock_in_epoch < :end_epoch
+    )
+    SELECT 
+        ROUND(SUM(hours), 2) as total_hours,
+        COUNT(DISTINCT user_id) as employees_worked,
+        {open_shifts_count(scoped)} as currently_active,
+        ROUND(SUM(hours * hourly_rate), 2) as total_pay
+    FROM today
+"""
+
+TODAY_SUMMARY_QUERY = today_summary_query()
+COMPANY_TODAY_SUMMARY_QUERY = today_summary_query(scoped=True)
+
+def fetch_today_summary(conn, company_id=None):
+    """Hours, headcount and pay for the current UTC day"""
     cursor = conn.cursor()
     
-    cursor.execute("""
-        SELECT id, name, email, hourly_rate, role, created_at
-        FROM users
-        WHERE is_active = 1
-        ORDER BY name
-    """)
-    
-    rows = cursor.fetchall()
-    conn.close()
+    now = utc_now()
+    start, end = day_window(now)
+    params = epoch_params({"start": start, "end": end, "now": db_time(now), "company_id": company_id},
+                          "start", "end", "now")
+    cursor.execute(TODAY_SUMMARY_QUERY if company_id is None else COMPANY_TODAY_SUMMARY_QUERY, params)
+    summary = cursor.fetchone()
     
-    return {"employees": [dict(row) for row in rows]}
+    return {
+        "date": start[:10],
+        "total_hours": summary['total_hours'] or 0,
+        "employees_worked": summary['employees_worked'],
+        "currently_active": summary['currently_active'],
+        "total_pay": summary['total_pay'] or 0
+    }
 
 @app.get("/today")
-def get_today_summary():
+@cached(ttl=5)
+async def get_today_summary(lanes: DBLanes = Depends(get_lanes)):
     """Get summary of today's activity"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # Total hours today
-    cursor.execute("""
-        SELECT 
-            ROUND(SUM(
-                (julianday(COALESCE(s.clock_out_at, datetime('now'))) - 
-                 julianday(s.clock_in_at)) * 24
-            ), 2) as total_hours
-        FROM shifts s
-        WHERE date(s.clock_in_at) = date('now')
-    """)
-    total_hours = cursor.fetchone()['total_hours'] or 0
-    
-    # Employees who worked today
-    cursor.execute("""
-        SELECT COUNT(DISTINCT user_id) as count
-        FROM shifts
-        WHERE date(clock_in_at) = date('now')
-    """)
-    employees_today = cursor.fetchone()['count']
-    
-    # Currently clocked in
-    cursor.execute("""
-        SELECT COUNT(*) as count
-        FROM shifts
-        WHERE clock_out_at IS NULL
-    """)
-    currently_active = cursor.fetchone()['count']
-    
-    # Total pay today
-    cursor.execute("""
-        SELECT 
-            ROUND(SUM(
-                (julianday(COALESCE(s.clock_out_at, datetime('now'))) - 
-                 julianday(s.clock_in_at)) * 24 * u.hourly_rate
-            ), 2) as total_pay
-        FROM shifts s
-        JOIN users u ON s.user_id = u.id
-        WHERE date(s.clock_in_at) = date('now')
-    """)
-    total_pay = cursor.fetchone()['total_pay'] or 0
+    return await lanes.status.run(fetch_today_summary)
+
+def checkout_for_export(pool, company_id):
+    """An export connection, after checking the company exists"""
+    conn = pool.acquire()
+    try:
+        if company_id is not None:
+            check_company(conn, company_id)
+    except Exception:
+        pool.release(conn)
+        raise
+    return conn
+
+class ExportResponse(StreamingResponse):
+    """
+    Streams an export body that owns a pooled connection
+
+    The body gives the connection back when it finishes, but if the client goes
+    away before the first chunk the body never starts, so it is given back here
+    """
+
+    def __init__(self, body, pool, conn, **kwargs):
+        self._started = False
+
+        def tracked():
+            self._started = True
+            yield from body
+
+        self._body = tracked()
+        self._release = functools.partial(pool.release, conn)
+        super().__init__(self._body, **kwargs)
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            # A cancelled send waits for the body's thread, so it isn't mid-chunk here
+            if self._started:
+                self._body.close()
+            else:
+                self._release()
+
+async def stream_shift_export(request, start, end, format, after_id, gzip, company_id=None):
+    """Validate the export parameters and start streaming"""
+    if format not in CONTENT_TYPES:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(CONTENT_TYPES)}")
+    try:
+        first_day = datetime.strptime(start, "%Y-%m-%d")
+        last_day = datetime.strptime(end, "%Y-%m-%d") if end else day_start(utc_now())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start and end must be dates like 2024-01-31")
     
-    conn.close()
+    # Check the connection out before streaming starts, so a busy pool is still a 503.
+    # Exports have their own pool: a slow download never holds a request connection
+    pool = request.app.state.export_pool
+    conn = await run_in_threadpool(checkout_for_export, pool, company_id)
+    body = export_shifts(pool, conn, db_time(first_day), db_time(last_day + timedelta(days=1)),
+                         fmt=format, after_id=after_id, gzip=gzip, company_id=company_id, archive_dir=ARCHIVE_DIR)
     
+    filename = f"shifts_{first_day:%Y-%m-%d}_{last_day:%Y-%m-%d}.{format}"
+    if company_id is not None:
+        filename = f"company{company_id}_{filename}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    return ExportResponse(body, pool, conn, media_type=CONTENT_TYPES[format], headers=headers)
+
+@app.get("/export/shifts")
+async def export_shifts_range(request: Request, start: str, end: Optional[str] = None,
+                              format: str = "ndjson", after_id: int = 0, gzip: bool = False):
+    """
+    Stream every shift and segment clocked in from `start` through `end` (YYYY-MM-DD, UTC)
+    Formats: ndjson (one shift per line, segments nested) or csv (one row per segment).
+    To resume a broken download, pass the last shift id received as after_id.
+    """
+    return await stream_shift_export(request, start, end, format, after_id, gzip)
+
+# ==================== BATCH ====================
+
+MAX_BATCH_ACTIONS = 20
+
+# Each action's parameters, checked per action so one bad slot only fails itself
+class NoParameters(BaseModel):
+    pass
+
+class PayrollParameters(BaseModel):
+    days: int = Field(7, ge=1, le=MAX_REPORT_DAYS)
+
+class EmployeeHoursParameters(BaseModel):
+    employee_id: int
+    days: int = Field(30, ge=1, le=MAX_REPORT_DAYS)
+
+def validation_detail(error):
+    """A pydantic ValidationError as one line, e.g. 'days: Input should be a valid integer'"""
+    return "; ".join(f"{'.'.join(str(part) for part in e['loc']) or 'parameters'}: {e['msg']}" for e in error.errors())
+
+# Same action names and parameters as calprotrack_connector.calprotrack_business
+BATCH_ACTIONS = {
+    "get_active_employees": (NoParameters, lambda conn, p, company_id: fetch_active_employees(conn, company_id)),
+    "get_payroll": (PayrollParameters, lambda conn, p, company_id: fetch_payroll(conn, p.days, company_id)),
+    "get_employee_hours": (EmployeeHoursParameters,
+                           lambda conn, p, company_id: fetch_employee_hours(conn, p.employee_id, p.days, company_id)),
+    "get_busy_sites": (NoParameters, lambda conn, p, company_id: fetch_busy_sites(conn, company_id)),
+    "get_today_summary": (NoParameters, lambda conn, p, company_id: fetch_today_summary(conn, company_id)),
+}
+
+def run_batch(conn, actions, company_id=None):
+    """Run every action against one read snapshot; a failing action doesn't sink the rest"""
+    results = []
+    with read_snapshot(conn):
+        if company_id is not None:
+            check_company(conn, company_id)
+        for item in actions:
+            if item.action not in BATCH_ACTIONS:
+                results.append({"action": item.action, "error": f"Unknown action: {item.action}", "status": 400})
+                continue
+            parameters_model, handler = BATCH_ACTIONS[item.action]
+            try:
+                parameters = parameters_model.model_validate(item.parameters)
+                results.append({"action": item.action, "result": handler(conn, parameters, company_id)})
+            except ValidationError as e:
+                results.append({"action": item.action, "error": validation_detail(e), "status": 400})
+            except HTTPException as e:
+                results.append({"action": item.action, "error": e.detail, "status": e.status_code})
+    return {"results": results}
+
+@app.post("/batch")
+async def batch(request: BatchRequest, lanes: DBLanes = Depends(get_lanes)):
+    """
+    Run several connector actions in one round trip, all against the same DB snapshot
+    Body: {"actions": [{"action": "get_today_summary"}, {"action": "get_payroll", "parameters": {"days": 7}}]}
+    Optional "company_id" scopes every action to one company.
+    """
+    if not request.actions or len(request.actions) > MAX_BATCH_ACTIONS:
+        raise HTTPException(status_code=400, detail=f"Send between 1 and {MAX_BATCH_ACTIONS} actions")
+    return await lanes.reports.run(run_batch, request.actions, request.company_id)
+
+@app.get("/state/check")
+async def check_onsite_state(request: Request, lanes: DBLanes = Depends(get_lanes)):
+    """Recount open shifts, segments and per-site headcount in SQL and compare with the in-memory state"""
+    return await lanes.reports.run(request.app.state.onsite.verify)
+
+@app.get("/stream/activity")
+async def stream_activity(request: Request, company_id: Optional[int] = None):
+    """
+    Live feed of clock-ins, clock-outs and site changes (Server-Sent Events)
+    Each `activity` event carries a JSON list of changes. Pass company_id for one company only.
+    """
+    return StreamingResponse(
+        sse_stream(request.app.state.activity, company_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# ==================== COMPANY (TENANT) ENDPOINTS ====================
+# Same reports as above, limited to one company's rows
+
+@app.get("/companies/{company_id}")
+async def company_root(company_id: int, lanes: DBLanes = Depends(get_lanes),
+                       onsite: OnSiteState = Depends(get_onsite)):
+    """Headline counts for one company"""
+    if onsite is not None:
+        check_onsite_company(onsite, company_id)
+        return root_payload(onsite.root_stats(company_id))
+    return await run_for_company(lanes.status, company_id, "/", fetch_root_stats)
+
+@app.get("/companies/{company_id}/active", response_model=List[ActiveEmployee])
+async def get_company_active_employees(company_id: int, lanes: DBLanes = Depends(get_lanes),
+                                       onsite: OnSiteState = Depends(get_onsite)):
+    """Get a company's employees currently clocked in"""
+    if onsite is not None:
+        check_onsite_company(onsite, company_id)
+        return model_response(List[ActiveEmployee], onsite.active_employees(company_id))
+    return model_response(List[ActiveEmployee],
+                          await run_for_company(lanes.status, company_id, "/active", fetch_active_employees))
+
+@app.get("/companies/{company_id}/payroll", response_model=List[PayrollEntry])
+async def get_company_payroll(company_id: int, days: int = 7, lanes: DBLanes = Depends(get_lanes)):
+    """Get a company's payroll summary for the last N days"""
+    return model_response(List[PayrollEntry],
+                          await run_for_company(lanes.history, company_id, "/payroll", fetch_payroll, days))
+
+@app.get("/companies/{company_id}/employee/{user_id}/hours", response_model=EmployeeHours)
+async def get_company_employee_hours(company_id: int, user_id: int, days: int = 30,
+                                     lanes: DBLanes = Depends(get_lanes)):
+    """Get hours worked for one of a company's employees"""
+    return model_response(EmployeeHours, await run_for_company(lanes.history, company_id, "/employee/{id}/hours",
+                                                               fetch_employee_hours, user_id, days))
+
+@app.get("/companies/{company_id}/payroll/detailed", response_model=List[PayrollDetail])
+async def get_company_payroll_detail(company_id: int, days: int = 7, start: Optional[str] = None,
+                                     end: Optional[str] = None, by_site: bool = False,
+                                     lanes: DBLanes = Depends(get_lanes)):
+    """Get a company's segment-accurate payroll (options as /payroll/detailed)"""
+    window = payroll_window(days, start, end)
+    return model_response(List[PayrollDetail], await run_for_company(lanes.history, company_id, "/payroll/detailed",
+                                                                     fetch_payroll_detail, window, by_site))
+
+@app.get("/companies/{company_id}/employee/{user_id}/payroll", response_model=PayrollDetail)
+async def get_company_employee_payroll(company_id: int, user_id: int, days: int = 7, start: Optional[str] = None,
+                                       end: Optional[str] = None, lanes: DBLanes = Depends(get_lanes)):
+    """Get one of a company's employees' segment-accurate payroll, per job site"""
+    window = payroll_window(days, start, end)
+    return model_response(PayrollDetail, await run_for_company(lanes.history, company_id, "/employee/{id}/payroll",
+                                                               fetch_employee_payroll, user_id, window))
+
+@app.get("/companies/{company_id}/analytics/hours", response_model=List[AnalyticsTotal])
+async def get_company_analytics_hours(company_id: int, days: int = 365, start: Optional[str] = None,
+                                      end: Optional[str] = None, group: str = "user",
+                                      lanes: DBLanes = Depends(get_lanes),
+                                      store: ColumnarStore = Depends(get_columnar)):
+    """Get a company's hours and pay per employee or job site (options as /analytics/hours)"""
+    check_choice("group", group, ANALYTICS_GROUPS)
+    window = payroll_window(days, start, end)
+    return model_response(List[AnalyticsTotal], await run_for_company(lanes.history, company_id, "/analytics/hours",
+                                                                      fetch_analytics_totals, store, window, group))
+
+@app.get("/companies/{company_id}/analytics/sites/{site_id}/trend", response_model=List[TrendPoint])
+async def get_company_site_trend(company_id: int, site_id: int, days: int = 90, bucket: str = "day",
+                                 lanes: DBLanes = Depends(get_lanes), store: ColumnarStore = Depends(get_columnar)):
+    """Get one of a company's job sites' hours per day or week"""
+    check_choice("bucket", bucket, TREND_BUCKETS)
+    check_days(days)
+    return model_response(List[TrendPoint], await run_for_company(lanes.history, company_id, "/analytics/sites/{id}/trend",
+                                                                  fetch_site_trend, store, site_id, days, bucket))
+
+@app.get("/companies/{company_id}/sites/busy", response_model=List[SiteBusyness])
+async def get_company_busy_sites(company_id: int, lanes: DBLanes = Depends(get_lanes),
+                                 onsite: OnSiteState = Depends(get_onsite)):
+    """Get a company's sites ranked by current activity and hours worked today"""
+    if onsite is not None:
+        check_onsite_company(onsite, company_id)
+        return model_response(List[SiteBusyness], onsite.busy_sites(company_id))
+    return model_response(List[SiteBusyness],
+                          await run_for_company(lanes.status, company_id, "/sites/busy", fetch_busy_sites))
+
+@app.get("/companies/{company_id}/sites")
+async def get_company_sites(request: Request, company_id: int, limit: Optional[int] = None,
+                            after: Optional[str] = None, fields: Optional[str] = None,
+                            lanes: DBLanes = Depends(get_lanes)):
+    """Get a company's active job sites (paging, fields and ETags as /sites)"""
+    check_limit(limit)
+    result = await load_sites(lanes=lanes, limit=limit, after=after, fields=parse_fields(fields, SITE_FIELDS),
+                              company_id=company_id)
+    return etag_response(request, result["page"], result["etag"])
+
+@app.get("/companies/{company_id}/employees")
+async def get_company_employees(request: Request, company_id: int, limit: Optional[int] = None,
+                                after: Optional[str] = None, fields: Optional[str] = None,
+                                lanes: DBLanes = Depends(get_lanes)):
+    """Get a company's active employees (paging, fields and ETags as /employees)"""
+    check_limit(limit)
+    result = await load_employees(lanes=lanes, limit=limit, after=after, fields=parse_fields(fields, EMPLOYEE_FIELDS),
+                                  company_id=company_id)
+    return etag_response(request, result["page"], result["etag"])
+
+@app.get("/companies/{company_id}/today")
+@cached(ttl=5)
+async def get_company_today_summary(company_id: int, lanes: DBLanes = Depends(get_lanes)):
+    """Get summary of a company's activity today"""
+    return await run_for_company(lanes.status, company_id, "/today", fetch_today_summary)
+
+@app.get("/companies/{company_id}/export/shifts")
+async def export_company_shifts(request: Request, company_id: int, start: str, end: Optional[str] = None,
+                                format: str = "ndjson", after_id: int = 0, gzip: bool = False):
+    """Stream a company's shifts and segments (same options as /export/shifts)"""
+    return await stream_shift_export(request, start, end, format, after_id, gzip, company_id)
+
+@app.get("/stats")
+def get_stats(request: Request):
+    """Get internal API metrics, one section per pool, lane, cache and background task"""
+    rollup = request.app.state.rollup
+    snapshot = request.app.state.snapshot
     return {
-        "date": datetime.now().strftime("%Y-%m-%d"),
-        "total_hours": total_hours,
-        "employees_worked": employees_today,
-        "currently_active": currently_active,
-        "total_pay": total_pay
+        "pool": request.app.state.db_pool.stats(),
+        "export_pool": request.app.state.export_pool.stats(),
+        "lanes": request.app.state.db_lanes.stats(),
+        "snapshot": {**snapshot.stats(), "pool": snapshot.pool.stats()} if snapshot is not None else None,
+        "cache": response_cache.stats(),
+        "rollup": {"last_refresh": rollup.last_result, "last_error": rollup.last_error},
+        "columnar": request.app.state.columnar.stats() if request.app.state.columnar is not None else None,
+        "tenants": tenant_metrics.stats(),
+        "activity": request.app.state.activity.stats(),
+        "onsite": request.app.state.onsite.stats(),
+        "queries": query_profiler.stats(),
+        "requests": {**request_metrics.stats(), "profiles_written": slow_request_profiler.dumped}
     }
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Per-route request latency and phases, and per-endpoint SQL statement latency, in Prometheus text format"""
+    lines = request_metrics.prometheus_lines() + query_profiler.prometheus_lines()
+    return PlainTextResponse("\n".join(lines) + "\n",
+                             media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     import uvicorn
     print("=" * 60)
@@ -370,9 +1100,10 @@ if __name__ == "__main__":
     
     # Test database connection
     try:
-        conn = get_db()
-        print("✅ Database connected successfully!")
-        conn.close()
+        pool = ConnectionPool(DB_PATH)
+        with pool.connection():
+            print("✅ Database connected successfully!")
+        pool.close()
     except Exception as e:
         print(f"❌ Database connection failed: {e}")
         exit(1)
@@ -382,8 +1113,13 @@ if __name__ == "__main__":
     print("  • http://127.0.0.1:8001/docs - Interactive API docs")
     print("  • http://127.0.0.1:8001/active - Who's clocked in now")
     print("  • http://127.0.0.1:8001/payroll - Last week's payroll")
+    print("  • http://127.0.0.1:8001/payroll/detailed - Payroll from segments, with overtime")
     print("  • http://127.0.0.1:8001/today - Today's summary")
     print("  • http://127.0.0.1:8001/sites/busy - Busiest sites")
+    print("  • http://127.0.0.1:8001/export/shifts?start=2024-01-01 - Bulk shift export")
+    print("  • http://127.0.0.1:8001/companies/1/payroll - Any report, for one company")
+    print("  • http://127.0.0.1:8001/stream/activity - Live clock-in/out feed (SSE)")
+    print("  • http://127.0.0.1:8001/metrics - Prometheus metrics (set CALPROTRACK_SQL_PROFILING=1 for SQL timings)")
     print("")
     print("=" * 60)
     
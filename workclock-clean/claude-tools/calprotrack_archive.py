@@ -0,0 +1,295 @@
+"""
+CalProTrack History Archive
+Moves closed shifts out of the live database into one SQLite file per month,
+so shifts and shift_segments only hold recent history and the live-table
+endpoints (/active, /today, /sites/busy) cost the same however many years
+of clock-ins the company has.
+
+A month is archived whole, once every shift that clocked in during it has
+clocked out. Its shifts and segments are copied into
+<archive dir>/shifts-YYYY-MM.db, then deleted from the live tables in the
+same transaction that registers the file in archived_months. A month is
+always either live or archived, never half of each, so no report can count a
+shift twice or miss one. Archive files never change afterwards.
+
+Reports whose window reaches into archived months (payroll, employee hours,
+the payroll engine, exports) ATTACH just those months, read-only and
+immutable - see archive_snapshot(). Rollup rows for archived days stay in the
+live database, so /payroll over closed days never needs the archive at all.
+
+The Node server only reads the live tables, so archived months drop out of
+its timesheet screens: keep at least as many months live as those show.
+
+Run:
+    python calprotrack_archive.py archive                    # months older than CALPROTRACK_ARCHIVE_KEEP_MONTHS
+    python calprotrack_archive.py archive --before 2025-01   # every month before January 2025
+    python calprotrack_archive.py list
+"""
+
+import argparse
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from calprotrack_config import DATABASE_PATH, ARCHIVE_DIR, ARCHIVE_KEEP_MONTHS
+from calprotrack_pool import open_connection, read_snapshot
+from calprotrack_rollup import refresh_rollup, rebuild_days
+from calprotrack_time import utc_now, db_time, db_epoch
+
+SHIFT_COLUMNS = "id, company_id, user_id, clock_in_at, clock_out_at, created_at, clock_in_epoch, clock_out_epoch"
+SEGMENT_COLUMNS = "id, company_id, shift_id, job_site_id, start_at, end_at, created_at, start_epoch, end_epoch"
+
+# The live tables' columns and the indexes the report queries seek on
+ARCHIVE_SCHEMA = [
+    """CREATE TABLE archive.shifts (
+        id INTEGER PRIMARY KEY, company_id INTEGER NOT NULL, user_id INTEGER NOT NULL,
+        clock_in_at TEXT NOT NULL, clock_out_at TEXT, created_at TEXT NOT NULL,
+        clock_in_epoch INTEGER, clock_out_epoch INTEGER
+    )""",
+    """CREATE TABLE archive.shift_segments (
+        id INTEGER PRIMARY KEY, company_id INTEGER NOT NULL, shift_id INTEGER NOT NULL,
+        job_site_id INTEGER NOT NULL, start_at TEXT NOT NULL, end_at TEXT, created_at TEXT NOT NULL,
+        start_epoch INTEGER, end_epoch INTEGER
+    )""",
+    "CREATE INDEX archive.idx_shifts_clock_in_epoch ON shifts(clock_in_epoch, user_id, clock_out_epoch)",
+    "CREATE INDEX archive.idx_shifts_user_clock_in_epoch ON shifts(user_id, clock_in_epoch, clock_out_epoch)",
+    "CREATE INDEX archive.idx_shifts_company_clock_in_epoch ON shifts(company_id, clock_in_epoch, user_id, clock_out_epoch)",
+    "CREATE INDEX archive.idx_segments_shift ON shift_segments(shift_id)",
+]
+
+
+class ArchiveError(Exception):
+    """A month can't be archived, or a query needs more archived months than SQLite can attach"""
+    pass
+
+
+# ==================== MONTHS AND FILES ====================
+
+def archive_dir_for(db_path):
+    """Where a database's month files live: CALPROTRACK_ARCHIVE_DIR, or archive/ next to the database"""
+    return ARCHIVE_DIR or os.path.join(os.path.dirname(os.path.abspath(db_path)), "archive")
+
+
+def month_bounds(month):
+    """[start, end) of a "YYYY-MM" month as stored timestamps"""
+    year, number = int(month[:4]), int(month[5:7])
+    following = f"{year + number // 12:04d}-{number % 12 + 1:02d}"
+    return f"{month}-01 00:00:00", f"{following}-01 00:00:00"
+
+
+def months_ago(months, now=None):
+    """The "YYYY-MM" month `months` before the current one"""
+    now = now or utc_now()
+    index = now.year * 12 + now.month - 1 - months
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def schema_name(month):
+    return "archive_" + month.replace("-", "_")
+
+
+def archived_months(conn, ranges):
+    """Registered months that overlap any of `ranges` ((start, end) stored timestamps), oldest first"""
+    rows = conn.execute("SELECT month, file, start_at, end_at FROM archived_months ORDER BY month").fetchall()
+    return [(row[0], row[1]) for row in rows
+            if any(row[2] < end and start < row[3] for start, end in ranges)]
+
+
+# ==================== READING ====================
+
+def attach_months(conn, archive_dir, months):
+    """
+    Attach each (month, file) to conn unless it already is; returns their schema names
+
+    Archive files never change, so they stay attached to pooled connections
+    between requests. Only when SQLite's attach limit is reached are the
+    other months detached, and that can't happen inside a transaction.
+    """
+    attached = {row[1] for row in conn.execute("PRAGMA database_list")}
+    wanted = {schema_name(month) for month, _ in months}
+    limit = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+    if len(wanted) > limit:
+        raise ArchiveError(f"This range reaches into {len(wanted)} archived months; "
+                           f"at most {limit} can be read at once - split it up")
+    stale = sorted(name for name in attached if name.startswith("archive_") and name not in wanted)
+    spare = limit - len(attached - {"main", "temp"})
+    missing = [(month, file) for month, file in months if schema_name(month) not in attached]
+    if len(missing) > spare:
+        if conn.in_transaction:
+            raise ArchiveError("Too many archived months attached to detach any inside a transaction")
+        for name in stale[:len(missing) - spare]:
+            conn.execute(f"DETACH DATABASE {name}")
+    for month, file in missing:
+        uri = Path(archive_dir, file).resolve().as_uri() + "?mode=ro&immutable=1"
+        conn.execute(f"ATTACH DATABASE ? AS {schema_name(month)}", (uri,))
+    return [schema_name(month) for month, _ in months]
+
+
+@contextmanager
+def archive_snapshot(conn, archive_dir, ranges):
+    """
+    read_snapshot(conn) with every archived month that overlaps `ranges`
+    attached; yields the schema names to query alongside main
+
+    The registry is read again inside the snapshot: if a month was archived
+    between the two reads, it is attached too and the snapshot retried.
+    """
+    while True:
+        months = archived_months(conn, ranges)
+        schemas = attach_months(conn, archive_dir, months)
+        with read_snapshot(conn):
+            if archived_months(conn, ranges) == months:
+                yield schemas
+                return
+
+
+# ==================== ARCHIVING ====================
+
+def _copy_month(conn, path, start, end):
+    """Copy a month's shifts and segments into a new file at `path`; returns (shifts, segments)"""
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn.execute("ATTACH DATABASE ? AS archive", (Path(tmp_path).resolve().as_uri() + "?mode=rwc",))
+    try:
+        conn.execute("BEGIN")
+        for statement in ARCHIVE_SCHEMA:
+            conn.execute(statement)
+        params = {"start": db_epoch(start), "end": db_epoch(end)}
+        shifts = conn.execute(f"""
+            INSERT INTO archive.shifts ({SHIFT_COLUMNS}) SELECT {SHIFT_COLUMNS} FROM main.shifts
+            WHERE clock_in_epoch >= :start AND clock_in_epoch < :end
+        """, params).rowcount
+        segments = conn.execute(f"""
+            INSERT INTO archive.shift_segments ({SEGMENT_COLUMNS}) SELECT {SEGMENT_COLUMNS} FROM main.shift_segments
+            WHERE shift_id IN (SELECT id FROM archive.shifts)
+        """).rowcount
+        conn.commit()
+    except Exception:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        conn.execute("DETACH DATABASE archive")
+    os.replace(tmp_path, path)
+    return shifts, segments
+
+
+def archive_month(db_path, month, archive_dir=None, log=print):
+    """
+    Move one month's shifts into its archive file
+
+    Returns a summary dict, or None when the month has nothing to move.
+    Raises ArchiveError if any of its shifts is still open or the month
+    changed while it was being copied (run it again).
+    """
+    archive_dir = archive_dir or archive_dir_for(db_path)
+    os.makedirs(archive_dir, exist_ok=True)
+    start, end = month_bounds(month)
+    window = {"start": db_epoch(start), "end": db_epoch(end)}
+    file = f"shifts-{month}.db"
+    path = os.path.join(archive_dir, file)
+
+    conn = open_connection(db_path, readonly=False)
+    try:
+        if conn.execute("SELECT 1 FROM archived_months WHERE month = ?", (month,)).fetchone():
+            return None
+        count_query = "SELECT COUNT(*), COUNT(clock_out_epoch) FROM shifts WHERE clock_in_epoch >= :start AND clock_in_epoch < :end"
+        total, closed = conn.execute(count_query, window).fetchone()
+        if total == 0:
+            return None
+        if closed < total:
+            raise ArchiveError(f"{month} still has {total - closed} open shift(s); close them before archiving it")
+
+        started = time.perf_counter()
+        shifts, segments = _copy_month(conn, path, start, end)
+
+        # Swap: the live rows go and the file is registered in one transaction
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            live_segments = conn.execute("""
+                SELECT COUNT(*) FROM shift_segments
+                WHERE shift_id IN (SELECT id FROM shifts WHERE clock_in_epoch >= :start AND clock_in_epoch < :end)
+            """, window).fetchone()[0]
+            if tuple(conn.execute(count_query, window).fetchone()) != (shifts, shifts) or live_segments != segments:
+                raise ArchiveError(f"{month} changed while it was being copied; run the archive again")
+            # Its rollup rows become final: nothing can rebuild them once the shifts are gone
+            rebuild_days(conn, start, end, db_time(utc_now()))
+            conn.execute("""
+                DELETE FROM shift_segments
+                WHERE shift_id IN (SELECT id FROM shifts WHERE clock_in_epoch >= :start AND clock_in_epoch < :end)
+            """, window)
+            conn.execute("DELETE FROM shifts WHERE clock_in_epoch >= :start AND clock_in_epoch < :end", window)
+            # The deletes marked the month's days for a rollup rebuild they must not get
+            conn.execute("DELETE FROM rollup_dirty_days WHERE day >= ? AND day < ?", (start[:10], end[:10]))
+            conn.execute("""
+                INSERT INTO archived_months (month, file, start_at, end_at, shift_count, segment_count)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (month, file, start, end, shifts, segments))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            os.remove(path)
+            raise
+    finally:
+        conn.close()
+
+    log(f"   📦 {month}: {shifts:,} shifts, {segments:,} segments -> {file} "
+        f"({time.perf_counter() - started:.1f}s)")
+    return {"month": month, "file": file, "shifts": shifts, "segments": segments}
+
+
+def archive_before(db_path, before, archive_dir=None, log=print):
+    """Archive every month before `before` ("YYYY-MM") that is fully closed; returns the summaries"""
+    # Archived days are only ever read from the rollup, so it must cover them first
+    refresh_rollup(db_path)
+    conn = open_connection(db_path)
+    try:
+        first = conn.execute("SELECT MIN(clock_in_at) FROM shifts").fetchone()[0]
+    finally:
+        conn.close()
+    if first is None:
+        return []
+
+    archived = []
+    month = first[:7]
+    while month < before:
+        try:
+            result = archive_month(db_path, month, archive_dir, log)
+            if result:
+                archived.append(result)
+        except ArchiveError as e:
+            log(f"   ⏭️  {e}")
+        month = month_bounds(month)[1][:7]
+    return archived
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move closed CalProTrack shifts into per-month history files")
+    parser.add_argument("command", choices=["archive", "list"])
+    parser.add_argument("--db", default=DATABASE_PATH, help="Path to fieldtrack.db (default: DATABASE_PATH)")
+    parser.add_argument("--before", help="Archive months before this one, YYYY-MM "
+                                         f"(default: all but the last {ARCHIVE_KEEP_MONTHS} months)")
+    parser.add_argument("--archive-dir", help="Where the month files go (default: CALPROTRACK_ARCHIVE_DIR or ./archive)")
+    args = parser.parse_args()
+
+    from calprotrack_migrations import run_migrations
+    run_migrations(args.db)
+
+    if args.command == "archive":
+        before = args.before or months_ago(ARCHIVE_KEEP_MONTHS)
+        print(f"🗄️  Archiving closed months before {before}...")
+        results = archive_before(args.db, before, args.archive_dir)
+        print(f"✅ Archived {len(results)} month(s): {sum(r['shifts'] for r in results):,} shifts, "
+              f"{sum(r['segments'] for r in results):,} segments")
+    else:
+        conn = open_connection(args.db)
+        rows = conn.execute("SELECT * FROM archived_months ORDER BY month").fetchall()
+        conn.close()
+        if not rows:
+            print("   Nothing archived yet.")
+        for row in rows:
+            print(f"   📦 {row['month']}: {row['shift_count']:,} shifts, {row['segment_count']:,} segments "
+                  f"in {row['file']} (archived {row['archived_at']})")
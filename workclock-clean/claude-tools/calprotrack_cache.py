@@ -0,0 +1,168 @@
+"""
+CalProTrack Response Cache
+In-process LRU cache for read endpoints, with a TTL per endpoint and a cap on
+total size. Any commit to the database - from the Node server, the rollup
+refresher or anything else - clears it, detected with PRAGMA data_version.
+"""
+
+import functools
+import inspect
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from calprotrack_pool import open_connection
+
+MAX_BYTES = 32 * 1024 * 1024    # total size of cached responses (JSON-encoded)
+MAX_ENTRIES = 1024
+
+# Arguments that are plumbing, not part of what the response depends on
+IGNORED_ARGS = ("conn", "request", "lanes")
+
+
+class ResponseCache:
+    """LRU + TTL cache of endpoint results, invalidated when the DB changes"""
+
+    def __init__(self, max_bytes=MAX_BYTES, max_entries=MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # key -> (value, expires_at, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._watch = None
+        self._data_version = None
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def open(self, db_path):
+        """
+        Start watching a database for changes
+
+        If the database can't be opened, caching stays off - without the watch
+        connection there would be no way to notice writes.
+        """
+        try:
+            self._watch = open_connection(db_path)
+        except sqlite3.OperationalError:
+            self._watch = None
+
+    def close(self):
+        with self._lock:
+            if self._watch is not None:
+                self._watch.close()
+                self._watch = None
+            self._clear()
+
+    def clear(self):
+        """Drop every cached response"""
+        with self._lock:
+            self._clear()
+
+    def _clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def _check_data_version(self):
+        """Drop everything if another connection has committed since the last check"""
+        if self._watch is None:
+            return
+        version = self._watch.execute("PRAGMA data_version").fetchone()[0]
+        if version != self._data_version:
+            if self._entries:
+                self.invalidations += 1
+            self._clear()
+            self._data_version = version
+
+    def lookup(self, key):
+        """
+        Returns (hit, value, version); pass version back to store() so a result
+        computed while the data changed is never cached
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._check_data_version()
+            entry = self._entries.get(key) if self._watch is not None else None
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[0], self._data_version
+            self.misses += 1
+            return False, None, self._data_version
+
+    def store(self, key, value, ttl, version):
+        """Cache `value` for `ttl` seconds unless the data changed since lookup()"""
+        size = len(json.dumps(value, default=str))
+        with self._lock:
+            self._check_data_version()
+            if self._watch is None or version != self._data_version or size > self.max_bytes:
+                return
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._entries[key] = (value, time.monotonic() + ttl, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes or len(self._entries) > self.max_entries:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def get_or_compute(self, key, ttl, compute):
+        """Return the cached value for `key`, or call compute() and cache it for `ttl` seconds"""
+        hit, value, version = self.lookup(key)
+        if hit:
+            return value
+        value = compute()
+        self.store(key, value, ttl, version)
+        return value
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+response_cache = ResponseCache()
+
+
+def cached(ttl):
+    """
+    Cache an endpoint's result for `ttl` seconds, keyed by endpoint name and
+    its query/path parameters
+    """
+    def cache_key(func, kwargs):
+        params = tuple(sorted((k, v) for k, v in kwargs.items() if k not in IGNORED_ARGS))
+        return (func.__name__,) + params
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                key = cache_key(func, kwargs)
+                hit, value, version = response_cache.lookup(key)
+                if hit:
+                    return value
+                value = await func(*args, **kwargs)
+                response_cache.store(key, value, ttl, version)
+                return value
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return response_cache.get_or_compute(cache_key(func, kwargs), ttl, lambda: func(*args, **kwargs))
+        return wrapper
+    return decorator
@@ -0,0 +1,438 @@
+"""
+CalProTrack Columnar Store
+Closed shift segments as fixed-width numpy columns on disk, for long-range
+analytics (hours and pay per employee or site over a year, per-site trends)
+that would otherwise scan millions of SQLite rows.
+
+Every segment is six integers: id, user_id, site_id, company_id and its
+start and end as epoch seconds. The store is a directory of runs, each a
+set of .npy files (one per column) sorted by start, plus meta.json listing
+the runs. Readers open the files with numpy.memmap, so a query touches only
+the pages it reads, and cut every run down to a time window with a binary
+search on its start column before aggregating.
+
+Refreshes are incremental: segments with an id above the last one seen are
+read, the closed ones written as a new run, and the ids of the open ones
+kept in meta.json ("pending") to be picked up once they close. The Node
+server never changes a segment after it closes, so nothing else can go
+stale. Because segments close out of id order, a new run's starts can
+overlap older runs; runs are merged whenever a run is no bigger than
+everything after it, which keeps their number logarithmic in the store's
+size. Run files never change once written, so readers need no locks.
+
+Segments are attributed to the window their start falls in, with their full
+duration. A segment whose shift is deleted stays in the store until the next
+`build`; reports drop it when they join names. Segments archived before the
+store's first refresh are read from the archive files by `build`. Only one
+process should refresh a store at a time.
+
+Run:
+    python calprotrack_columnar.py build       # (re)write the store from the database and its archive
+    python calprotrack_columnar.py refresh     # append segments closed since the last refresh
+    python calprotrack_columnar.py info
+"""
+
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from calprotrack_config import DATABASE_PATH, COLUMNAR_DIR, COLUMNAR_INTERVAL
+from calprotrack_pool import open_connection, read_snapshot
+from calprotrack_time import utc_now, db_time
+
+VERSION = 1
+
+# Column name -> on-disk dtype, in the order SEGMENTS_QUERY selects them
+COLUMNS = {
+    "id": np.int64,
+    "user_id": np.int32,
+    "site_id": np.int32,
+    "company_id": np.int32,
+    "start": np.int64,
+    "end": np.int64,
+}
+
+# Open segments come back with end = -1. A segment left open when its shift
+# clocked out counts as ending at the clock-out, as in the rollup.
+SEGMENTS_QUERY = """
+    SELECT ss.id, s.user_id, ss.job_site_id, ss.company_id, ss.start_epoch,
+           COALESCE(ss.end_epoch, s.clock_out_epoch, -1)
+    FROM {schema}.shift_segments ss
+    JOIN {schema}.shifts s ON s.id = ss.shift_id
+    WHERE {where}
+"""
+
+FETCH_ROWS = 250_000   # rows converted to numpy at a time
+MAX_RUNS = 8           # merge runs beyond this many even if their sizes don't call for it
+
+
+# ==================== COLUMNS ====================
+
+def columnar_dir_for(db_path):
+    """Where a database's store lives: CALPROTRACK_COLUMNAR_DIR, or columnar/ next to the database"""
+    return COLUMNAR_DIR or os.path.join(os.path.dirname(os.path.abspath(db_path)), "columnar")
+
+
+def _empty():
+    return {name: np.empty(0, dtype) for name, dtype in COLUMNS.items()}
+
+
+def _read_segments(conn, where, params=(), schema="main"):
+    """Segments matching `where` as a dict of columns"""
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    cursor.execute(SEGMENTS_QUERY.format(schema=schema, where=where), params)
+    chunks = []
+    while True:
+        rows = cursor.fetchmany(FETCH_ROWS)
+        if not rows:
+            break
+        chunks.append(np.array(rows, dtype=np.int64))
+    if not chunks:
+        return _empty()
+    table = np.concatenate(chunks)
+    return {name: table[:, i].astype(dtype) for i, (name, dtype) in enumerate(COLUMNS.items())}
+
+
+def _concat(parts):
+    return {name: np.concatenate([part[name] for part in parts]) for name in COLUMNS}
+
+
+def _take(columns, selector):
+    return {name: values[selector] for name, values in columns.items()}
+
+
+def _sorted_by_start(columns):
+    return _take(columns, np.argsort(columns["start"], kind="stable"))
+
+
+def _add(total, part):
+    """total + part, padding the shorter of two per-id bincounts"""
+    if len(total) < len(part):
+        total = np.pad(total, (0, len(part) - len(total)))
+    total[:len(part)] += part
+    return total
+
+
+def user_rates(conn):
+    """
+    Hourly rate per user id, for ColumnarStore.totals(rates=...)
+
+    One slot longer than the highest id: totals() clips ids past the end
+    (deleted users) onto that last, zero slot.
+    """
+    rows = conn.execute("SELECT id, hourly_rate FROM users").fetchall()
+    rates = np.zeros(max((row[0] for row in rows), default=0) + 2)
+    for user_id, rate in rows:
+        rates[user_id] = rate or 0.0
+    return rates
+
+
+# ==================== STORE ====================
+
+class ColumnarStore:
+    """The runs in one store directory, memory-mapped; refresh() and build() write it"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.last_refresh_s = None
+        self._lock = threading.Lock()
+        self._mapped = {}                 # run name -> its memory-mapped columns
+        self._state = (None, [])          # (meta, columns of each run), swapped whole
+        self._meta_mtime = None
+
+    # ---- reading ----
+
+    @property
+    def ready(self):
+        """Whether the store has been built"""
+        return self._state[0] is not None
+
+    def open(self):
+        """Map the runs meta.json lists; a store that was never built reads as empty"""
+        for _ in range(3):
+            try:
+                stat = (self.path / "meta.json").stat()
+                meta = json.loads((self.path / "meta.json").read_text())
+                runs = [self._map(run["name"]) for run in meta["runs"]]
+            except FileNotFoundError:
+                # Not built yet, or a refresh replaced a run between the two reads
+                continue
+            self._meta_mtime = stat.st_mtime_ns
+            self._publish(meta, runs)
+            return self
+        return self
+
+    def reload(self):
+        """open() again if another process has refreshed the store since"""
+        try:
+            mtime = (self.path / "meta.json").stat().st_mtime_ns
+        except FileNotFoundError:
+            return self
+        if mtime != self._meta_mtime:
+            self.open()
+        return self
+
+    def _map(self, name):
+        if name not in self._mapped:
+            self._mapped[name] = {column: np.load(self.path / name / f"{column}.npy", mmap_mode="r")
+                                  for column in COLUMNS}
+        return self._mapped[name]
+
+    def _publish(self, meta, runs):
+        self._state = (meta, runs)
+        names = {run["name"] for run in meta["runs"]}
+        self._mapped = {name: columns for name, columns in self._mapped.items() if name in names}
+
+    def _window(self, since=None, until=None, company_id=None, user_id=None, site_id=None):
+        """Each run's segments that started in [since, until) and match the filters"""
+        for columns in self._state[1]:
+            start = columns["start"]
+            lo = 0 if since is None else int(np.searchsorted(start, since, "left"))
+            hi = len(start) if until is None else int(np.searchsorted(start, until, "left"))
+            if hi <= lo:
+                continue
+            # Slices of a memmap are views: nothing outside [lo, hi) is read
+            columns = {name: values[lo:hi] for name, values in columns.items()}
+            mask = None
+            for name, wanted in (("company_id", company_id), ("user_id", user_id), ("site_id", site_id)):
+                if wanted is not None:
+                    match = columns[name] == wanted
+                    mask = match if mask is None else mask & match
+            if mask is not None:
+                columns = _take(columns, mask)
+            if len(columns["start"]):
+                yield columns
+
+    def totals(self, by="user_id", since=None, until=None, rates=None, **filters):
+        """
+        Hours, pay and segment count per user_id or site_id, over segments that
+        started in [since, until) (epoch seconds); filters: company_id, user_id, site_id
+
+        Pay is straight time at the rates from user_rates(); without them it is 0.
+        Returns {"id", "hours", "pay", "segments"} arrays, one entry per id with segments.
+        """
+        seconds, pay, segments = np.zeros(0), np.zeros(0), np.zeros(0, np.int64)
+        for columns in self._window(since, until, **filters):
+            keys = columns[by]
+            duration = (columns["end"] - columns["start"]).astype(np.float64)
+            seconds = _add(seconds, np.bincount(keys, weights=duration))
+            segments = _add(segments, np.bincount(keys))
+            if rates is not None:
+                pay = _add(pay, np.bincount(keys, weights=duration * rates.take(columns["user_id"], mode="clip")))
+        ids = np.flatnonzero(segments)
+        pay = _add(pay, np.zeros(len(segments)))
+        return {"id": ids, "hours": seconds[ids] / 3600, "pay": pay[ids] / 3600, "segments": segments[ids]}
+
+    def trend(self, since, until, bucket=86400, **filters):
+        """
+        Hours and segment count per `bucket` seconds from `since`, over segments
+        that started in [since, until); filters as totals(). Returns (hours, segments) arrays.
+        """
+        buckets = max(0, -(-(until - since) // bucket))
+        seconds, segments = np.zeros(buckets), np.zeros(buckets, np.int64)
+        for columns in self._window(since, until, **filters):
+            index = (columns["start"] - since) // bucket
+            seconds += np.bincount(index, weights=(columns["end"] - columns["start"]).astype(np.float64),
+                                   minlength=buckets)
+            segments += np.bincount(index, minlength=buckets)
+        return seconds / 3600, segments
+
+    # ---- writing ----
+
+    def build(self, db_path, archive_dir=None):
+        """Write the store from scratch: every closed segment in the database and its archived months"""
+        from calprotrack_archive import archive_dir_for
+        archive_dir = archive_dir or archive_dir_for(db_path)
+        with self._lock:
+            started = time.perf_counter()
+            conn = open_connection(db_path)
+            try:
+                with read_snapshot(conn):
+                    files = [row[0] for row in conn.execute("SELECT file FROM archived_months ORDER BY month")]
+                    live = _read_segments(conn, "1")
+            finally:
+                conn.close()
+            parts = [live]
+            # Archive files never change once registered, so reading them after the snapshot is safe
+            for file in files:
+                archive = open_connection(Path(archive_dir, file), immutable=True)
+                try:
+                    parts.append(_read_segments(archive, "1"))
+                finally:
+                    archive.close()
+            segments = _concat(parts)
+            closed = segments["end"] >= 0
+            meta = {"version": VERSION, "last_id": int(segments["id"].max(initial=0)),
+                    "pending": segments["id"][~closed].tolist(), "runs": [], "next_run": 1}
+            old = self._state[0]
+            if old is not None:
+                meta["next_run"] = old["next_run"]
+            elif (self.path / "meta.json").exists():
+                meta["next_run"] = json.loads((self.path / "meta.json").read_text())["next_run"]
+            runs = self._write_runs(meta, [], _sorted_by_start(_take(segments, closed)))
+            self._commit(meta, runs, started)
+            self._remove_stale_runs()
+            return self.stats()
+
+    def refresh(self, db_path):
+        """Append the segments closed since the last refresh (build() first if the store is empty)"""
+        if not self.ready:
+            self.open()
+        if not self.ready:
+            return self.build(db_path)
+        with self._lock:
+            started = time.perf_counter()
+            meta = dict(self._state[0])
+            conn = open_connection(db_path)
+            try:
+                with read_snapshot(conn):
+                    new = _read_segments(conn, "ss.id > ?", (meta["last_id"],))
+                    pending = (_read_segments(conn, "ss.id IN (SELECT value FROM json_each(?))",
+                                              (json.dumps(meta["pending"]),))
+                               if meta["pending"] else _empty())
+            finally:
+                conn.close()
+            segments = _concat([pending, new])
+            closed = segments["end"] >= 0
+            # Pending ids that are gone were deleted with their shift; they are simply dropped
+            meta["pending"] = segments["id"][~closed].tolist()
+            meta["last_id"] = max(meta["last_id"], int(new["id"].max(initial=0)))
+            appended = int(closed.sum())
+            runs = list(zip(meta["runs"], self._state[1]))
+            if appended:
+                runs = self._write_runs(meta, runs, _sorted_by_start(_take(segments, closed)))
+            self._commit(meta, runs, started)
+            self._remove_stale_runs()
+            return {**self.stats(), "appended": appended}
+
+    def _write_runs(self, meta, runs, batch):
+        """
+        Add `batch` (sorted by start) after `runs` ((info, columns) pairs), merging
+        it with the newest runs while the next older one is no bigger than they are
+        together, or there would be more than MAX_RUNS; returns the new run list
+        """
+        merge = 0
+        size = len(batch["start"])
+        while merge < len(runs) and (len(runs) - merge + 1 > MAX_RUNS or runs[-merge - 1][0]["rows"] <= size):
+            merge += 1
+            size += runs[-merge][0]["rows"]
+        if merge:
+            batch = _sorted_by_start(_concat([columns for _, columns in runs[-merge:]] + [batch]))
+            runs = runs[:-merge]
+        if not len(batch["start"]):
+            return runs
+        name = f"run-{meta['next_run']:06d}"
+        meta["next_run"] += 1
+        tmp = self.path / (name + ".tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        for column, values in batch.items():
+            np.save(tmp / f"{column}.npy", values)
+        os.replace(tmp, self.path / name)
+        info = {"name": name, "rows": len(batch["start"]),
+                "min_start": int(batch["start"][0]), "max_start": int(batch["start"][-1])}
+        return runs + [(info, self._map(name))]
+
+    def _commit(self, meta, runs, started):
+        """Write meta.json (atomically) listing `runs` ((info, columns) pairs) and serve them"""
+        meta["runs"] = [info for info, _ in runs]
+        meta["refreshed_at"] = db_time(utc_now())
+        tmp = self.path / "meta.json.tmp"
+        tmp.write_text(json.dumps(meta))
+        os.replace(tmp, self.path / "meta.json")
+        self._meta_mtime = (self.path / "meta.json").stat().st_mtime_ns
+        self._publish(meta, [columns for _, columns in runs])
+        self.last_refresh_s = time.perf_counter() - started
+
+    def _remove_stale_runs(self):
+        """Delete run directories meta.json no longer lists (mapped copies stay readable until unmapped)"""
+        keep = {run["name"] for run in self._state[0]["runs"]}
+        for entry in self.path.iterdir():
+            if entry.is_dir() and entry.name.startswith("run-") and entry.name not in keep:
+                shutil.rmtree(entry, ignore_errors=True)
+
+    def stats(self):
+        meta, runs = self._state
+        return {
+            "path": str(self.path),
+            "ready": meta is not None,
+            "rows": sum(run["rows"] for run in meta["runs"]) if meta else 0,
+            "runs": len(runs),
+            "last_id": meta["last_id"] if meta else None,
+            "pending": len(meta["pending"]) if meta else None,
+            "refreshed_at": meta.get("refreshed_at") if meta else None,
+            "last_refresh_ms": round(self.last_refresh_s * 1000, 1) if self.last_refresh_s is not None else None,
+        }
+
+
+class ColumnarRefresher:
+    """Background thread that builds the store if needed, then refreshes it every `interval` seconds"""
+
+    def __init__(self, db_path, store, interval=COLUMNAR_INTERVAL, archive_dir=None):
+        self.db_path = db_path
+        self.store = store
+        self.interval = interval
+        self.archive_dir = archive_dir
+        self.last_error = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="columnar-refresher", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self.store.ready:
+                    self.store.refresh(self.db_path)
+                else:
+                    self.store.build(self.db_path, self.archive_dir)
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+            self._stop.wait(self.interval)
+
+    def stats(self):
+        return {**self.store.stats(), "interval_s": self.interval, "last_error": self.last_error}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the CalProTrack columnar analytics store")
+    parser.add_argument("command", choices=["build", "refresh", "info"])
+    parser.add_argument("--db", default=DATABASE_PATH, help="Path to fieldtrack.db (default: DATABASE_PATH)")
+    parser.add_argument("--dir", help="Store directory (default: CALPROTRACK_COLUMNAR_DIR or ./columnar)")
+    parser.add_argument("--archive-dir", help="Month files to read on build (default: CALPROTRACK_ARCHIVE_DIR or ./archive)")
+    args = parser.parse_args()
+
+    store = ColumnarStore(args.dir or columnar_dir_for(args.db)).open()
+    if args.command != "info":
+        from calprotrack_migrations import run_migrations
+        run_migrations(args.db)
+        started = time.perf_counter()
+        if args.command == "build":
+            print(f"🏗️  Building the columnar store in {store.path}...")
+            result = store.build(args.db, args.archive_dir)
+        else:
+            result = store.refresh(args.db)
+        print(f"✅ Columnar {args.command} finished in {time.perf_counter() - started:.2f}s")
+        if "appended" in result:
+            print(f"   ➕ Appended: {result['appended']:,} segments")
+    result = store.stats()
+    if not result["ready"]:
+        print(f"   Nothing built yet in {store.path}.")
+    else:
+        print(f"   📦 {result['rows']:,} segments in {result['runs']} run(s), up to id {result['last_id']:,}")
+        print(f"   ⏳ Open segments waiting to close: {result['pending']:,}")
+        print(f"   ⏰ Refreshed at: {result['refreshed_at']}")
@@ -0,0 +1,85 @@
+"""
+CalProTrack Settings
+Where the database lives and how connections to it are tuned, read from the
+environment once at import. DATABASE_PATH is the variable db.js reads and
+both default to the same file, so the Node server and these tools always
+open the same database.
+
+Settings (environment):
+    DATABASE_PATH=path                       the live database (default: fieldtrack.db next to db.js)
+    CALPROTRACK_POOL_SIZE=8                  max API read connections open at once
+    CALPROTRACK_POOL_TIMEOUT=10              seconds to wait for a free connection
+    CALPROTRACK_EXPORT_POOL_SIZE=2           max /export downloads streaming at once (own connections)
+    CALPROTRACK_EXPORT_POOL_TIMEOUT=1        seconds an export waits for one of those before a 503
+    CALPROTRACK_STATUS_LANE_SIZE=4           threads for the quick status endpoints (/, /active, /today, ...)
+    CALPROTRACK_STATUS_LANE_TIMEOUT=5        seconds a status query may run before it is interrupted (504)
+    CALPROTRACK_REPORTS_LANE_SIZE=2          threads for payroll and hours reports (and the history lane)
+    CALPROTRACK_REPORTS_LANE_TIMEOUT=30      seconds a report query may run before it is interrupted (504)
+    CALPROTRACK_MMAP_SIZE=268435456          PRAGMA mmap_size for read connections, in bytes
+    CALPROTRACK_CACHE_SIZE_KB=65536          PRAGMA cache_size per connection, in KB
+    CALPROTRACK_BUSY_TIMEOUT_MS=5000         PRAGMA busy_timeout
+    CALPROTRACK_REPORT_SNAPSHOT=path         serve payroll and hours reports from copies named after this path
+    CALPROTRACK_SNAPSHOT_INTERVAL=300        seconds between refreshes of that copy
+    CALPROTRACK_DAILY_OVERTIME_HOURS=8       payroll: straight-time hours per workday (0 = no daily overtime)
+    CALPROTRACK_DAILY_DOUBLE_TIME_HOURS=12   payroll: workday hours after which double time starts (0 = none)
+    CALPROTRACK_WEEKLY_OVERTIME_HOURS=40     payroll: regular hours per week before weekly overtime (0 = none)
+    CALPROTRACK_ARCHIVE_DIR=path             per-month history files (default: archive/ next to the database)
+    CALPROTRACK_ARCHIVE_KEEP_MONTHS=13       months the archive command leaves in the live tables
+    CALPROTRACK_COLUMNAR_DIR=path            keep a columnar copy of closed segments here for /analytics
+    CALPROTRACK_COLUMNAR_INTERVAL=300        seconds between refreshes of that store
+"""
+
+import os
+
+
+def _env_int(name, default):
+    value = os.environ.get(name, "").strip()
+    return int(value) if value else default
+
+
+def _env_float(name, default):
+    value = os.environ.get(name, "").strip()
+    return float(value) if value else default
+
+
+# Same default as db.js: fieldtrack.db in the app root, one level above these tools
+DEFAULT_DATABASE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "fieldtrack.db")
+DATABASE_PATH = os.environ.get("DATABASE_PATH") or DEFAULT_DATABASE_PATH
+
+# Connection pool
+POOL_SIZE = _env_int("CALPROTRACK_POOL_SIZE", 8)
+POOL_TIMEOUT = _env_float("CALPROTRACK_POOL_TIMEOUT", 10.0)
+
+# Exports hold a connection until the client has downloaded everything, so they
+# get their own small pool instead of starving the request pool
+EXPORT_POOL_SIZE = _env_int("CALPROTRACK_EXPORT_POOL_SIZE", 2)
+EXPORT_POOL_TIMEOUT = _env_float("CALPROTRACK_EXPORT_POOL_TIMEOUT", 1.0)
+
+# DB lanes (calprotrack_executor): threads and query timeout per lane, so slow
+# reports can never starve the quick status polls
+STATUS_LANE_SIZE = _env_int("CALPROTRACK_STATUS_LANE_SIZE", 4)
+STATUS_LANE_TIMEOUT = _env_float("CALPROTRACK_STATUS_LANE_TIMEOUT", 5.0)
+REPORTS_LANE_SIZE = _env_int("CALPROTRACK_REPORTS_LANE_SIZE", 2)
+REPORTS_LANE_TIMEOUT = _env_float("CALPROTRACK_REPORTS_LANE_TIMEOUT", 30.0)
+
+# Pragmas for the long-lived read connections
+MMAP_SIZE = _env_int("CALPROTRACK_MMAP_SIZE", 256 * 1024 * 1024)     # memory-map up to 256 MB of the DB file
+CACHE_SIZE_KB = _env_int("CALPROTRACK_CACHE_SIZE_KB", 64 * 1024)      # 64 MB page cache per connection
+BUSY_TIMEOUT_MS = _env_int("CALPROTRACK_BUSY_TIMEOUT_MS", 5000)       # wait this long when the Node server holds a write lock
+
+# Report snapshot (off unless a path is given)
+REPORT_SNAPSHOT_PATH = os.environ.get("CALPROTRACK_REPORT_SNAPSHOT") or None
+SNAPSHOT_INTERVAL = _env_float("CALPROTRACK_SNAPSHOT_INTERVAL", 300.0)
+
+# Overtime rules for the payroll engine (calprotrack_payroll); 0 turns a rule off
+DAILY_OVERTIME_HOURS = _env_float("CALPROTRACK_DAILY_OVERTIME_HOURS", 8.0)
+DAILY_DOUBLE_TIME_HOURS = _env_float("CALPROTRACK_DAILY_DOUBLE_TIME_HOURS", 12.0)
+WEEKLY_OVERTIME_HOURS = _env_float("CALPROTRACK_WEEKLY_OVERTIME_HOURS", 40.0)
+
+# History archive (calprotrack_archive)
+ARCHIVE_DIR = os.environ.get("CALPROTRACK_ARCHIVE_DIR") or None
+ARCHIVE_KEEP_MONTHS = _env_int("CALPROTRACK_ARCHIVE_KEEP_MONTHS", 13)
+
+# Columnar analytics store (calprotrack_columnar; the API keeps it only if a path is given)
+COLUMNAR_DIR = os.environ.get("CALPROTRACK_COLUMNAR_DIR") or None
+COLUMNAR_INTERVAL = _env_float("CALPROTRACK_COLUMNAR_INTERVAL", 300.0)
@@ -3,12 +3,252 @@ CalProTrack Tool Connector
 This is what runs BEHIND Claude when it uses your CalProTrack tool
 """
 
-import requests
+import asyncio
 import json
+import threading
+import time
+
+import requests
 
 # Your API base URL
 API_BASE = "http://127.0.0.1:8001"
 
+# Client defaults
+CONNECT_TIMEOUT = 3.0       # seconds to open a connection
+READ_TIMEOUT = 30.0         # seconds to wait for a response (payroll can be slow)
+RETRIES = 2                 # extra attempts after a connection error or 502/503/504
+BACKOFF = 0.25              # first retry waits this long, then doubles
+POOL_SIZE = 10              # keep-alive connections kept open per client
+RETRY_STATUSES = (502, 503, 504)
+
+CONNECTION_ERROR = {
+    "error": "Could not connect to CalProTrack API",
+    "message": f"Make sure the API is running at {API_BASE}"
+}
+
+
+def route(action, parameters):
+    """(method, path, query params) for a connector action; ValueError if it can't be routed"""
+    if action == "get_active_employees":
+        return "GET", "/active", None
+    elif action == "get_payroll":
+        return "GET", "/payroll", {"days": parameters.get('days', 7)}
+    elif action == "get_employee_hours":
+        employee_id = parameters.get('employee_id')
+        if not employee_id:
+            raise ValueError("employee_id is required for get_employee_hours")
+        return "GET", f"/employee/{employee_id}/hours", {"days": parameters.get('days', 30)}
+    elif action == "get_busy_sites":
+        return "GET", "/sites/busy", None
+    elif action == "get_today_summary":
+        return "GET", "/today", None
+    raise ValueError(f"Unknown action: {action}")
+
+
+def api_result(status_code, text, data):
+    """What calprotrack_business returns for a response"""
+    if status_code == 200:
+        return data()
+    return {
+        "error": f"API returned status {status_code}",
+        "message": text
+    }
+
+
+class CallStats:
+    """Per-call latency, kept per action (or per path for raw requests)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}    # label -> [calls, errors, retries, total_seconds, max_seconds, last_seconds]
+        self.last = None    # {"label", "status", "latency_ms", "retries"} of the most recent call
+
+    def record(self, label, status, seconds, retries):
+        with self._lock:
+            entry = self._calls.setdefault(label, [0, 0, 0, 0.0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += 0 if status == 200 else 1
+            entry[2] += retries
+            entry[3] += seconds
+            entry[4] = max(entry[4], seconds)
+            entry[5] = seconds
+            self.last = {"label": label, "status": status, "latency_ms": round(seconds * 1000, 3), "retries": retries}
+
+    def summary(self):
+        with self._lock:
+            return {
+                label: {
+                    "calls": e[0],
+                    "errors": e[1],
+                    "retries": e[2],
+                    "avg_ms": round(e[3] / e[0] * 1000, 3),
+                    "max_ms": round(e[4] * 1000, 3),
+                    "last_ms": round(e[5] * 1000, 3),
+                }
+                for label, e in self._calls.items()
+            }
+
+
+class CalProTrackClient:
+    """
+    Reusable CalProTrack API client
+    
+    Keeps connections alive between calls (requests.Session), applies
+    timeouts, retries connection errors and 502/503/504 with exponential
+    backoff, and records the latency of every call in .stats.
+    """
+    
+    def __init__(self, base_url=API_BASE, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+                 retries=RETRIES, backoff=BACKOFF, pool_size=POOL_SIZE):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.stats = CallStats()
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+    
+    def request(self, method, path, params=None, json=None, label=None):
+        """Send one request (with retries) and return the requests.Response"""
+        started = time.perf_counter()
+        attempt = 0
+        status = None
+        try:
+            while True:
+                try:
+                    response = self.session.request(method, self.base_url + path, params=params,
+                                                    json=json, timeout=self.timeout)
+                    status = response.status_code
+                    if status not in RETRY_STATUSES or attempt >= self.retries:
+                        return response
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                    if attempt >= self.retries:
+                        raise
+                time.sleep(self.backoff * 2 ** attempt)
+                attempt += 1
+        finally:
+            self.stats.record(label or f"{method} {path}", status, time.perf_counter() - started, attempt)
+    
+    def call(self, action, parameters=None):
+        """Run one connector action; same results as calprotrack_business"""
+        try:
+            method, path, params = route(action, parameters or {})
+        except ValueError as e:
+            return {"error": str(e)}
+        try:
+            response = self.request(method, path, params=params, label=action)
+            return api_result(response.status_code, response.text, response.json)
+        except requests.exceptions.ConnectionError:
+            return dict(CONNECTION_ERROR)
+        except Exception as e:
+            return {
+                "error": "Unexpected error",
+                "message": str(e)
+            }
+    
+    def close(self):
+        self.session.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AsyncCalProTrackClient:
+    """
+    Async CalProTrack API client (needs httpx)
+    
+    Same timeouts, retries and latency stats as CalProTrackClient; call_many()
+    runs several actions concurrently over the shared connection pool.
+    """
+    
+    def __init__(self, base_url=API_BASE, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+                 retries=RETRIES, backoff=BACKOFF, pool_size=POOL_SIZE):
+        import httpx
+        self._httpx = httpx
+        self.retries = retries
+        self.backoff = backoff
+        self.stats = CallStats()
+        connect, read = timeout
+        self.client = httpx.AsyncClient(
+            base_url=base_url.rstrip("/"),
+            timeout=httpx.Timeout(read, connect=connect),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+    
+    async def request(self, method, path, params=None, json=None, label=None):
+        """Send one request (with retries) and return the httpx.Response"""
+        started = time.perf_counter()
+        attempt = 0
+        status = None
+        try:
+            while True:
+                try:
+                    response = await self.client.request(method, path, params=params, json=json)
+                    status = response.status_code
+                    if status not in RETRY_STATUSES or attempt >= self.retries:
+                        return response
+                except (self._httpx.ConnectError, self._httpx.TimeoutException):
+                    if attempt >= self.retries:
+                        raise
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+                attempt += 1
+        finally:
+            self.stats.record(label or f"{method} {path}", status, time.perf_counter() - started, attempt)
+    
+    async def call(self, action, parameters=None):
+        """Run one connector action; same results as calprotrack_business"""
+        try:
+            method, path, params = route(action, parameters or {})
+        except ValueError as e:
+            return {"error": str(e)}
+        try:
+            response = await self.request(method, path, params=params, label=action)
+            return api_result(response.status_code, response.text, response.json)
+        except self._httpx.ConnectError:
+            return dict(CONNECTION_ERROR)
+        except Exception as e:
+            return {
+                "error": "Unexpected error",
+                "message": str(e)
+            }
+    
+    async def call_many(self, actions):
+        """
+        Run several actions at once
+        
+        actions: action names or (action, parameters) pairs; results come back in the same order
+        """
+        calls = [self.call(item) if isinstance(item, str) else self.call(*item) for item in actions]
+        return await asyncio.gather(*calls)
+    
+    async def aclose(self):
+        await self.client.aclose()
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+
+# Shared by calprotrack_business / calprotrack_batch so every call reuses its connections
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """The module's shared CalProTrackClient"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = CalProTrackClient()
+        return _client
+
+
 def calprotrack_business(action: str, parameters: dict = None):
     """
     Claude calls this function when it needs CalProTrack data
@@ -21,53 +261,49 @@ def calprotrack_business(action: str, parameters: dict = None):
         dict: The response from your CalProTrack API
     """
     
-    if parameters is None:
-        parameters = {}
+    return get_client().call(action, parameters)
+
+
+def calprotrack_batch(actions: list):
+    """
+    Run several actions in one call, all answered from the same moment in the database
     
-    try:
-        # Route to the correct endpoint based on action
-        if action == "get_active_employees":
-            response = requests.get(f"{API_BASE}/active")
-            
-        elif action == "get_payroll":
-            days = parameters.get('days', 7)
-            response = requests.get(f"{API_BASE}/payroll?days={days}")
-            
-        elif action == "get_employee_hours":
-            employee_id = parameters.get('employee_id')
-            if not employee_id:
-                return {"error": "employee_id is required for get_employee_hours"}
-            days = parameters.get('days', 30)
-            response = requests.get(f"{API_BASE}/employee/{employee_id}/hours?days={days}")
-            
-        elif action == "get_busy_sites":
-            response = requests.get(f"{API_BASE}/sites/busy")
-            
-        elif action == "get_today_summary":
-            response = requests.get(f"{API_BASE}/today")
-            
+    Args:
+        actions: Action names, or (action, parameters) pairs, e.g.
+                 ["get_today_summary", ("get_payroll", {"days": 7})]
+    
+    Returns:
+        list: One entry per action, in order - its response, or {"error": ...}
+    """
+    
+    body = {"actions": []}
+    for item in actions:
+        if isinstance(item, str):
+            body["actions"].append({"action": item, "parameters": {}})
         else:
-            return {"error": f"Unknown action: {action}"}
+            action, parameters = item
+            body["actions"].append({"action": action, "parameters": parameters or {}})
+    
+    try:
+        response = get_client().request("POST", "/batch", json=body, label="batch")
         
-        # Return the JSON response
-        if response.status_code == 200:
-            return response.json()
-        else:
-            return {
-                "error": f"API returned status {response.status_code}",
-                "message": response.text
-            }
-            
+        if response.status_code != 200:
+            error = api_result(response.status_code, response.text, response.json)
+            return [error for _ in actions]
+        
+        return [
+            entry["result"] if "result" in entry else {"error": entry["error"]}
+            for entry in response.json()["results"]
+        ]
+    
     except requests.exceptions.ConnectionError:
-        return {
-            "error": "Could not connect to CalProTrack API",
-            "message": "Make sure the API is running at http://127.0.0.1:8001"
-        }
+        return [dict(CONNECTION_ERROR) for _ in actions]
     except Exception as e:
-        return {
+        error = {
             "error": "Unexpected error",
             "message": str(e)
         }
+        return [error for _ in actions]
 
 
 # ==================== DEMO: How Claude Would Use This ====================
@@ -150,6 +386,26 @@ def demo_claude_conversation():
         print(f"    👥 {busiest['active_employees']} employees currently there")
         print(f"    ⏰ {busiest['total_hours_today']:.2f} total hours today")
     
+    # Scenario 5: One question that needs several actions
+    print("\n" + "=" * 70)
+    print("\n👤 USER: How's today going overall?")
+    print("\n🤖 CLAUDE: Pulling today's summary, who's in and site activity in one go...")
+    print("    [Claude calls: calprotrack_batch(['get_today_summary', 'get_active_employees', 'get_busy_sites'])]")
+    
+    summary, active, sites = calprotrack_batch(['get_today_summary', 'get_active_employees', 'get_busy_sites'])
+    
+    if 'error' not in summary and isinstance(active, list) and isinstance(sites, list):
+        print(f"\n🤖 CLAUDE: {summary['total_hours']:.2f} hours logged today, "
+              f"{len(active)} people clocked in right now.")
+        if sites:
+            print(f"    📍 Busiest site: {sites[0]['site_name']} ({sites[0]['active_employees']} there now)")
+    
+    print("\n" + "=" * 70)
+    print("\n⏱️  Call latency:")
+    for label, timing in get_client().stats.summary().items():
+        print(f"    • {label}: {timing['calls']} calls, avg {timing['avg_ms']:.1f} ms, "
+              f"max {timing['max_ms']:.1f} ms")
+    
     print("\n" + "=" * 70)
     print("  ✅ DEMO COMPLETE!")
     print("=" * 70)
@@ -0,0 +1,159 @@
+"""
+CalProTrack DB Lanes
+Async endpoints hand their blocking SQLite work to a dedicated thread pool
+("lane") instead of Starlette's shared one. Slow report queries get their own
+lane so they can never starve the quick status polls.
+
+Each query has a deadline; when it passes, the running statement is stopped
+with sqlite3.Connection.interrupt() and QueryTimeout is raised.
+"""
+
+import asyncio
+import contextvars
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from calprotrack_config import STATUS_LANE_SIZE, STATUS_LANE_TIMEOUT, REPORTS_LANE_SIZE, REPORTS_LANE_TIMEOUT
+from calprotrack_timing import record_phase
+
+# Lane defaults: (workers, timeout in seconds), set in calprotrack_config
+STATUS_LANE = (STATUS_LANE_SIZE, STATUS_LANE_TIMEOUT)       # /, /active, /today, /sites, /employees, /sites/busy
+REPORTS_LANE = (REPORTS_LANE_SIZE, REPORTS_LANE_TIMEOUT)    # /payroll, /employee/{id}/hours, /batch, history
+
+
+class QueryTimeout(Exception):
+    """Raised when a query runs past its lane's timeout"""
+
+
+class _Deadline:
+    """Links a queued call to the connection it ends up running on, so it can be interrupted"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.conn = None
+        self.expired = False
+
+    def expire(self):
+        with self.lock:
+            self.expired = True
+            if self.conn is not None:
+                self.conn.interrupt()
+
+
+class DBLane:
+    """A bounded thread pool that runs fn(conn, *args) on pooled connections"""
+
+    def __init__(self, name, pool, workers, timeout):
+        self.name = name
+        self.pool = pool
+        self.workers = workers
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"db-{name}")
+        self._lock = threading.Lock()
+
+        # Metrics
+        self._queued = 0
+        self._running = 0
+        self._max_queued = 0
+        self._completed = 0
+        self._timeouts = 0
+        self._total_queue_wait = 0.0
+
+    async def run(self, fn, *args):
+        """Run fn(conn, *args) in this lane and return its result"""
+        loop = asyncio.get_running_loop()
+        deadline = _Deadline()
+        with self._lock:
+            self._queued += 1
+            self._max_queued = max(self._max_queued, self._queued)
+
+        timer = loop.call_later(self.timeout, deadline.expire)
+        # Carry the request's context (e.g. the endpoint tag for query profiling) onto the lane thread
+        context = contextvars.copy_context()
+        try:
+            return await loop.run_in_executor(self._executor, context.run, self._call, deadline,
+                                              time.perf_counter(), fn, args)
+        finally:
+            timer.cancel()
+
+    def _call(self, deadline, enqueued_at, fn, args):
+        started = time.perf_counter()
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+            self._total_queue_wait += started - enqueued_at
+        try:
+            if deadline.expired:
+                raise QueryTimeout(f"Query waited longer than {self.timeout}s in the {self.name} lane")
+            with self.pool.connection() as conn:
+                with deadline.lock:
+                    deadline.conn = conn
+                running = time.perf_counter()
+                # Per-request phases for Server-Timing: lane + pool wait, then the work itself
+                record_phase("queue", running - enqueued_at)
+                try:
+                    return fn(conn, *args)
+                except sqlite3.OperationalError:
+                    if deadline.expired:
+                        raise QueryTimeout(f"Query exceeded {self.timeout}s in the {self.name} lane")
+                    raise
+                finally:
+                    record_phase("db", time.perf_counter() - running)
+                    # Detach before the connection goes back to the pool so a
+                    # late interrupt can't hit someone else's query
+                    with deadline.lock:
+                        deadline.conn = None
+        except QueryTimeout:
+            with self._lock:
+                self._timeouts += 1
+            raise
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._completed += 1
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def stats(self):
+        """Queue depth and throughput for this lane"""
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "timeout_s": self.timeout,
+                "queued": self._queued,
+                "running": self._running,
+                "max_queued": self._max_queued,
+                "completed": self._completed,
+                "timeouts": self._timeouts,
+                "avg_queue_wait_ms": round(self._total_queue_wait / self._completed * 1000, 3) if self._completed else 0,
+            }
+
+
+class DBLanes:
+    """
+    The API's lanes: quick status queries and heavy reports
+
+    With a snapshot_pool (calprotrack_snapshot), payroll and hours reports get
+    a third lane, `history`, that reads the report snapshot; without one,
+    `history` is simply the reports lane.
+    """
+
+    def __init__(self, pool, status=STATUS_LANE, reports=REPORTS_LANE, snapshot_pool=None):
+        self.status = DBLane("status", pool, *status)
+        self.reports = DBLane("reports", pool, *reports)
+        self.history = DBLane("history", snapshot_pool, *reports) if snapshot_pool is not None else self.reports
+
+    def shutdown(self):
+        self.status.shutdown()
+        self.reports.shutdown()
+        if self.history is not self.reports:
+            self.history.shutdown()
+
+    def stats(self):
+        stats = {"status": self.status.stats(), "reports": self.reports.stats()}
+        if self.history is not self.reports:
+            stats["history"] = self.history.stats()
+        return stats
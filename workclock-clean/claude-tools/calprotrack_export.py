@@ -0,0 +1,209 @@
+"""
+CalProTrack Bulk Export
+Streams every shift (with its segments) that clocked in during a date range
+as NDJSON or CSV, a batch of rows at a time, so memory stays flat no matter
+how many shifts the range holds.
+
+Shifts come out in id order. A client that gets cut off can pick up where it
+left off by passing the last shift id it received as `after_id`.
+
+Ranges that reach into archived months (calprotrack_archive) read those
+months' files too, merged into the same id order.
+"""
+
+import csv
+import io
+import json
+import zlib
+from contextlib import nullcontext
+
+from calprotrack_archive import archive_snapshot
+
+BATCH_SIZE = 1000       # rows pulled per fetchmany()
+
+NDJSON = "ndjson"
+CSV = "csv"
+CONTENT_TYPES = {
+    NDJSON: "application/x-ndjson",
+    CSV: "text/csv",
+}
+
+CSV_COLUMNS = [
+    "shift_id", "company_id", "user_id", "user_name", "clock_in_at", "clock_out_at",
+    "segment_id", "job_site_id", "site_name", "start_at", "end_at",
+]
+
+# Smallest and largest shift id in the range (for one company, if scoped),
+# found on idx_shifts_clock_in / idx_shifts_company_clock_in so the export
+# below can walk shifts in rowid order without sorting
+def id_range_query(scoped=False):
+    company = "company_id = :company_id AND " if scoped else ""
+    return f"""
+    SELECT MIN(id) as first_id, MAX(id) as last_id
+    FROM shifts
+    WHERE {company}clock_in_at >= :start AND clock_in_at < :end
+"""
+
+EXPORT_COLUMNS = """
+        s.id as shift_id,
+        s.company_id,
+        s.user_id,
+        u.name as user_name,
+        s.clock_in_at,
+        s.clock_out_at,
+        ss.id as segment_id,
+        ss.job_site_id,
+        js.name as site_name,
+        ss.start_at,
+        ss.end_at"""
+
+# One row per segment (or one row for a shift without segments), in
+# (shift id, segment id) order. The unary + keeps SQLite walking shifts by
+# rowid; the clock-in check just drops the odd shift inside the id range
+# that clocked in outside the date range.
+def export_query(scoped=False, archives=()):
+    company = "AND +s.company_id = :company_id" if scoped else ""
+    live = f"""
+    SELECT {EXPORT_COLUMNS}
+    FROM shifts s
+    LEFT JOIN users u ON u.id = s.user_id
+    LEFT JOIN shift_segments ss ON ss.shift_id = s.id
+    LEFT JOIN job_sites js ON js.id = ss.job_site_id
+    WHERE s.id > :after_id AND s.id >= :first_id AND s.id <= :last_id
+      AND +s.clock_in_at >= :start AND +s.clock_in_at < :end
+      {company}"""
+    if not archives:
+        return live + "\n    ORDER BY s.id, ss.id\n"
+    # An archive file holds one month, so its shifts are simply filtered by date
+    archived = "".join(f"""
+    UNION ALL
+    SELECT {EXPORT_COLUMNS}
+    FROM {schema}.shifts s
+    LEFT JOIN main.users u ON u.id = s.user_id
+    LEFT JOIN {schema}.shift_segments ss ON ss.shift_id = s.id
+    LEFT JOIN main.job_sites js ON js.id = ss.job_site_id
+    WHERE s.id > :after_id AND s.clock_in_at >= :start AND s.clock_in_at < :end
+      {company}""" for schema in archives)
+    return live + archived + "\n    ORDER BY shift_id, segment_id\n"
+
+ID_RANGE_QUERY = id_range_query()
+COMPANY_ID_RANGE_QUERY = id_range_query(scoped=True)
+EXPORT_QUERY = export_query()
+COMPANY_EXPORT_QUERY = export_query(scoped=True)
+
+
+def _shift_record(row):
+    return {
+        "id": row["shift_id"],
+        "company_id": row["company_id"],
+        "user_id": row["user_id"],
+        "user_name": row["user_name"],
+        "clock_in_at": row["clock_in_at"],
+        "clock_out_at": row["clock_out_at"],
+        "segments": [],
+    }
+
+
+def _segment_record(row):
+    return {
+        "id": row["segment_id"],
+        "job_site_id": row["job_site_id"],
+        "site_name": row["site_name"],
+        "start_at": row["start_at"],
+        "end_at": row["end_at"],
+    }
+
+
+def _ndjson_chunks(batches):
+    """One JSON object per shift, with its segments nested"""
+    current = None
+    for rows in batches:
+        lines = []
+        for row in rows:
+            if current is None or current["id"] != row["shift_id"]:
+                if current is not None:
+                    lines.append(json.dumps(current) + "\n")
+                current = _shift_record(row)
+            if row["segment_id"] is not None:
+                current["segments"].append(_segment_record(row))
+        # A shift whose segments run past this batch stays open for the next one
+        yield "".join(lines)
+    if current is not None:
+        yield json.dumps(current) + "\n"
+
+
+def _csv_chunks(batches):
+    """One CSV line per segment, shift columns repeated"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    for rows in batches:
+        writer.writerows(tuple(row) for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def _gzip_chunks(chunks):
+    """Compress a stream of text chunks into a single gzip member"""
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_shifts(pool, conn, start, end, fmt=NDJSON, after_id=0, gzip=False, company_id=None,
+                  batch_size=BATCH_SIZE, archive_dir=None):
+    """
+    Generator of response body chunks for shifts clocked in during [start, end),
+    optionally only one company's
+
+    Takes ownership of `conn`, a connection checked out of `pool`, and gives it
+    back when the stream ends or is closed. A generator that never started
+    can't: then the caller releases `conn` itself. The whole export reads
+    from one snapshot, so a shift closed mid-export can't show up twice.
+    With an archive_dir, archived months in the range are exported too.
+    """
+    def batches():
+        cursor = conn.cursor()
+        scoped = company_id is not None
+        if archive_dir is None:
+            cursor.execute("BEGIN")
+            snapshot = nullcontext(())
+        else:
+            snapshot = archive_snapshot(conn, archive_dir, [(start, end)])
+        with snapshot as archives:
+            cursor.execute(COMPANY_ID_RANGE_QUERY if scoped else ID_RANGE_QUERY,
+                           {"start": start, "end": end, "company_id": company_id})
+            bounds = cursor.fetchone()
+            if bounds["first_id"] is None and not archives:
+                return
+            cursor.execute(export_query(scoped, tuple(archives)) if archives else
+                           COMPANY_EXPORT_QUERY if scoped else EXPORT_QUERY, {
+                "start": start,
+                "end": end,
+                "after_id": after_id,
+                # No live shifts in the range: an empty id range leaves just the archives
+                "first_id": bounds["first_id"] if bounds["first_id"] is not None else 0,
+                "last_id": bounds["last_id"] if bounds["last_id"] is not None else -1,
+                "company_id": company_id,
+            })
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+
+    chunks = _csv_chunks(batches()) if fmt == CSV else _ndjson_chunks(batches())
+    try:
+        if gzip:
+            yield from _gzip_chunks(chunks)
+        else:
+            for chunk in chunks:
+                if chunk:
+                    yield chunk
+    finally:
+        chunks.close()
+        pool.release(conn)
@@ -0,0 +1,275 @@
+"""
+CalProTrack Load-Test Data Generator
+Fills a database with synthetic companies, employees, job sites and shift
+history, fast enough to build a 10M+ segment dataset in a few minutes.
+
+Everything is added alongside the existing data (new companies, new ids)
+unless --reset is given. The same --seed always generates the same rows
+for the same "now".
+
+Run:
+    python calprotrack_generate.py --db load.db --drop-indexes --companies 50 --users 200 --sites 40 \\
+        --days 365 --shifts-per-day 150
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import time
+from datetime import timedelta
+
+from calprotrack_config import DATABASE_PATH
+from calprotrack_migrations import run_migrations
+from calprotrack_pool import open_connection
+from calprotrack_rollup import refresh_rollup
+from calprotrack_time import utc_now, day_start, db_time, db_epoch
+
+# The demo DB in the repo root doubles as a schema template for new files
+TEMPLATE_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "fieldtrack.db")
+
+BATCH_SIZE = 200_000                # segment rows per transaction
+LOAD_CACHE_KB = 256 * 1024          # page cache while loading
+HOURLY_RATES = (18, 20, 22, 25, 28, 30, 35, 40)
+
+# Shifts start between 05:00 and 11:00 and last 4-10 hours, so none cross midnight
+FIRST_CLOCK_IN = 5 * 3600
+LAST_CLOCK_IN = 11 * 3600
+MIN_SHIFT = 4 * 3600
+MAX_SHIFT = 10 * 3600
+
+# "HH:MM:SS" for every second of the day - much cheaper than strftime per row
+CLOCK = [f"{s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d}" for s in range(86400)]
+
+# Rows carry their *_epoch columns too, so the migration's triggers have nothing to fill in
+SHIFT_INSERT = ("INSERT INTO shifts (id, company_id, user_id, clock_in_at, clock_out_at, created_at, "
+                "clock_in_epoch, clock_out_epoch) VALUES (?, ?, ?, ?, ?, ?, ?, ?)")
+SEGMENT_INSERT = ("INSERT INTO shift_segments (id, company_id, shift_id, job_site_id, start_at, end_at, created_at, "
+                  "start_epoch, end_epoch) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)")
+
+
+def _next_id(conn, table):
+    """First id after everything the table has ever handed out (AUTOINCREMENT never reuses ids)"""
+    used = conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0]
+    seq = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchone()
+    return max(used, seq[0] if seq else 0) + 1
+
+
+def _drop_indexes(conn):
+    """Drop the shift and segment indexes for a bulk load; returns the SQL to recreate them"""
+    indexes = conn.execute("""
+        SELECT name, sql FROM sqlite_master
+        WHERE type = 'index' AND tbl_name IN ('shifts', 'shift_segments') AND sql IS NOT NULL
+    """).fetchall()
+    for name, _ in indexes:
+        conn.execute(f"DROP INDEX {name}")
+    return [sql for _, sql in indexes]
+
+
+def _add_companies(conn, rng, companies, users, sites):
+    """Insert the companies with their users and sites; returns [(company_id, user_ids, site_ids)]"""
+    company_id = _next_id(conn, "companies")
+    user_id = _next_id(conn, "users")
+    site_id = _next_id(conn, "job_sites")
+
+    created = []
+    for _ in range(companies):
+        user_ids = list(range(user_id, user_id + users))
+        site_ids = list(range(site_id, site_id + sites))
+        conn.execute("INSERT INTO companies (id, name) VALUES (?, ?)", (company_id, f"Load Test Co {company_id}"))
+        conn.executemany(
+            "INSERT INTO users (id, company_id, email, name, pass_hash, role, hourly_rate) "
+            "VALUES (?, ?, ?, ?, 'x', 'employee', ?)",
+            [(uid, company_id, f"user{uid}@co{company_id}.test", f"Employee {uid}", rng.choice(HOURLY_RATES))
+             for uid in user_ids],
+        )
+        conn.executemany(
+            "INSERT INTO job_sites (id, company_id, name, address) VALUES (?, ?, ?, ?)",
+            [(sid, company_id, f"Site {sid}", f"{sid} Load Test Rd") for sid in site_ids],
+        )
+        created.append((company_id, user_ids, site_ids))
+        company_id += 1
+        user_id += users
+        site_id += sites
+    return created
+
+
+def generate(db_path, companies=10, users=50, sites=20, days=30, shifts_per_day=40, max_segments=3,
+             seed=42, batch_size=BATCH_SIZE, reset=False, drop_indexes=False, now=None, log=print):
+    """
+    Add `companies` companies with `days` days of shift history ending today
+
+    Each company gets `users` employees and `sites` job sites, and each day
+    `shifts_per_day` of its employees work one shift split over 1 to
+    `max_segments` sites. Today's shifts that haven't ended yet are left open.
+    With drop_indexes, the shift and segment indexes are dropped for the load
+    and rebuilt afterwards (even if it fails or is interrupted): one sort per
+    index is far cheaper than keeping a dozen B-trees up to date row by row,
+    but nothing else should be using the database meanwhile.
+    Returns a summary dict of what was inserted.
+    """
+    rng = random.Random(seed)
+    now = now or utc_now()
+    today = day_start(now)
+    now_second = int((now - today).total_seconds())
+
+    if not os.path.exists(db_path):
+        shutil.copy(TEMPLATE_DB, db_path)
+    # Before the load, so the epoch columns exist and only the existing rows are backfilled
+    run_migrations(db_path)
+
+    started = time.perf_counter()
+    conn = open_connection(db_path, readonly=False)
+    conn.row_factory = None
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute(f"PRAGMA cache_size = -{LOAD_CACHE_KB}")
+    dropped = []
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        if drop_indexes:
+            dropped = _drop_indexes(conn)
+        if reset:
+            log("🗑️  Clearing existing shifts...")
+            conn.execute("DELETE FROM shift_segments")
+            conn.execute("DELETE FROM shifts")
+        created = _add_companies(conn, rng, companies, users, sites)
+        shift_id = _next_id(conn, "shifts")
+        segment_id = _next_id(conn, "shift_segments")
+        conn.commit()
+
+        counts = {"shifts": 0, "open_shifts": 0, "segments": 0}
+        shift_rows = []
+        segment_rows = []
+
+        def flush():
+            conn.execute("BEGIN")
+            conn.executemany(SHIFT_INSERT, shift_rows)
+            conn.executemany(SEGMENT_INSERT, segment_rows)
+            conn.commit()
+            counts["shifts"] += len(shift_rows)
+            counts["segments"] += len(segment_rows)
+            shift_rows.clear()
+            segment_rows.clear()
+
+        # Day by day, oldest first, so the time indexes are filled roughly in order.
+        # Draws use rng.random() directly: randint/choice cost several times more per row.
+        draw = rng.random
+        clock_in_span = LAST_CLOCK_IN - FIRST_CLOCK_IN + 1
+        shift_span = MAX_SHIFT - MIN_SHIFT + 1
+        for day_offset in range(days - 1, -1, -1):
+            is_today = day_offset == 0
+            day = today - timedelta(days=day_offset)
+            date = day.strftime("%Y-%m-%d ")
+            midnight = db_epoch(db_time(day))
+            for company_id, user_ids, site_ids in created:
+                site_count = len(site_ids)
+                for user_id in rng.sample(user_ids, min(shifts_per_day, len(user_ids))):
+                    start = FIRST_CLOCK_IN + int(draw() * clock_in_span)
+                    end = start + MIN_SHIFT + int(draw() * shift_span)
+                    if is_today and start >= now_second:
+                        continue
+                    cuts = {start + 1 + int(draw() * (end - start - 1)) for _ in range(int(draw() * max_segments))}
+                    bounds = [start, *sorted(cuts), end]
+                    sites_worked = [site_ids[int(draw() * site_count)] for _ in range(len(bounds) - 1)]
+
+                    if is_today and end > now_second:
+                        # Still working: keep the segments that have started, the last one open
+                        bounds = [b for b in bounds if b < now_second]
+                        sites_worked = sites_worked[:len(bounds)]
+                        clock_out = clock_out_epoch = None
+                        counts["open_shifts"] += 1
+                    else:
+                        clock_out = date + CLOCK[end]
+                        clock_out_epoch = midnight + end
+
+                    clock_in = date + CLOCK[start]
+                    shift_rows.append((shift_id, company_id, user_id, clock_in, clock_out, clock_in,
+                                       midnight + start, clock_out_epoch))
+                    for i, site_id in enumerate(sites_worked):
+                        start_at = date + CLOCK[bounds[i]]
+                        if i + 1 < len(bounds):
+                            end_at, end_epoch = date + CLOCK[bounds[i + 1]], midnight + bounds[i + 1]
+                        else:
+                            end_at, end_epoch = clock_out, clock_out_epoch
+                        segment_rows.append((segment_id, company_id, shift_id, site_id, start_at, end_at, start_at,
+                                             midnight + bounds[i], end_epoch))
+                        segment_id += 1
+                    shift_id += 1
+
+                    if len(segment_rows) >= batch_size:
+                        flush()
+            log(f"   📅 {date.strip()}: {counts['shifts'] + len(shift_rows):,} shifts, "
+                f"{counts['segments'] + len(segment_rows):,} segments so far")
+        flush()
+    finally:
+        load_seconds = time.perf_counter() - started
+        # Also on KeyboardInterrupt: the dropped indexes must come back either way
+        if conn.in_transaction:
+            conn.rollback()
+        if dropped:
+            log(f"🧱 Rebuilding {len(dropped)} indexes...")
+            for sql in dropped:
+                # IF NOT EXISTS: a rolled-back load also rolled back the DROP
+                conn.execute(sql.replace("INDEX", "INDEX IF NOT EXISTS", 1))
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.close()
+
+    # The rollup is rebuilt from scratch: a normal refresh only picks up
+    # shifts that clocked out recently
+    log("📊 Rebuilding the daily rollup...")
+    refresh_rollup(db_path, full=True)
+
+    return {
+        "companies": len(created),
+        "users": len(created) * users,
+        "sites": len(created) * sites,
+        **counts,
+        "load_seconds": round(load_seconds, 2),
+        "total_seconds": round(time.perf_counter() - started, 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic CalProTrack data for load testing")
+    parser.add_argument("--db", default=DATABASE_PATH,
+                        help="Path to fieldtrack.db (default: DATABASE_PATH; created from the template if missing)")
+    parser.add_argument("--companies", type=int, default=10, help="New companies to create")
+    parser.add_argument("--users", type=int, default=50, help="Employees per company")
+    parser.add_argument("--sites", type=int, default=20, help="Job sites per company")
+    parser.add_argument("--days", type=int, default=30, help="Days of history, ending today")
+    parser.add_argument("--shifts-per-day", type=int, default=40, help="Shifts per company per day")
+    parser.add_argument("--max-segments", type=int, default=3, help="Most job sites visited in one shift")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed (same seed, same data)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Segment rows per transaction")
+    parser.add_argument("--reset", action="store_true", help="Delete all existing shifts first")
+    parser.add_argument("--drop-indexes", action="store_true",
+                        help="Drop the shift indexes during the load and rebuild them after (much faster for "
+                             "big loads; not allowed on DATABASE_PATH, which the servers are using)")
+    args = parser.parse_args()
+
+    if args.users < 1 or args.sites < 1 or args.days < 1 or args.max_segments < 1:
+        parser.error("--users, --sites, --days and --max-segments must be at least 1")
+    if args.drop_indexes and os.path.abspath(args.db) == os.path.abspath(DATABASE_PATH):
+        parser.error("--drop-indexes would leave the live database without indexes; use it with a separate --db")
+
+    print("=" * 70)
+    print("  🏗️  GENERATING LOAD-TEST DATA")
+    print("=" * 70)
+    print(f"   {args.companies} companies × {args.users} employees × {args.sites} sites, "
+          f"{args.days} days × {args.shifts_per_day} shifts/day, seed {args.seed}\n")
+
+    try:
+        result = generate(args.db, args.companies, args.users, args.sites, args.days, args.shifts_per_day,
+                          args.max_segments, args.seed, args.batch_size, args.reset, args.drop_indexes)
+    except sqlite3.Error as e:
+        print(f"❌ Database error: {e}")
+        raise SystemExit(1)
+
+    print(f"\n✅ Done in {result['total_seconds']:.1f}s (load {result['load_seconds']:.1f}s)")
+    print(f"   🏢 Companies: {result['companies']:,}")
+    print(f"   👥 Employees: {result['users']:,}")
+    print(f"   📍 Job sites: {result['sites']:,}")
+    print(f"   📋 Shifts: {result['shifts']:,} ({result['open_shifts']:,} still open)")
+    print(f"   🧩 Segments: {result['segments']:,}")
+    print(f"   ⚡ {result['segments'] / max(result['load_seconds'], 0.001):,.0f} segments/sec")
@@ -0,0 +1,162 @@
+"""
+CalProTrack Fast JSON Responses
+Report endpoints hand their rows back as a FastJSONResponse, which FastAPI
+sends as-is: no per-row re-validation against the response_model, and the
+whole body is encoded to bytes in one call by orjson (the stdlib json when
+orjson isn't installed). Routes keep response_model=, so the OpenAPI docs
+show the same models as before.
+
+What validation used to guarantee is checked once instead: every query
+declared with model_query() must return exactly its model's fields, in the
+model's order, and no column a model declares non-Optional may come straight
+from a nullable table column. check_model_queries() verifies both when the
+API starts.
+
+Settings (environment):
+    CALPROTRACK_VALIDATE_RESPONSES=1    also validate each fast response against its model (development)
+"""
+
+import functools
+import json
+import os
+import re
+import time
+from typing import get_args
+
+from fastapi.responses import Response
+from pydantic import TypeAdapter
+
+from calprotrack_timing import record_phase
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+VALIDATE_RESPONSES = os.environ.get("CALPROTRACK_VALIDATE_RESPONSES", "").strip().lower() in ("1", "true", "yes", "on")
+
+# (model, sql) for every query whose rows are sent without validation
+_model_queries = []
+
+
+class ResponseSchemaError(Exception):
+    """A query's result columns don't match the model its endpoint documents"""
+    pass
+
+
+def dumps(content):
+    """Compact UTF-8 JSON bytes, the same document JSONResponse would send"""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    """JSON response encoded with orjson; its encoding time counts as the request's serialization"""
+
+    media_type = "application/json"
+
+    def render(self, content):
+        started = time.perf_counter()
+        try:
+            return dumps(content)
+        finally:
+            record_phase("serialization", time.perf_counter() - started)
+
+
+@functools.lru_cache(maxsize=None)
+def _adapter(response_type):
+    return TypeAdapter(response_type)
+
+
+def model_response(response_type, content):
+    """Send rows documented as `response_type` (a model or List[model]) without re-validating them"""
+    if VALIDATE_RESPONSES:
+        _adapter(response_type).validate_python(content)
+    return FastJSONResponse(content)
+
+
+def model_query(model, sql):
+    """Declare that `sql` returns `model` rows; check_model_queries() verifies the columns"""
+    _model_queries.append((model, sql))
+    return sql
+
+
+class _NullParams(dict):
+    """Binds NULL to every named parameter, so a query can be prepared without real values"""
+
+    def __missing__(self, key):
+        return None
+
+
+def result_columns(conn, sql):
+    """Column names a query returns, without reading any rows"""
+    cursor = conn.execute(f"SELECT * FROM ({sql}) LIMIT 0", _NullParams())
+    return [column[0] for column in cursor.description]
+
+
+_PARENTHESES = re.compile(r"\([^()]*\)")
+_TABLE = re.compile(r"\b(LEFT\s+(?:OUTER\s+)?)?(?:FROM|JOIN)\s+(\w+)"
+                    r"(?:\s+(?:AS\s+)?(?!(?:ON|USING|WHERE|JOIN|LEFT|INNER|CROSS|GROUP|ORDER|LIMIT)\b)(\w+))?", re.I)
+_COLUMN = re.compile(r"(?:(\w+)\.)?(\w+)(?:\s+AS\s+(\w+))?", re.I)
+
+
+def nullable_columns(conn, sql):
+    """
+    Result columns of `sql` that are a nullable table column passed through
+    as-is: a column without NOT NULL, or any column of a LEFT JOINed table
+
+    Only the last SELECT's plain column references are considered (expressions
+    like COALESCE() or ROUND() aren't), which is how the report queries pass
+    table values through.
+    """
+    outer = sql
+    while _PARENTHESES.search(outer):
+        outer = _PARENTHESES.sub("", outer)
+    select = re.split(r"\bSELECT\b", outer, flags=re.I)[-1]
+    select_list = re.split(r"\bFROM\b", select, maxsplit=1, flags=re.I)[0]
+    aliases = {}
+    for left_join, table, alias in _TABLE.findall(select):
+        notnull = {row[1]: bool(row[3] or row[5]) for row in conn.execute(f"PRAGMA table_info({table})")}
+        aliases[alias or table] = (notnull, bool(left_join))
+    nullable = set()
+    for item in select_list.replace("DISTINCT", "").split(","):
+        match = _COLUMN.fullmatch(item.strip())
+        if match is None:
+            continue
+        alias, column, name = match.groups()
+        if alias is None and len(aliases) == 1:
+            alias = next(iter(aliases))
+        if alias not in aliases or column not in aliases[alias][0]:
+            continue        # a CTE or subquery column, or an expression
+        notnull, left_joined = aliases[alias]
+        if left_joined or not notnull[column]:
+            nullable.add(name or column)
+    return nullable
+
+
+def _optional(field):
+    return type(None) in get_args(field.annotation)
+
+
+def check_model_queries(conn):
+    """
+    Raise ResponseSchemaError unless every declared query returns its model's
+    fields in order (the order is what makes the bytes match the old responses),
+    with every nullable column declared Optional
+
+    Returns the number of queries checked.
+    """
+    problems = []
+    for model, sql in _model_queries:
+        expected = list(model.model_fields)
+        columns = result_columns(conn, sql)
+        if columns != expected:
+            problems.append(f"{model.__name__}: query returns {columns}, model has {expected}")
+            continue
+        for column in sorted(nullable_columns(conn, sql)):
+            if not _optional(model.model_fields[column]):
+                problems.append(f"{model.__name__}: {column} can be NULL but isn't Optional")
+    if problems:
+        raise ResponseSchemaError("; ".join(problems))
+    return len(_model_queries)
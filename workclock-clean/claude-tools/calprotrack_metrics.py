@@ -0,0 +1,115 @@
+"""
+CalProTrack Metrics
+Small thread-safe histograms and the Prometheus text format used by /metrics
+"""
+
+import bisect
+import threading
+
+# Latency buckets in seconds (upper bounds; +Inf is implied)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Counts of observations per bucket, plus their sum"""
+
+    __slots__ = ("buckets", "counts", "count", "sum", "max")
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        # Callers hold their own lock, so this stays a few list operations
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th observation (the last finite bound for the overflow bucket)"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return self.buckets[min(i, len(self.buckets) - 1)]
+        return self.buckets[-1]
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "avg_ms": round(self.sum / self.count * 1000, 3) if self.count else 0,
+            "p50_ms": round(self.quantile(0.5) * 1000, 3),
+            "p95_ms": round(self.quantile(0.95) * 1000, 3),
+            "p99_ms": round(self.quantile(0.99) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+        }
+
+
+class HistogramFamily:
+    """Histograms keyed by a tuple of label values"""
+
+    def __init__(self, label_names, buckets=LATENCY_BUCKETS):
+        self.label_names = label_names
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    def observe(self, labels, value):
+        with self._lock:
+            histogram = self._histograms.get(labels)
+            if histogram is None:
+                histogram = self._histograms[labels] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def items(self):
+        """(labels, Histogram) pairs; the histograms are copies, safe to read without the lock"""
+        with self._lock:
+            copies = []
+            for labels, h in self._histograms.items():
+                copy = Histogram(h.buckets)
+                copy.counts, copy.count, copy.sum, copy.max = list(h.counts), h.count, h.sum, h.max
+                copies.append((labels, copy))
+            return copies
+
+
+# ---- Prometheus text exposition format ----
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def header(name, kind, help_text):
+    return [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+
+
+def sample(name, value, names=(), values=()):
+    return f"{name}{_labels(names, values)} {value}"
+
+
+def histogram_lines(name, help_text, family):
+    """A HistogramFamily as Prometheus histogram lines"""
+    lines = header(name, "histogram", help_text)
+    for labels, h in family.items():
+        cumulative = 0
+        for bound, n in zip(h.buckets + ("+Inf",), h.counts):
+            cumulative += n
+            le = 'le="' + str(bound) + '"'
+            lines.append(f"{name}_bucket{_labels(family.label_names, labels, le)} {cumulative}")
+        lines.append(f"{name}_sum{_labels(family.label_names, labels)} {h.sum:.6f}")
+        lines.append(f"{name}_count{_labels(family.label_names, labels)} {h.count}")
+    return lines
@@ -0,0 +1,213 @@
+"""
+CalProTrack API Migrations
+Indexes and tables the Python API depends on, applied once at startup
+
+db.js owns the core schema. Everything here is additive, and a migration
+either holds the write lock briefly (DDL) or backfills in small batches of
+its own, so the Node server keeps writing while they run.
+"""
+
+from calprotrack_pool import open_connection
+
+# Rows per transaction when a migration backfills an existing table
+BACKFILL_BATCH = 5000
+
+
+def _epoch(column):
+    """SQL for a stored timestamp as integer seconds since 1970 (NULL stays NULL)"""
+    return f"CAST(strftime('%s', {column}) AS INTEGER)"
+
+
+def _epoch_triggers(table, columns):
+    """
+    Triggers that keep `table`'s *_epoch copies of `columns` ({text: epoch})
+    in step with whatever the Node server writes. An INSERT that already
+    supplies the epochs (the bulk generator) skips the extra UPDATE.
+    """
+    assignments = ", ".join(f"{epoch} = {_epoch('NEW.' + text)}" for text, epoch in columns.items())
+    missing = " OR ".join(f"(NEW.{text} IS NOT NULL AND NEW.{epoch} IS NULL)" for text, epoch in columns.items())
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS {table}_epochs_insert AFTER INSERT ON {table}
+            WHEN {missing}
+            BEGIN UPDATE {table} SET {assignments} WHERE id = NEW.id; END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {table}_epochs_update AFTER UPDATE OF {", ".join(columns)} ON {table}
+            BEGIN UPDATE {table} SET {assignments} WHERE id = NEW.id; END""",
+    ]
+
+def _epoch_backfill(tables):
+    """
+    Migration step that fills the *_epoch columns of rows written before the
+    triggers existed, BACKFILL_BATCH ids per transaction. tables is
+    {table: {text: epoch}}. Rows already filled are skipped, so an
+    interrupted run just picks up where it stopped.
+    """
+    def backfill(conn):
+        for table, columns in tables.items():
+            assignments = ", ".join(f"{epoch} = {_epoch(text)}" for text, epoch in columns.items())
+            missing = " OR ".join(f"({text} IS NOT NULL AND {epoch} IS NULL)" for text, epoch in columns.items())
+            low, high = conn.execute(f"SELECT MIN(id), MAX(id) FROM {table}").fetchone()
+            for start in range(low or 0, (high or -1) + 1, BACKFILL_BATCH):
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    conn.execute(f"UPDATE {table} SET {assignments} WHERE id >= ? AND id < ? AND ({missing})",
+                                 (start, start + BACKFILL_BATCH))
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+    return backfill
+
+def _dirty_day_triggers(table, day, columns):
+    """
+    Triggers that record in rollup_dirty_days the day of any `table` row
+    inserted, deleted or changed (in `columns`) for a day before today, so the
+    rollup refresh rebuilds it. `day` is SQL for a row's day, with {row} for
+    NEW or OLD. Today's clock-ins and clock-outs don't match, so the Node
+    server's normal writes add nothing.
+    """
+    def mark(row):
+        return (f"INSERT OR IGNORE INTO rollup_dirty_days (day) "
+                f"SELECT day FROM (SELECT {day.format(row=row)} AS day) WHERE day < date('now');")
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS {table}_dirty_insert AFTER INSERT ON {table}
+            BEGIN {mark('NEW')} END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {table}_dirty_delete AFTER DELETE ON {table}
+            BEGIN {mark('OLD')} END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {table}_dirty_update AFTER UPDATE OF {", ".join(columns)} ON {table}
+            BEGIN {mark('OLD')} {mark('NEW')} END""",
+    ]
+
+SHIFT_EPOCHS = {"clock_in_at": "clock_in_epoch", "clock_out_at": "clock_out_epoch"}
+SEGMENT_EPOCHS = {"start_at": "start_epoch", "end_at": "end_epoch"}
+
+# (name, statements) - applied in order, each one exactly once. statements is
+# either a list run in one transaction, or a function of the connection that
+# runs its own (short) transactions and is recorded as applied once it returns.
+MIGRATIONS = [
+    ("shift_covering_indexes", [
+        # Open-shift counts and lookups: WHERE clock_out_at IS NULL
+        "CREATE INDEX IF NOT EXISTS idx_shifts_open ON shifts(clock_out_at, user_id)",
+        # Per-employee windows: WHERE user_id = ? AND clock_in_at >= ?
+        "CREATE INDEX IF NOT EXISTS idx_shifts_user_clock_in ON shifts(user_id, clock_in_at, clock_out_at)",
+        # Payroll/today windows: WHERE clock_in_at >= ? (covers every column the reports read)
+        "CREATE INDEX IF NOT EXISTS idx_shifts_clock_in_cover ON shifts(clock_in_at, user_id, clock_out_at)",
+    ]),
+    ("daily_rollup", [
+        # Hours and cost per (day, user, job site) for closed days - see calprotrack_rollup.py
+        """CREATE TABLE IF NOT EXISTS daily_user_site_rollup (
+            day TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            job_site_id INTEGER,
+            company_id INTEGER NOT NULL,
+            hours REAL NOT NULL,
+            cost REAL NOT NULL,
+            segment_count INTEGER NOT NULL,
+            shift_count INTEGER NOT NULL,
+            PRIMARY KEY (day, user_id, job_site_id)
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_rollup_user_day ON daily_user_site_rollup(user_id, day)",
+        """CREATE TABLE IF NOT EXISTS rollup_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            covered_until TEXT,
+            watermark TEXT,
+            refreshed_at TEXT
+        )""",
+        # /sites/busy only reads today's and still-open segments
+        "CREATE INDEX IF NOT EXISTS idx_segments_start ON shift_segments(start_at)",
+        "CREATE INDEX IF NOT EXISTS idx_segments_open ON shift_segments(end_at)",
+    ]),
+    ("name_keyset_indexes", [
+        # /sites and /employees pages: WHERE is_active = 1 AND (name, id) > (?, ?) ORDER BY name, id
+        "CREATE INDEX IF NOT EXISTS idx_job_sites_active_name ON job_sites(is_active, name)",
+        "CREATE INDEX IF NOT EXISTS idx_users_active_name ON users(is_active, name)",
+    ]),
+    ("company_scoped_indexes", [
+        # /companies/{company_id}/... - the same lookups as above, led by company_id
+        "CREATE INDEX IF NOT EXISTS idx_shifts_company_open ON shifts(company_id, clock_out_at, clock_in_at, user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_shifts_company_clock_in ON shifts(company_id, clock_in_at, user_id, clock_out_at)",
+        "CREATE INDEX IF NOT EXISTS idx_segments_company_start ON shift_segments(company_id, start_at)",
+        "CREATE INDEX IF NOT EXISTS idx_segments_company_open ON shift_segments(company_id, end_at)",
+        "CREATE INDEX IF NOT EXISTS idx_rollup_company_day ON daily_user_site_rollup(company_id, day)",
+        "CREATE INDEX IF NOT EXISTS idx_job_sites_company_active_name ON job_sites(company_id, is_active, name)",
+        "CREATE INDEX IF NOT EXISTS idx_users_company_active_name ON users(company_id, is_active, name)",
+    ]),
+    ("epoch_columns", [
+        # Integer copies of the shift and segment times, so durations are a subtraction
+        # instead of two julianday() text parses per row. Kept up to date by triggers from
+        # here on; the rows already there are filled by epoch_backfill below.
+        "ALTER TABLE shifts ADD COLUMN clock_in_epoch INTEGER",
+        "ALTER TABLE shifts ADD COLUMN clock_out_epoch INTEGER",
+        "ALTER TABLE shift_segments ADD COLUMN start_epoch INTEGER",
+        "ALTER TABLE shift_segments ADD COLUMN end_epoch INTEGER",
+        *_epoch_triggers("shifts", SHIFT_EPOCHS),
+        *_epoch_triggers("shift_segments", SEGMENT_EPOCHS),
+        # Report windows on the integer columns, covering what the duration math reads
+        "CREATE INDEX IF NOT EXISTS idx_shifts_clock_in_epoch ON shifts(clock_in_epoch, user_id, clock_out_epoch)",
+        "CREATE INDEX IF NOT EXISTS idx_shifts_clock_out_epoch ON shifts(clock_out_epoch, clock_in_epoch, user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_shifts_user_clock_in_epoch ON shifts(user_id, clock_in_epoch, clock_out_epoch)",
+        "CREATE INDEX IF NOT EXISTS idx_shifts_company_clock_in_epoch "
+        "ON shifts(company_id, clock_in_epoch, user_id, clock_out_epoch)",
+        "CREATE INDEX IF NOT EXISTS idx_shifts_company_clock_out_epoch "
+        "ON shifts(company_id, clock_out_epoch, clock_in_epoch, user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_segments_start_epoch ON shift_segments(start_epoch, end_epoch, job_site_id)",
+        "CREATE INDEX IF NOT EXISTS idx_segments_company_start_epoch "
+        "ON shift_segments(company_id, start_epoch, end_epoch, job_site_id)",
+    ]),
+    ("epoch_backfill", _epoch_backfill({"shifts": SHIFT_EPOCHS, "shift_segments": SEGMENT_EPOCHS})),
+    ("archived_months", [
+        # Months moved out of shifts/shift_segments into their own files - see calprotrack_archive.py
+        """CREATE TABLE IF NOT EXISTS archived_months (
+            month TEXT PRIMARY KEY,
+            file TEXT NOT NULL,
+            start_at TEXT NOT NULL,
+            end_at TEXT NOT NULL,
+            shift_count INTEGER NOT NULL,
+            segment_count INTEGER NOT NULL,
+            archived_at TEXT NOT NULL DEFAULT (datetime('now'))
+        )""",
+    ]),
+    ("rollup_dirty_days", [
+        # Past days whose shifts were added, removed or edited since the last rollup refresh
+        "CREATE TABLE IF NOT EXISTS rollup_dirty_days (day TEXT PRIMARY KEY) WITHOUT ROWID",
+        *_dirty_day_triggers("shifts", "substr({row}.clock_in_at, 1, 10)",
+                             ("clock_in_at", "clock_out_at", "user_id", "company_id")),
+        # A segment counts on its shift's day
+        *_dirty_day_triggers("shift_segments",
+                             "(SELECT substr(clock_in_at, 1, 10) FROM shifts WHERE id = {row}.shift_id)",
+                             ("shift_id", "job_site_id", "start_at", "end_at")),
+    ]),
+]
+
+
+def run_migrations(db_path):
+    """Apply any migrations this database hasn't seen yet; returns their names"""
+    conn = open_connection(db_path, readonly=False)
+    try:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS calprotrack_migrations (
+                name TEXT PRIMARY KEY,
+                applied_at TEXT NOT NULL DEFAULT (datetime('now'))
+            )
+        """)
+        applied = {row["name"] for row in conn.execute("SELECT name FROM calprotrack_migrations")}
+
+        newly_applied = []
+        for name, statements in MIGRATIONS:
+            if name in applied:
+                continue
+            if callable(statements):
+                statements(conn)
+                statements = []
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for statement in statements:
+                    conn.execute(statement)
+                conn.execute("INSERT INTO calprotrack_migrations (name) VALUES (?)", (name,))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            newly_applied.append(name)
+        return newly_applied
+    finally:
+        conn.close()
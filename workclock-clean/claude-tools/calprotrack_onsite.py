@@ -0,0 +1,408 @@
+"""
+CalProTrack On-Site State
+An in-memory index of open shifts and segments, so /active, /sites/busy and
+the / stats answer from memory instead of re-running SQL on every call.
+
+The state is seeded once and then kept current from the activity watcher's
+row-id deltas (see calprotrack_activity.py), so it trails the database by at
+most one watcher poll. /state/check recounts everything in SQL and reports
+any difference.
+
+Companies, users and job sites aren't in the watcher's deltas. Each batch
+only picks up rows added since the last one (an id seek), so a new user or
+site shows up with their first shift; edits to names, addresses and
+is_active flags are picked up by a full reload every LOOKUP_REFRESH_SECONDS.
+"""
+
+import threading
+import time
+from datetime import datetime
+
+from calprotrack_time import utc_now, parse_db_time, day_start, day_window, db_epoch
+
+EPOCH = datetime(1970, 1, 1)
+
+# How long /state/check gives the watcher to catch up before reporting a mismatch
+CHECK_RETRY_SECONDS = 1.5
+
+# How often the watcher reloads every company, user and job site to catch edits
+LOOKUP_REFRESH_SECONDS = 60.0
+
+
+def _seconds(value):
+    """Stored timestamp (or datetime) -> seconds since the epoch"""
+    if isinstance(value, str):
+        value = parse_db_time(value)
+    return (value - EPOCH).total_seconds()
+
+
+class Shift:
+    __slots__ = ("id", "company_id", "user_id", "clock_in_at", "open_segments")
+
+    def __init__(self, id, company_id, user_id, clock_in_at):
+        self.id = id
+        self.company_id = company_id
+        self.user_id = user_id
+        self.clock_in_at = clock_in_at
+        self.open_segments = set()
+
+
+class Segment:
+    __slots__ = ("id", "shift_id", "company_id", "user_id", "site_id", "start_at", "start")
+
+    def __init__(self, id, shift_id, company_id, user_id, site_id, start_at):
+        self.id = id
+        self.shift_id = shift_id
+        self.company_id = company_id
+        self.user_id = user_id
+        self.site_id = site_id
+        self.start_at = start_at
+        self.start = _seconds(start_at)
+
+
+class User:
+    __slots__ = ("id", "company_id", "name", "email", "is_active")
+
+    def __init__(self, id, company_id, name, email, is_active):
+        self.id = id
+        self.company_id = company_id
+        self.name = name
+        self.email = email
+        self.is_active = is_active
+
+
+class Site:
+    __slots__ = ("id", "company_id", "name", "address", "is_active")
+
+    def __init__(self, id, company_id, name, address, is_active):
+        self.id = id
+        self.company_id = company_id
+        self.name = name
+        self.address = address
+        self.is_active = is_active
+
+
+# Lookup rows with an id above the largest one already loaded (all of them for 0)
+COMPANIES_QUERY = "SELECT id FROM companies WHERE id > ?"
+USERS_QUERY = "SELECT id, company_id, name, email, is_active FROM users WHERE id > ?"
+SITES_QUERY = "SELECT id, company_id, name, address, is_active FROM job_sites WHERE id > ?"
+
+OPEN_SHIFTS_QUERY = "SELECT id, company_id, user_id, clock_in_at FROM shifts WHERE clock_out_at IS NULL"
+
+OPEN_SEGMENTS_QUERY = """
+    SELECT ss.id, ss.shift_id, ss.company_id, s.user_id, ss.job_site_id, ss.start_at
+    FROM shift_segments ss
+    JOIN shifts s ON s.id = ss.shift_id
+    WHERE ss.end_at IS NULL
+"""
+
+# Hours of segments that started today and are already closed, per site
+CLOSED_TODAY_QUERY = """
+    SELECT job_site_id, SUM(end_epoch - start_epoch) / 3600.0 as hours
+    FROM shift_segments
+    WHERE start_epoch >= ? AND start_epoch < ? AND end_epoch IS NOT NULL
+    GROUP BY job_site_id
+"""
+
+
+class OnSiteState:
+    """Open shifts and segments, who is at which site, and hours worked per site today"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.ready = False
+        self.seeded_at = None
+        self.updates = 0
+
+        self.shifts = {}            # shift id -> Shift (open shifts only)
+        self.segments = {}          # segment id -> Segment (open segments only)
+        self.user_shifts = {}       # user id -> set of open shift ids
+        self.site_users = {}        # site id -> set of user ids with an open segment on an open shift
+        self.companies = set()
+        self.users = {}             # user id -> User
+        self.sites = {}             # site id -> Site
+        self.closed_today = {}      # site id -> hours of today's closed segments
+        self._today = None          # epoch seconds of the midnight closed_today belongs to
+        self._lookups_at = None     # time.monotonic() of the last full lookup reload
+        self._last_ids = {}         # lookup query -> largest id it has loaded
+
+    # ---- activity watcher thread ----
+
+    def seed(self, conn):
+        """Load everything from the watcher's snapshot"""
+        now = utc_now()
+        start, end = day_window(now)
+        with self._lock:
+            self.shifts = {}
+            self.segments = {}
+            self.user_shifts = {}
+            self.site_users = {}
+            self._load_lookups(conn)
+            for row in conn.execute(OPEN_SHIFTS_QUERY):
+                self._open_shift(row["id"], row["company_id"], row["user_id"], row["clock_in_at"])
+            for row in conn.execute(OPEN_SEGMENTS_QUERY):
+                self._open_segment(row["id"], row["shift_id"], row["company_id"], row["user_id"],
+                                   row["job_site_id"], row["start_at"])
+            self._today = _seconds(start)
+            window = (db_epoch(start), db_epoch(end))
+            self.closed_today = {row["job_site_id"]: row["hours"] for row in conn.execute(CLOSED_TODAY_QUERY, window)}
+            self.seeded_at = now
+            self.ready = True
+
+    def update(self, conn, events):
+        """Apply one batch of watcher events"""
+        with self._lock:
+            self._load_lookups(conn, full=time.monotonic() - self._lookups_at >= LOOKUP_REFRESH_SECONDS)
+            self._roll_day(utc_now())
+            for event in events:
+                kind = event["type"]
+                if kind == "clock_in":
+                    self._open_shift(event["shift_id"], event["company_id"], event["user_id"], event["at"])
+                elif kind == "clock_out":
+                    self._close_shift(event["shift_id"])
+                elif kind == "segment_start":
+                    self._open_segment(event["segment_id"], event["shift_id"], event["company_id"],
+                                       event["user_id"], event["job_site_id"], event["at"])
+                elif kind == "segment_end":
+                    self._close_segment(event["segment_id"], event["at"])
+            self.updates += 1
+
+    def _load_lookups(self, conn, full=True):
+        """Reload companies, users and job sites, or with full=False just add new ones"""
+        if full:
+            self.companies, self.users, self.sites = set(), {}, {}
+            self._last_ids = {}
+            self._lookups_at = time.monotonic()
+        self.companies.update(row[0] for row in self._new_rows(conn, COMPANIES_QUERY))
+        self.users.update((row[0], User(*row)) for row in self._new_rows(conn, USERS_QUERY))
+        self.sites.update((row[0], Site(*row)) for row in self._new_rows(conn, SITES_QUERY))
+
+    def _new_rows(self, conn, query):
+        rows = conn.execute(query, (self._last_ids.get(query, 0),)).fetchall()
+        if rows:
+            self._last_ids[query] = max(row[0] for row in rows)
+        return rows
+
+    def _roll_day(self, now):
+        """Forget yesterday's closed-segment hours once the UTC day changes"""
+        today = _seconds(day_start(now))
+        if today != self._today:
+            self._today = today
+            self.closed_today = {}
+
+    def _open_shift(self, shift_id, company_id, user_id, clock_in_at):
+        self.shifts[shift_id] = Shift(shift_id, company_id, user_id, clock_in_at)
+        self.user_shifts.setdefault(user_id, set()).add(shift_id)
+
+    def _close_shift(self, shift_id):
+        shift = self.shifts.pop(shift_id, None)
+        if shift is None:
+            return
+        shifts = self.user_shifts.get(shift.user_id)
+        if shifts is not None:
+            shifts.discard(shift_id)
+            if not shifts:
+                del self.user_shifts[shift.user_id]
+        # Any segment still open on it no longer counts as someone on site
+        for segment_id in shift.open_segments:
+            segment = self.segments.get(segment_id)
+            if segment is not None:
+                self._leave_site(segment.site_id, segment.user_id)
+
+    def _open_segment(self, segment_id, shift_id, company_id, user_id, site_id, start_at):
+        segment = Segment(segment_id, shift_id, company_id, user_id, site_id, start_at)
+        self.segments[segment_id] = segment
+        shift = self.shifts.get(shift_id)
+        if shift is not None:
+            shift.open_segments.add(segment_id)
+            self.site_users.setdefault(site_id, set()).add(user_id)
+
+    def _close_segment(self, segment_id, end_at):
+        segment = self.segments.pop(segment_id, None)
+        if segment is None:
+            return
+        if segment.start >= self._today:
+            hours = (_seconds(end_at) - segment.start) / 3600
+            self.closed_today[segment.site_id] = self.closed_today.get(segment.site_id, 0.0) + hours
+        shift = self.shifts.get(segment.shift_id)
+        if shift is not None:
+            shift.open_segments.discard(segment_id)
+            self._leave_site(segment.site_id, segment.user_id)
+
+    def _leave_site(self, site_id, user_id):
+        """Drop user_id from the site unless another of their open segments is there"""
+        for shift_id in self.user_shifts.get(user_id, ()):
+            for segment_id in self.shifts[shift_id].open_segments:
+                segment = self.segments.get(segment_id)
+                if segment is not None and segment.site_id == site_id:
+                    return
+        users = self.site_users.get(site_id)
+        if users is not None:
+            users.discard(user_id)
+            if not users:
+                del self.site_users[site_id]
+
+    # ---- reads (request side) ----
+
+    def has_company(self, company_id):
+        with self._lock:
+            return company_id in self.companies
+
+    def root_stats(self, company_id=None):
+        """Same counts as ROOT_STATS_QUERY"""
+        with self._lock:
+            return {
+                "active_employees": sum(1 for u in self.users.values()
+                                        if u.is_active == 1 and company_id in (None, u.company_id)),
+                "active_sites": sum(1 for s in self.sites.values()
+                                    if s.is_active == 1 and company_id in (None, s.company_id)),
+                "currently_clocked_in": sum(1 for s in self.shifts.values() if company_id in (None, s.company_id)),
+            }
+
+    def active_employees(self, company_id=None):
+        """Same rows as the /active query"""
+        now = _seconds(utc_now())
+        rows = []
+        with self._lock:
+            for shift in self.shifts.values():
+                if company_id is not None and shift.company_id != company_id:
+                    continue
+                # The site of the most recent open segment
+                current = max((self.segments[i] for i in shift.open_segments if i in self.segments),
+                              key=lambda seg: seg.start_at, default=None)
+                user = self.users.get(shift.user_id)
+                site = self.sites.get(current.site_id) if current is not None else None
+                if user is None or site is None:
+                    continue
+                rows.append({
+                    "user_id": user.id,
+                    "name": user.name,
+                    "email": user.email,
+                    "site_name": site.name,
+                    "site_address": site.address or "No address",
+                    "clocked_in_at": shift.clock_in_at,
+                    "hours_today": round((now - _seconds(shift.clock_in_at)) / 3600, 2),
+                })
+        rows.sort(key=lambda row: row["clocked_in_at"], reverse=True)
+        return rows
+
+    def busy_sites(self, company_id=None):
+        """Same rows as SITES_BUSY_QUERY"""
+        now_dt = utc_now()
+        now = _seconds(now_dt)
+        rows = []
+        with self._lock:
+            self._roll_day(now_dt)
+            tomorrow = self._today + 86400
+            open_hours = {}
+            for segment in self.segments.values():
+                if self._today <= segment.start < tomorrow:
+                    open_hours[segment.site_id] = open_hours.get(segment.site_id, 0.0) + (now - segment.start) / 3600
+            for site in self.sites.values():
+                if site.is_active != 1 or (company_id is not None and site.company_id != company_id):
+                    continue
+                hours = self.closed_today.get(site.id, 0.0) + open_hours.get(site.id, 0.0)
+                rows.append({
+                    "site_id": site.id,
+                    "site_name": site.name,
+                    "site_address": site.address,
+                    "active_employees": len(self.site_users.get(site.id, ())),
+                    "total_hours_today": round(hours, 2),
+                })
+        rows.sort(key=lambda row: (-row["active_employees"], -row["total_hours_today"]))
+        return rows
+
+    # ---- consistency check ----
+
+    def _snapshot(self):
+        with self._lock:
+            return {
+                "open_shifts": set(self.shifts),
+                "open_segments": set(self.segments),
+                "site_users": {site: set(users) for site, users in self.site_users.items() if users},
+                "closed_today": {site: round(hours, 4) for site, hours in self.closed_today.items()},
+            }
+
+    @staticmethod
+    def _recount(conn):
+        """The same sets, recounted from scratch in SQL"""
+        start, end = day_window(utc_now())
+        window = (db_epoch(start), db_epoch(end))
+        site_users = {}
+        for row in conn.execute("""
+            SELECT DISTINCT ss.job_site_id, s.user_id
+            FROM shift_segments ss
+            JOIN shifts s ON s.id = ss.shift_id
+            WHERE ss.end_at IS NULL AND s.clock_out_at IS NULL
+        """):
+            site_users.setdefault(row[0], set()).add(row[1])
+        return {
+            "open_shifts": {row[0] for row in conn.execute("SELECT id FROM shifts WHERE clock_out_at IS NULL")},
+            "open_segments": {row[0] for row in conn.execute("SELECT id FROM shift_segments WHERE end_at IS NULL")},
+            "site_users": site_users,
+            "closed_today": {row[0]: round(row[1], 4) for row in conn.execute(CLOSED_TODAY_QUERY, window)},
+        }
+
+    @staticmethod
+    def _differences(memory, sql):
+        differences = {}
+        for key in ("open_shifts", "open_segments"):
+            missing, extra = sorted(sql[key] - memory[key]), sorted(memory[key] - sql[key])
+            if missing or extra:
+                differences[key] = {"missing": missing, "extra": extra}
+        if memory["site_users"] != sql["site_users"]:
+            sites = set(memory["site_users"]) | set(sql["site_users"])
+            differences["site_users"] = {
+                site: {"memory": sorted(memory["site_users"].get(site, ())), "sql": sorted(sql["site_users"].get(site, ()))}
+                for site in sorted(sites) if memory["site_users"].get(site) != sql["site_users"].get(site)
+            }
+        sites = set(memory["closed_today"]) | set(sql["closed_today"])
+        hours = {
+            site: {"memory": memory["closed_today"].get(site, 0), "sql": sql["closed_today"].get(site, 0)}
+            for site in sorted(sites)
+            if abs(memory["closed_today"].get(site, 0) - sql["closed_today"].get(site, 0)) > 0.001
+        }
+        if hours:
+            differences["closed_today"] = hours
+        return differences
+
+    def verify(self, conn):
+        """
+        Compare the in-memory state with a full SQL recount
+
+        The state may trail the database by one watcher poll, so a mismatch is
+        re-checked once after CHECK_RETRY_SECONDS before it is reported.
+        """
+        if not self.ready:
+            return {"consistent": False, "ready": False, "differences": {}}
+        started = time.perf_counter()
+        for attempt in range(2):
+            conn.execute("BEGIN")
+            try:
+                sql = self._recount(conn)
+            finally:
+                conn.commit()
+            differences = self._differences(self._snapshot(), sql)
+            if not differences or attempt:
+                break
+            time.sleep(CHECK_RETRY_SECONDS)
+        return {
+            "consistent": not differences,
+            "ready": True,
+            "open_shifts": len(sql["open_shifts"]),
+            "open_segments": len(sql["open_segments"]),
+            "sites_with_people": len(sql["site_users"]),
+            "check_ms": round((time.perf_counter() - started) * 1000, 3),
+            "differences": differences,
+        }
+
+    def stats(self):
+        with self._lock:
+            return {
+                "ready": self.ready,
+                "seeded_at": self.seeded_at.strftime("%Y-%m-%d %H:%M:%S") if self.seeded_at else None,
+                "updates": self.updates,
+                "open_shifts": len(self.shifts),
+                "open_segments": len(self.segments),
+                "sites_with_people": len(self.site_users),
+            }
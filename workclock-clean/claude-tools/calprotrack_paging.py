@@ -0,0 +1,94 @@
+"""
+CalProTrack Paging
+Keyset pagination, field projection and ETags for the list endpoints
+
+Pages are cut on (name, id) instead of OFFSET, so page 500 costs the same as
+page 1. The cursor handed back as `next_after` is opaque to clients: just
+pass it back as `after` to get the next page.
+"""
+
+import base64
+import hashlib
+import json
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse, Response
+
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(row):
+    """Cursor pointing just past `row`"""
+    raw = json.dumps([row["name"], row["id"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(after):
+    """(name, id) from a cursor made by encode_cursor"""
+    try:
+        padded = after + "=" * (-len(after) % 4)
+        name, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(name, str) or not isinstance(row_id, int):
+            raise ValueError
+        return name, row_id
+    except (ValueError, TypeError):
+        # Bad base64/JSON, or JSON that isn't a [name, id] pair (e.g. "MQ" is just 1)
+        raise HTTPException(status_code=400, detail="Invalid 'after' cursor")
+
+
+def check_limit(limit):
+    if limit is not None and not 1 <= limit <= MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_PAGE_SIZE}")
+
+
+def parse_fields(fields, allowed):
+    """Columns requested with ?fields=a,b - all of `allowed` when not given"""
+    if not fields:
+        return allowed
+    requested = tuple(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+    unknown = [f for f in requested if f not in allowed]
+    if unknown or not requested:
+        raise HTTPException(status_code=400, detail=f"fields must be from: {', '.join(allowed)}")
+    return requested
+
+
+def keyset_page(conn, table, fields, limit=None, after=None, company_id=None):
+    """
+    Active rows of `table` in (name, id) order, projected to `fields`, optionally for one company
+
+    Returns (rows, next_after); next_after is None on the last page. Without
+    a limit every row comes back in one page, like before paging existed.
+    """
+    # name and id are always read - they make up the cursor
+    columns = ", ".join(dict.fromkeys(fields + ("name", "id")))
+    company = "company_id = ? AND " if company_id is not None else ""
+    query = f"SELECT {columns} FROM {table} WHERE {company}is_active = 1"
+    params = [company_id] if company_id is not None else []
+    if after is not None:
+        query += " AND (name, id) > (?, ?)"
+        params.extend(decode_cursor(after))
+    query += " ORDER BY name, id"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit + 1)
+
+    rows = conn.execute(query, params).fetchall()
+    next_after = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_after = encode_cursor(rows[-1])
+    return [{f: row[f] for f in fields} for row in rows], next_after
+
+
+def etag_for(payload):
+    """Weak ETag from the JSON body"""
+    body = json.dumps(payload, sort_keys=True, default=str)
+    return 'W/"' + hashlib.sha1(body.encode()).hexdigest() + '"'
+
+
+def etag_response(request, payload, etag):
+    """304 when the client already has this version, else the JSON body with its ETag"""
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in (tag.strip() for tag in if_none_match.split(",")) or if_none_match.strip() == "*":
+        return Response(status_code=304, headers={"ETag": etag})
+    return JSONResponse(payload, headers={"ETag": etag})
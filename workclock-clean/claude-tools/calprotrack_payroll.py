@@ -0,0 +1,334 @@
+"""
+CalProTrack Payroll Engine
+Segment-accurate payroll with overtime, computed with NumPy
+
+The SQL reports (/payroll, /employee/{id}/hours) pay whole-shift duration at
+the hourly rate. This engine works from shift_segments instead: it loads the
+segments that can affect a window into arrays, clips them to the window and
+splits every one into regular, overtime and double-time hours per user and
+job site - sorting, running totals and bincounts, no per-row Python.
+
+Rules (thresholds from calprotrack_config; UTC days and Monday-Sunday weeks):
+    daily overtime      workday hours past 8 are paid 1.5x
+    daily double time   workday hours past 12 are paid 2x
+    weekly overtime     regular hours past 40 in a week are paid 1.5x
+A shift's first 24 hours belong to the day it clocked in on, so a night
+shift is one workday; hours a shift runs past that (one left open for days)
+count on the UTC day they fall on, each its own workday. Hours already paid as daily overtime don't count towards the
+weekly 40. Hours worked earlier in the same day or week but before the
+window still count towards the thresholds; only hours inside it are paid.
+
+Shifts still open count up to "now". Shifts that cross the window start are
+looked for up to SHIFT_LOOKBACK_DAYS back (open ones at any age); an open
+shift older than that is paid without the rest of its day and week.
+"""
+
+import json
+from contextlib import nullcontext
+from datetime import timedelta
+
+import numpy as np
+
+from calprotrack_config import DAILY_OVERTIME_HOURS, DAILY_DOUBLE_TIME_HOURS, WEEKLY_OVERTIME_HOURS
+from calprotrack_archive import archive_snapshot
+from calprotrack_pool import read_snapshot
+from calprotrack_time import db_time, db_epoch, parse_db_time
+
+OVERTIME_RATE = 1.5
+DOUBLE_TIME_RATE = 2.0
+SHIFT_LOOKBACK_DAYS = 7
+EPOCH_WEEKDAY = 3       # 1970-01-01 was a Thursday: (day + 3) // 7 numbers Monday-Sunday weeks
+
+HOUR_COLUMNS = ("regular_hours", "overtime_hours", "double_time_hours")
+
+
+class OvertimeRules:
+    """Overtime thresholds in hours (0 or None turns one off) and the premium rates"""
+
+    def __init__(self, daily_overtime=DAILY_OVERTIME_HOURS, daily_double_time=DAILY_DOUBLE_TIME_HOURS,
+                 weekly_overtime=WEEKLY_OVERTIME_HOURS, overtime_rate=OVERTIME_RATE,
+                 double_time_rate=DOUBLE_TIME_RATE):
+        self.daily_overtime = daily_overtime or None
+        self.daily_double_time = daily_double_time or None
+        self.weekly_overtime = weekly_overtime or None
+        self.overtime_rate = overtime_rate
+        self.double_time_rate = double_time_rate
+
+
+DEFAULT_RULES = OvertimeRules()
+
+
+# ==================== LOADING ====================
+
+def row_filter(company_id=None, user_id=None, table=""):
+    """`... AND ` prefix limiting shifts to one company and/or user"""
+    prefix = f"{table}." if table else ""
+    parts = []
+    if company_id is not None:
+        parts.append(f"{prefix}company_id = :company_id AND ")
+    if user_id is not None:
+        parts.append(f"{prefix}user_id = :user_id AND ")
+    return "".join(parts)
+
+
+def first_crossing_query(filters="", schema="main"):
+    """Earliest clock-in of a closed shift that runs into the window from the days before it"""
+    return f"""
+    SELECT MIN(clock_in_epoch) FROM {schema}.shifts
+    WHERE {filters}clock_in_epoch >= :lookback AND clock_in_epoch < :since AND clock_out_epoch > :since
+"""
+
+
+def segments_query(filters="", schema="main"):
+    """Segments of the shifts clocked in from :load_from, plus shifts still open from before it"""
+    return f"""
+    SELECT s.user_id, ss.job_site_id, s.clock_in_epoch, ss.start_epoch,
+           COALESCE(ss.end_epoch, s.clock_out_epoch, :now)
+    FROM {schema}.shifts s
+    JOIN {schema}.shift_segments ss ON ss.shift_id = s.id
+    WHERE {filters}s.clock_in_epoch >= :load_from AND s.clock_in_epoch < :until
+    UNION ALL
+    SELECT s.user_id, ss.job_site_id, s.clock_in_epoch, ss.start_epoch, COALESCE(ss.end_epoch, :now)
+    FROM {schema}.shifts s
+    JOIN {schema}.shift_segments ss ON ss.shift_id = s.id
+    WHERE {filters}s.clock_out_epoch IS NULL AND s.clock_in_epoch < :load_from
+"""
+
+
+def week_start(seconds):
+    """Midnight (UTC) on the Monday of the week containing `seconds` (both seconds since 1970)"""
+    day = seconds // 86400
+    return (day - (day + EPOCH_WEEKDAY) % 7) * 86400
+
+
+def split_workdays(users, sites, clock_ins, starts, ends):
+    """
+    (users, sites, workdays, starts, ends) with each segment's hours on their
+    workday: the clock-in day for the shift's first 24 hours, then the UTC day
+    they fall on. Segments reaching past those boundaries are split there.
+    """
+    cutoffs = clock_ins + 86400
+    workdays = clock_ins // 86400
+    late = ends > cutoffs
+    if not late.any():
+        return users, sites, workdays, starts, ends
+    # The clock-in day's part: every segment, cut off after 24 hours (late ones that start after that drop out)
+    early = starts < cutoffs
+    head = (users[early], sites[early], workdays[early], starts[early], np.minimum(ends, cutoffs)[early])
+    # The rest, one piece per UTC day it touches
+    low, high = np.maximum(starts[late], cutoffs[late]), ends[late]
+    first_day = low // 86400
+    days = np.maximum((high - 1) // 86400 - first_day + 1, 0)
+    piece = np.repeat(np.arange(len(low)), days)
+    day = first_day[piece] + np.arange(len(piece)) - np.repeat(np.cumsum(days) - days, days)
+    tail = (users[late][piece], sites[late][piece], day,
+            np.maximum(low[piece], day * 86400), np.minimum(high[piece], (day + 1) * 86400))
+    return tuple(np.concatenate(parts) for parts in zip(head, tail))
+
+
+def load_segments(conn, since, until, now, company_id=None, user_id=None, schemas=()):
+    """
+    Arrays (users, sites, workdays, starts, ends) of every segment that can
+    affect pay in [since, until): the window's own plus the earlier hours of
+    the days and weeks it starts in. Times are seconds since 1970, workdays
+    days since 1970. Run inside one read transaction.
+
+    since, until and now are seconds since 1970 too: the query reads the
+    integer *_epoch columns, so the rows arrive as plain ints. `schemas` are
+    attached archive months to read alongside the live tables.
+    """
+    filters = row_filter(company_id, user_id)
+    params = {"company_id": company_id, "user_id": user_id, "since": since, "until": until, "now": now,
+              "lookback": since - SHIFT_LOOKBACK_DAYS * 86400}
+
+    # Context starts at the Monday of the earliest workday that reaches into the window
+    sources = ("main", *schemas)
+    first = min((conn.execute(first_crossing_query(filters, schema), params).fetchone()[0] or since
+                 for schema in sources), default=since)
+    params["load_from"] = week_start(min(first, since))
+
+    segment_filters = row_filter(company_id, user_id, "s")
+    rows = []
+    for schema in sources:
+        rows += conn.execute(segments_query(segment_filters, schema), params).fetchall()
+    if not rows:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty, empty, empty
+    users, sites, clock_ins, starts, ends = np.array(rows, dtype=np.int64).T
+    return split_workdays(users, sites, clock_ins, starts, np.maximum(ends, starts))
+
+
+# ==================== COMPUTATION ====================
+
+def _split_at(users, sites, workdays, starts, ends, moment):
+    """Cut every segment that spans `moment` in two, so each piece is wholly before or after it"""
+    spans = (starts < moment) & (ends > moment)
+    if not spans.any():
+        return users, sites, workdays, starts, ends
+    return (np.concatenate([users, users[spans]]), np.concatenate([sites, sites[spans]]),
+            np.concatenate([workdays, workdays[spans]]),
+            np.concatenate([starts, np.full(spans.sum(), moment)]),
+            np.concatenate([np.where(spans, moment, ends), ends[spans]]))
+
+
+def _segment_order(users, workdays, starts):
+    """Indices that sort segments by (user, workday, start)"""
+    if not len(users):
+        return np.zeros(0, dtype=np.intp)
+    first_day, first_start = workdays.min(), starts.min()
+    days = int(workdays.max() - first_day) + 1
+    span = int(starts.max() - first_start) + 1
+    if (int(users.max()) + 1) * days * span < 2 ** 62:
+        # One int64 key sorts several times faster than lexsort on three
+        return np.argsort((users * days + (workdays - first_day)) * span + (starts - first_start))
+    return np.lexsort((starts, workdays, users))
+
+
+def _running_before(values, group_starts):
+    """Running total of `values` before each row, restarting where group_starts is True (rows in group order)"""
+    before = np.cumsum(values) - values
+    group = np.cumsum(group_starts) - 1
+    return before - before[group_starts][group]
+
+
+def _overlap(before, after, low, high=np.inf):
+    """How much of each [before, after) stretch of a running total lies in [low, high)"""
+    return np.clip(after, low, high) - np.clip(before, low, high)
+
+
+def classify_hours(users, workdays, starts, ends, rules=DEFAULT_RULES):
+    """
+    Regular, overtime and double-time hours of each segment, in input order
+
+    Segments are ranked by (user, workday, start); each one's place in the
+    running total of its workday and of its week decides which of its hours
+    pass a threshold.
+    """
+    order = _segment_order(users, workdays, starts)
+    users, workdays = users[order], workdays[order]
+    hours = (ends[order] - starts[order]) / 3600.0
+
+    new_user = np.ones(len(users), dtype=bool)
+    new_user[1:] = users[1:] != users[:-1]
+    new_day = new_user.copy()
+    new_day[1:] |= workdays[1:] != workdays[:-1]
+
+    day_before = _running_before(hours, new_day)
+    day_after = day_before + hours
+    straight_time = min(rules.daily_overtime or np.inf, rules.daily_double_time or np.inf)
+    regular = _overlap(day_before, day_after, 0.0, straight_time)
+    if rules.daily_double_time:
+        double = _overlap(day_before, day_after, rules.daily_double_time)
+    else:
+        double = np.zeros_like(hours)
+    overtime = hours - regular - double
+
+    if rules.weekly_overtime:
+        weeks = (workdays + EPOCH_WEEKDAY) // 7
+        new_week = new_user.copy()
+        new_week[1:] |= weeks[1:] != weeks[:-1]
+        week_before = _running_before(regular, new_week)
+        weekly = _overlap(week_before, week_before + regular, rules.weekly_overtime)
+        regular = regular - weekly
+        overtime = overtime + weekly
+
+    # Back to input order
+    result = np.empty((3, len(order)))
+    result[:, order] = regular, overtime, double
+    return result
+
+
+def pay_hours(users, sites, workdays, starts, ends, since, until, rules=DEFAULT_RULES):
+    """
+    Hours inside [since, until) (epoch seconds) per (user, site)
+
+    Returns (user_ids, site_ids, hours) with hours shaped (3, pairs):
+    regular, overtime and double time.
+    """
+    ends = np.minimum(ends, until)
+    live = starts < ends
+    users, sites, workdays, starts, ends = users[live], sites[live], workdays[live], starts[live], ends[live]
+    users, sites, workdays, starts, ends = _split_at(users, sites, workdays, starts, ends, since)
+    # Sum in (user, workday, start) order, so rounding can't depend on the order rows were loaded in
+    order = _segment_order(users, workdays, starts)
+    users, sites, workdays, starts, ends = users[order], sites[order], workdays[order], starts[order], ends[order]
+
+    hours = classify_hours(users, workdays, starts, ends, rules)
+    paid = starts >= since
+    if not paid.any():
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, np.zeros((3, 0))
+
+    site_span = int(sites.max()) + 1
+    pairs, pair_index = np.unique(users[paid] * site_span + sites[paid], return_inverse=True)
+    totals = np.stack([np.bincount(pair_index, weights=h[paid], minlength=len(pairs)) for h in hours])
+    return pairs // site_span, pairs % site_span, totals
+
+
+# ==================== REPORTS ====================
+
+def _hours_entry(regular, overtime, double, rate, rules):
+    return {
+        "regular_hours": round(regular, 2),
+        "overtime_hours": round(overtime, 2),
+        "double_time_hours": round(double, 2),
+        "total_hours": round(regular + overtime + double, 2),
+        "total_pay": round(rate * (regular + rules.overtime_rate * overtime + rules.double_time_rate * double), 2),
+    }
+
+
+def payroll(conn, since, until, now, company_id=None, user_id=None, by_site=False, rules=DEFAULT_RULES,
+            archive_dir=None):
+    """
+    Pay per employee for [since, until) (stored-timestamp strings), highest
+    hours first. With by_site, each entry lists its hours per job site too.
+    With an archive_dir, archived months the window (or the days and weeks
+    before it) reaches into are read as well.
+    """
+    if archive_dir is None:
+        snapshot = nullcontext(())
+    else:
+        context_from = db_time(parse_db_time(since) - timedelta(days=SHIFT_LOOKBACK_DAYS + 7))
+        snapshot = archive_snapshot(conn, archive_dir, [(context_from, until)])
+    since, until = db_epoch(since), db_epoch(until)
+    with snapshot as schemas, read_snapshot(conn):
+        arrays = load_segments(conn, since, until, db_epoch(now), company_id, user_id, schemas)
+        user_ids, site_ids, hours = pay_hours(*arrays, since, until, rules)
+        if not len(user_ids):
+            return []
+        people = {row[0]: row for row in conn.execute(
+            "SELECT id, name, email, hourly_rate FROM users WHERE id IN (SELECT value FROM json_each(?))",
+            (json.dumps(np.unique(user_ids).tolist()),))}
+        site_names = {}
+        if by_site:
+            site_names = dict(conn.execute(
+                "SELECT id, name FROM job_sites WHERE id IN (SELECT value FROM json_each(?))",
+                (json.dumps(np.unique(site_ids).tolist()),)).fetchall())
+
+    # One row per (user, site) pair from here on: a few thousand at most
+    entries = {}
+    for user, site, regular, overtime, double in zip(user_ids.tolist(), site_ids.tolist(), *hours.tolist()):
+        person = people.get(user)
+        if person is None:
+            continue
+        entry = entries.get(user)
+        if entry is None:
+            entry = entries[user] = {"user_id": user, "name": person[1], "email": person[2],
+                                     "hourly_rate": person[3], "hours": [0.0, 0.0, 0.0],
+                                     "sites": [] if by_site else None}
+        entry["hours"][0] += regular
+        entry["hours"][1] += overtime
+        entry["hours"][2] += double
+        if by_site:
+            entry["sites"].append({"site_id": site, "site_name": site_names.get(site, ""),
+                                   **_hours_entry(regular, overtime, double, person[3], rules)})
+
+    result = []
+    for entry in entries.values():
+        sites = entry.pop("sites")
+        totals = _hours_entry(*entry.pop("hours"), entry["hourly_rate"], rules)
+        if sites is not None:
+            sites.sort(key=lambda site: (-site["total_hours"], site["site_id"]))
+        result.append({**entry, **totals, "sites": sites})
+    result.sort(key=lambda entry: (-entry["total_hours"], entry["user_id"]))
+    return result
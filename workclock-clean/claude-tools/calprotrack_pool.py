@@ -0,0 +1,208 @@
+"""
+CalProTrack Connection Pool
+Keeps SQLite connections open between requests instead of reconnecting every time
+"""
+
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from calprotrack_config import POOL_SIZE, POOL_TIMEOUT, MMAP_SIZE, CACHE_SIZE_KB, BUSY_TIMEOUT_MS
+from calprotrack_profiling import query_profiler
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection frees up within the pool timeout"""
+
+
+class DatabaseUnavailable(Exception):
+    """Raised when the database file can't be opened"""
+
+
+def open_connection(db_path, readonly=True, immutable=False):
+    """
+    Open a tuned connection to an existing CalProTrack database
+
+    Uses mode=rw so a wrong path fails instead of silently creating an empty DB.
+    Read connections are switched to query_only so a bug can never write.
+    immutable=True is for files nothing writes to (report snapshots): SQLite
+    then skips locking and change detection entirely.
+    With SQL profiling on, the connection times its statements.
+    """
+    uri = Path(db_path).resolve().as_uri() + ("?mode=ro&immutable=1" if immutable else "?mode=rw")
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False, factory=query_profiler.connection_factory())
+    conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    if not immutable:
+        conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KB}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    if readonly:
+        conn.execute("PRAGMA query_only = ON")
+    return conn
+
+
+@contextmanager
+def read_snapshot(conn):
+    """
+    Run a with-block in one read transaction, so every query in it sees the same data
+
+    If the caller already opened one (e.g. /batch), the block simply joins it.
+    """
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute("BEGIN")
+    try:
+        yield conn
+    finally:
+        conn.commit()
+
+
+class ConnectionPool:
+    """
+    A fixed-size pool of read-only SQLite connections
+
+    Connections are opened lazily, handed out to one request at a time and
+    kept open until close() is called on shutdown, or until recycle() when the
+    file at db_path has been replaced.
+    """
+
+    def __init__(self, db_path, size=POOL_SIZE, timeout=POOL_TIMEOUT, immutable=False):
+        self.db_path = db_path
+        self.size = size
+        self.timeout = timeout
+        self.immutable = immutable
+        self._idle = queue.LifoQueue()
+        self._connections = []
+        self._retired = set()   # checked out before the last recycle(); closed on release
+        self._lock = threading.Lock()
+        self._closed = False
+
+        # Metrics
+        self._in_use = 0
+        self._acquired = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def acquire(self):
+        """Check out a connection, opening a new one if the pool isn't full yet"""
+        if self._closed:
+            raise RuntimeError("Connection pool is closed")
+
+        start = time.perf_counter()
+        conn = None
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                if len(self._connections) < self.size:
+                    try:
+                        conn = open_connection(self.db_path, immutable=self.immutable)
+                    except sqlite3.OperationalError:
+                        raise DatabaseUnavailable(f"Database not found at {self.db_path}")
+                    self._connections.append(conn)
+
+        waited = False
+        if conn is None:
+            waited = True
+            try:
+                conn = self._idle.get(timeout=self.timeout)
+            except queue.Empty:
+                with self._lock:
+                    self._timeouts += 1
+                raise PoolTimeout(f"No database connection free after {self.timeout}s")
+
+        wait = time.perf_counter() - start
+        with self._lock:
+            self._in_use += 1
+            self._acquired += 1
+            if waited:
+                self._waits += 1
+            self._total_wait += wait
+            self._max_wait = max(self._max_wait, wait)
+        return conn
+
+    def release(self, conn):
+        """Return a connection to the pool"""
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            self._in_use -= 1
+            closed = self._closed
+            retired = conn in self._retired
+            self._retired.discard(conn)
+        if closed or retired:
+            conn.close()
+        else:
+            self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Use a pooled connection in a with-block"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def recycle(self, db_path=None):
+        """
+        Reopen every connection: idle ones close now, busy ones when released
+
+        For when the database has been replaced - by a new file at db_path,
+        or by one at a new db_path given here. Open connections keep reading
+        the file they opened; retired_in_use() says when none are left.
+        """
+        with self._lock:
+            if db_path is not None:
+                self.db_path = db_path
+            # Connections still in use finish their query on the old file
+            self._retired.update(self._connections)
+            self._connections = []
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._retired.discard(conn)
+            conn.close()
+
+    def retired_in_use(self):
+        """How many connections checked out before the last recycle() are still in use"""
+        with self._lock:
+            return len(self._retired)
+
+    def close(self):
+        """Close every idle connection; busy ones close when they are released"""
+        with self._lock:
+            self._closed = True
+            self._connections = []
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def stats(self):
+        """Pool size and wait-time metrics"""
+        with self._lock:
+            return {
+                "size": self.size,
+                "open_connections": len(self._connections),
+                "in_use": self._in_use,
+                "idle": self._idle.qsize(),
+                "retired_in_use": len(self._retired),
+                "acquired": self._acquired,
+                "waited": self._waits,
+                "timeouts": self._timeouts,
+                "avg_wait_ms": round(self._total_wait / self._acquired * 1000, 3) if self._acquired else 0,
+                "max_wait_ms": round(self._max_wait * 1000, 3),
+            }
@@ -0,0 +1,258 @@
+"""
+CalProTrack Query Profiling
+Times every SQL statement the API runs, tagged with the endpoint that ran it,
+and logs the slow ones together with their EXPLAIN QUERY PLAN.
+
+Off by default. When enabled (CALPROTRACK_SQL_PROFILING=1 before the API
+starts), connections are opened as ProfiledConnection. When disabled they
+are plain sqlite3 connections, so the only cost left is tagging each request
+with its endpoint.
+
+A statement's time is everything spent inside execute() and the fetches
+that read its rows, recorded when its cursor is re-executed, closed or
+garbage collected.
+
+Settings (environment):
+    CALPROTRACK_SQL_PROFILING=1             turn profiling on
+    CALPROTRACK_SLOW_QUERY_MS=250           slow-query threshold
+    CALPROTRACK_SLOW_QUERY_LOG=path.log     JSON-lines slow-query log ("" to keep it in memory only)
+"""
+
+import contextvars
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from calprotrack_metrics import HistogramFamily, header, sample, histogram_lines
+
+SLOW_QUERY_MS = 250
+SLOW_QUERY_LOG = "calprotrack_slow_queries.log"
+RECENT_SLOW = 50            # slow queries kept in memory for /stats
+MAX_STATEMENTS = 500        # distinct statements tracked; the rest are counted as "other"
+PLAN_TTL = 300              # seconds a statement's EXPLAIN QUERY PLAN is reused for the slow log
+
+# Endpoint (route path) the current request is serving; set per request by the API
+current_endpoint = contextvars.ContextVar("calprotrack_endpoint", default="background")
+
+# "IN (?, ?, ?)" lists of any length count as one statement
+_PLACEHOLDER_LIST = re.compile(r"\?(\s*,\s*\?)+")
+
+
+class QueryProfiler:
+    """Per-endpoint, per-statement latency histograms and the slow-query log"""
+
+    def __init__(self, enabled=False, slow_ms=SLOW_QUERY_MS, log_path=SLOW_QUERY_LOG):
+        self.enabled = enabled
+        self.slow_ms = slow_ms
+        self.log_path = log_path
+        self._lock = threading.Lock()
+        self._statements = {}   # sql -> (statement id, normalized sql)
+        self._latency = HistogramFamily(("endpoint", "statement"))
+        self._rows = {}         # (endpoint, statement) -> rows read
+        self._slow = {}         # (endpoint, statement) -> slow executions
+        self._plans = {}        # statement -> (plan, explained_at)
+        self._recent_slow = deque(maxlen=RECENT_SLOW)
+
+    def connection_factory(self):
+        """Connection class for sqlite3.connect(factory=...)"""
+        return ProfiledConnection if self.enabled else sqlite3.Connection
+
+    def _statement(self, sql):
+        with self._lock:
+            known = self._statements.get(sql)
+            if known is None:
+                normalized = _PLACEHOLDER_LIST.sub("?, ...", " ".join(sql.split()))
+                if len(self._statements) >= MAX_STATEMENTS:
+                    return "other", normalized
+                known = self._statements[sql] = (hashlib.sha1(normalized.encode()).hexdigest()[:12], normalized)
+            return known
+
+    def record(self, conn, sql, params, seconds, rows):
+        """Account one finished statement"""
+        statement, normalized = self._statement(sql)
+        labels = (current_endpoint.get(), statement)
+        self._latency.observe(labels, seconds)
+        slow = seconds * 1000 >= self.slow_ms
+        with self._lock:
+            self._rows[labels] = self._rows.get(labels, 0) + rows
+            if slow:
+                self._slow[labels] = self._slow.get(labels, 0) + 1
+        if slow:
+            self._log_slow(conn, labels, normalized, sql, params, seconds, rows)
+
+    def _plan(self, conn, statement, sql, params):
+        """EXPLAIN QUERY PLAN for a statement, reused for PLAN_TTL seconds"""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._plans.get(statement)
+        if cached is not None and now - cached[1] < PLAN_TTL:
+            return cached[0]
+        try:
+            # The base class execute, so explaining isn't itself profiled
+            rows = sqlite3.Connection.execute(conn, "EXPLAIN QUERY PLAN " + sql, params).fetchall()
+            plan = [row[3] for row in rows]
+        except sqlite3.Error as e:
+            plan = [f"unavailable: {e}"]
+        with self._lock:
+            self._plans[statement] = (plan, now)
+        return plan
+
+    def _log_slow(self, conn, labels, normalized, sql, params, seconds, rows):
+        entry = {
+            "at": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()),
+            "endpoint": labels[0],
+            "statement": labels[1],
+            "duration_ms": round(seconds * 1000, 3),
+            "rows": rows,
+            "sql": normalized,
+            "params": params,
+            "plan": self._plan(conn, labels[1], sql, params),
+        }
+        line = json.dumps(entry, default=str)
+        with self._lock:
+            self._recent_slow.append(entry)
+            if self.log_path:
+                try:
+                    with open(self.log_path, "a") as f:
+                        f.write(line + "\n")
+                except OSError:
+                    pass
+
+    def stats(self, top=10):
+        """The `top` statements by total time, and the latest slow queries"""
+        statements = []
+        with self._lock:
+            texts = {statement: normalized for statement, normalized in self._statements.values()}
+            rows = dict(self._rows)
+            slow = dict(self._slow)
+            recent = list(self._recent_slow)[-10:]
+        for labels, h in self._latency.items():
+            statements.append({
+                "endpoint": labels[0],
+                "statement": labels[1],
+                "sql": texts.get(labels[1], "")[:200],
+                "total_ms": round(h.sum * 1000, 3),
+                "rows": rows.get(labels, 0),
+                "slow": slow.get(labels, 0),
+                **h.summary(),
+            })
+        statements.sort(key=lambda s: -s["total_ms"])
+        return {
+            "enabled": self.enabled,
+            "slow_query_ms": self.slow_ms,
+            "tracked": len(statements),
+            "top": statements[:top],
+            "recent_slow": recent,
+        }
+
+    def prometheus_lines(self):
+        """Everything above in Prometheus text format"""
+        lines = header("calprotrack_sql_profiling_enabled", "gauge", "1 when SQL statements are being timed")
+        lines.append(sample("calprotrack_sql_profiling_enabled", int(self.enabled)))
+        lines += histogram_lines("calprotrack_sql_statement_seconds",
+                                 "Time spent executing and fetching each SQL statement, by endpoint", self._latency)
+        with self._lock:
+            texts = list(self._statements.values())
+            rows = dict(self._rows)
+            slow = dict(self._slow)
+        lines += header("calprotrack_sql_rows_total", "counter", "Rows read by each SQL statement, by endpoint")
+        lines += [sample("calprotrack_sql_rows_total", n, ("endpoint", "statement"), labels) for labels, n in rows.items()]
+        lines += header("calprotrack_sql_slow_total", "counter",
+                        f"Statements slower than {self.slow_ms} ms, by endpoint")
+        lines += [sample("calprotrack_sql_slow_total", n, ("endpoint", "statement"), labels) for labels, n in slow.items()]
+        lines += header("calprotrack_sql_statement_info", "gauge", "SQL text of each statement id")
+        lines += [sample("calprotrack_sql_statement_info", 1, ("statement", "sql"), text) for text in texts]
+        return lines
+
+
+class ProfiledCursor(sqlite3.Cursor):
+    """Cursor that adds up the time spent running its statement and reading its rows"""
+
+    _sql = None
+
+    def _start(self, sql, params):
+        self._finish()
+        self._sql = sql
+        self._params = params
+        self._elapsed = 0.0
+        self._rows = 0
+
+    def _finish(self):
+        if self._sql is not None:
+            sql, self._sql = self._sql, None
+            query_profiler.record(self.connection, sql, self._params, self._elapsed, self._rows)
+
+    def execute(self, sql, parameters=()):
+        self._start(sql, parameters)
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._elapsed += time.perf_counter() - started
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._elapsed += time.perf_counter() - started
+        self._rows += row is not None
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._elapsed += time.perf_counter() - started
+        self._rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._elapsed += time.perf_counter() - started
+        self._rows += len(rows)
+        return rows
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            row = super().__next__()
+        finally:
+            self._elapsed += time.perf_counter() - started
+        self._rows += 1
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass    # never raise from a finalizer (e.g. during interpreter shutdown)
+
+
+class ProfiledConnection(sqlite3.Connection):
+    """Connection whose statements all run on ProfiledCursors"""
+
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        # sqlite3.Connection.execute makes a plain cursor internally, so route it through ours
+        return self.cursor().execute(sql, parameters)
+
+
+def _env_flag(name):
+    return os.environ.get(name, "").strip().lower() in ("1", "true", "yes", "on")
+
+
+query_profiler = QueryProfiler(
+    enabled=_env_flag("CALPROTRACK_SQL_PROFILING"),
+    slow_ms=float(os.environ.get("CALPROTRACK_SLOW_QUERY_MS", SLOW_QUERY_MS)),
+    log_path=os.environ.get("CALPROTRACK_SLOW_QUERY_LOG", SLOW_QUERY_LOG),
+)
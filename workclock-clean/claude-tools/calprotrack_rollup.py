@@ -0,0 +1,266 @@
+"""
+CalProTrack Daily Rollup
+Keeps daily_user_site_rollup (hours and cost per day, user and job site) up to
+date so reports only aggregate raw shifts for days the rollup doesn't cover.
+
+The rollup holds every shift that clocked in before `covered_until` and
+clocked out before `watermark`. Everything else in a report window - the
+partial first day, today, and shifts that were still open at the last
+refresh - is computed live by the API. Shifts written for past days after
+those days were rolled up (backdated entries, edits, deletes) are noticed
+by triggers (calprotrack_migrations) and their days rebuilt on the next
+refresh.
+
+Run:
+    python calprotrack_rollup.py refresh     # catch up since the last watermark
+    python calprotrack_rollup.py backfill    # rebuild the whole table from scratch
+"""
+
+import argparse
+import threading
+import time
+from datetime import timedelta
+
+from calprotrack_config import DATABASE_PATH
+from calprotrack_pool import open_connection
+from calprotrack_time import utc_now, db_time, parse_db_time, day_start, ceil_day, epoch_params
+
+# Clock-outs newer than this may still be committing on the Node side,
+# so the watermark trails "now" by this much
+SETTLE_SECONDS = 60
+
+# How often the API refreshes the rollup in the background
+REFRESH_INTERVAL = 300
+
+# Closed shifts that clocked in during [:from, :to), split per job site.
+# Shifts are attributed to the day they clocked in on, same as /payroll.
+ROLLUP_INSERT = """
+    INSERT INTO daily_user_site_rollup
+        (day, user_id, job_site_id, company_id, hours, cost, segment_count, shift_count)
+    SELECT
+        day,
+        user_id,
+        job_site_id,
+        company_id,
+        SUM(hours),
+        SUM(hours * hourly_rate),
+        COUNT(segment_id),
+        SUM(is_first_segment)
+    FROM (
+        SELECT
+            substr(s.clock_in_at, 1, 10) as day,
+            s.user_id,
+            s.company_id,
+            ss.job_site_id,
+            ss.id as segment_id,
+            (COALESCE(ss.end_epoch, s.clock_out_epoch) -
+             COALESCE(ss.start_epoch, s.clock_in_epoch)) / 3600.0 as hours,
+            COALESCE(u.hourly_rate, 0) as hourly_rate,
+            -- each shift is counted once, on the row of its first segment
+            CASE
+                WHEN ss.id IS NULL THEN 1
+                WHEN ss.id = (SELECT MIN(id) FROM shift_segments WHERE shift_id = s.id) THEN 1
+                ELSE 0
+            END as is_first_segment
+        FROM shifts s
+        LEFT JOIN shift_segments ss ON ss.shift_id = s.id
+        LEFT JOIN users u ON u.id = s.user_id
+        WHERE s.clock_in_at >= :from AND s.clock_in_at < :to
+          AND s.clock_out_at < :watermark
+    )
+    GROUP BY day, user_id, job_site_id
+"""
+
+
+def rebuild_days(conn, start, end, watermark):
+    """Recompute rollup rows for the days in [start, end)"""
+    conn.execute("DELETE FROM daily_user_site_rollup WHERE day >= ? AND day < ?", (start[:10], end[:10]))
+    conn.execute(ROLLUP_INSERT, {"from": start, "to": end, "watermark": watermark})
+
+
+def _next_day(start):
+    return db_time(parse_db_time(start) + timedelta(days=1))
+
+
+def _begin_rebuild(conn, covered_until):
+    """
+    Start a full rebuild: reports read live shifts until it finishes, and rows
+    for days without shifts any more are dropped. Returns the first day to
+    rebuild ("YYYY-MM-DD 00:00:00"), or None when there are no shifts.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Archived months' rows can't be recomputed (their shifts are gone), so they are kept
+        archived_until = conn.execute("SELECT MAX(end_at) FROM archived_months").fetchone()[0]
+        first = conn.execute("SELECT MIN(clock_in_at) FROM shifts").fetchone()[0]
+        if first is not None and archived_until is not None:
+            first = max(first, archived_until)
+        first_day = first[:10] if first is not None and first < covered_until else covered_until[:10]
+        # The days from first_day on are replaced one at a time afterwards
+        conn.execute("DELETE FROM daily_user_site_rollup WHERE day >= ? AND (day < ? OR day >= ?)",
+                     ((archived_until or "")[:10], first_day, covered_until[:10]))
+        conn.execute("DELETE FROM rollup_dirty_days")
+        conn.execute("""
+            INSERT INTO rollup_state (id, covered_until, watermark, refreshed_at)
+            VALUES (1, NULL, NULL, datetime('now'))
+            ON CONFLICT(id) DO UPDATE SET covered_until = NULL, watermark = NULL, refreshed_at = datetime('now')
+        """)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return first_day + " 00:00:00" if first_day < covered_until[:10] else None
+
+
+def refresh_rollup(db_path, full=False):
+    """
+    Bring the rollup up to date; full=True rebuilds it from scratch
+
+    A full rebuild (also the first refresh of a database) runs one transaction
+    per day, so the Node server is never locked out for longer than a day's
+    rebuild. Otherwise the refresh adds the days that closed since the last
+    one and rebuilds the days with late clock-outs or with shifts added,
+    removed or edited afterwards (rollup_dirty_days, filled by triggers).
+
+    Returns a summary dict with the new coverage and how many days were rebuilt.
+    """
+    conn = open_connection(db_path, readonly=False)
+    try:
+        watermark_dt = utc_now() - timedelta(seconds=SETTLE_SECONDS)
+        watermark = db_time(watermark_dt)
+        covered_until = db_time(day_start(watermark_dt))
+
+        state = conn.execute("SELECT covered_until, watermark FROM rollup_state WHERE id = 1").fetchone()
+        if full or state is None or state["covered_until"] is None:
+            day = _begin_rebuild(conn, covered_until)
+            while day is not None and day < covered_until:
+                conn.execute("BEGIN IMMEDIATE")
+                rebuild_days(conn, day, _next_day(day), watermark)
+                conn.commit()
+                day = _next_day(day)
+            # Only changes made while it ran are left for the catch-up below
+            state = {"covered_until": covered_until, "watermark": watermark}
+
+        conn.execute("BEGIN IMMEDIATE")
+        # Shifts in already-covered days that clocked out since the last refresh
+        late = {row["day"] for row in conn.execute("""
+            SELECT DISTINCT substr(clock_in_at, 1, 10) as day
+            FROM shifts
+            WHERE clock_out_at >= ? AND clock_out_at < ?
+              AND clock_in_at < ?
+        """, (state["watermark"], watermark, state["covered_until"]))}
+        # Covered days whose shifts changed; archived days are final
+        archived_until = conn.execute("SELECT MAX(end_at) FROM archived_months").fetchone()[0]
+        dirty = {row["day"] for row in conn.execute(
+            "SELECT day FROM rollup_dirty_days WHERE day >= ? AND day < ?",
+            ((archived_until or "")[:10], state["covered_until"][:10]))}
+        rebuilt_days = late | dirty
+        for day in sorted(rebuilt_days):
+            start = day + " 00:00:00"
+            rebuild_days(conn, start, _next_day(start), watermark)
+        # Marks for days not covered yet are settled when those days close, just below
+        conn.execute("DELETE FROM rollup_dirty_days")
+
+        # Days that became closed since the last refresh
+        if state["covered_until"] < covered_until:
+            rebuild_days(conn, state["covered_until"], covered_until, watermark)
+
+        conn.execute("""
+            INSERT INTO rollup_state (id, covered_until, watermark, refreshed_at)
+            VALUES (1, ?, ?, datetime('now'))
+            ON CONFLICT(id) DO UPDATE SET
+                covered_until = excluded.covered_until,
+                watermark = excluded.watermark,
+                refreshed_at = excluded.refreshed_at
+        """, (covered_until, watermark))
+        conn.commit()
+
+        return {
+            "covered_until": covered_until,
+            "watermark": watermark,
+            "late_days_rebuilt": len(rebuilt_days),
+        }
+    except Exception:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def rollup_window(conn, since, now):
+    """
+    Query parameters that split [since, now] between the rollup and live shifts
+
+    Run this in the same read transaction as the report query so the rollup
+    state and rollup rows come from one snapshot.
+    """
+    state = conn.execute("SELECT covered_until, watermark FROM rollup_state WHERE id = 1").fetchone()
+    rollup_start = ceil_day(since)
+
+    if state is None or state["covered_until"] is None or rollup_start >= state["covered_until"]:
+        # Nothing usable in the rollup: the live part covers the whole window
+        rollup_start = rollup_end = watermark = since
+    else:
+        rollup_end = state["covered_until"]
+        watermark = state["watermark"]
+
+    params = {
+        "since": since,
+        "now": now,
+        "rollup_start": rollup_start,
+        "rollup_end": rollup_end,
+        "rollup_start_day": rollup_start[:10],
+        "rollup_end_day": rollup_end[:10],
+        "watermark": watermark,
+    }
+    # The live part of a report filters and subtracts on the *_epoch columns
+    return epoch_params(params, "since", "now", "rollup_start", "rollup_end", "watermark")
+
+
+class RollupRefresher:
+    """Background thread that refreshes the rollup every `interval` seconds"""
+
+    def __init__(self, db_path, interval=REFRESH_INTERVAL):
+        self.db_path = db_path
+        self.interval = interval
+        self.last_result = None
+        self.last_error = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rollup-refresher", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.last_result = refresh_rollup(self.db_path)
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+            self._stop.wait(self.interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the CalProTrack daily rollup")
+    parser.add_argument("command", choices=["refresh", "backfill"])
+    parser.add_argument("--db", default=DATABASE_PATH, help="Path to fieldtrack.db (default: DATABASE_PATH)")
+    args = parser.parse_args()
+
+    from calprotrack_migrations import run_migrations
+    run_migrations(args.db)
+
+    started = time.perf_counter()
+    result = refresh_rollup(args.db, full=(args.command == "backfill"))
+    elapsed = time.perf_counter() - started
+
+    print(f"✅ Rollup {args.command} finished in {elapsed:.2f}s")
+    print(f"   📅 Covered until: {result['covered_until']}")
+    print(f"   ⏰ Watermark: {result['watermark']}")
+    print(f"   🔁 Late days rebuilt: {result['late_days_rebuilt']}")
@@ -0,0 +1,152 @@
+"""
+CalProTrack Report Snapshot
+A read-only copy of the database for the heavy report endpoints (payroll,
+employee hours), refreshed in the background with the SQLite backup API.
+
+Long payroll scans on the live file hold a read snapshot of its WAL for their
+whole run, which keeps the Node server's checkpoints from completing and lets
+the WAL grow while clock-ins keep writing. Reading a copy instead means the
+only long reader of the live file is the backup itself, once per interval.
+
+Each refresh writes a new file next to the configured path, numbered
+"<name>-000042.db" (via "<file>.tmp" and a rename, so no reader ever sees a
+half-written copy), and points the pool at it (ConnectionPool.recycle).
+Snapshots are opened immutable - no locks, no change checks - so a file is
+never replaced while anything has it open; that would fail on Windows and
+go unnoticed by SQLite elsewhere. Connections opened on an older copy finish
+their query there, and older copies are deleted once none are left.
+
+Reports served from it lag the live data by up to one interval (open shifts
+are still counted up to "now").
+"""
+
+import glob
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from calprotrack_config import SNAPSHOT_INTERVAL
+from calprotrack_pool import open_connection
+
+
+def copy_database(db_path, snapshot_path):
+    """Copy a live database to snapshot_path with the backup API; returns the copy's size in bytes"""
+    tmp_path = snapshot_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    source = open_connection(db_path)
+    try:
+        target = sqlite3.connect(tmp_path)
+        try:
+            # One step: the whole copy comes from a single read transaction, so it's consistent
+            source.backup(target)
+            # A copy in WAL mode would have -wal/-shm files that outlive the rename
+            target.execute("PRAGMA journal_mode = DELETE")
+        finally:
+            target.close()
+    finally:
+        source.close()
+    os.replace(tmp_path, snapshot_path)
+    return os.path.getsize(snapshot_path)
+
+
+def snapshot_versions(snapshot_path):
+    """{version: path} of the numbered copies made for snapshot_path"""
+    base, ext = os.path.splitext(snapshot_path)
+    pattern = re.compile(re.escape(base) + r"-(\d{6})" + re.escape(ext) + "$")
+    versions = {}
+    for path in glob.glob(glob.escape(base) + "-*" + glob.escape(ext)):
+        match = pattern.match(path)
+        if match:
+            versions[int(match.group(1))] = path
+    return versions
+
+
+class ReportSnapshot:
+    """Background thread that makes a new snapshot every `interval` seconds and moves its pool onto it"""
+
+    def __init__(self, db_path, snapshot_path, interval=SNAPSHOT_INTERVAL):
+        self.db_path = db_path
+        self.snapshot_path = snapshot_path
+        self.interval = interval
+        versions = snapshot_versions(snapshot_path)
+        self.version = max(versions, default=0)
+        self.path = versions.get(self.version)     # the newest copy, None until the first refresh
+        self.pool = None            # the ConnectionPool reading the snapshot, recycled after each refresh
+        self.refreshes = 0
+        self.last_refresh = None    # wall-clock time of the last completed copy
+        self.last_seconds = None
+        self.last_bytes = None
+        self.last_error = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="report-snapshot", daemon=True)
+
+    def refresh(self):
+        """Copy the live database to a new file now and point the pool at it"""
+        started = time.perf_counter()
+        base, ext = os.path.splitext(self.snapshot_path)
+        path = f"{base}-{self.version + 1:06d}{ext}"
+        size = copy_database(self.db_path, path)
+        self.version += 1
+        self.path = path
+        if self.pool is not None:
+            self.pool.recycle(path)
+        self.refreshes += 1
+        self.last_refresh = time.time()
+        self.last_seconds = time.perf_counter() - started
+        self.last_bytes = size
+        self.remove_old()
+
+    def remove_old(self):
+        """Delete the copies before the current one, once no connection is reading them"""
+        if self.pool is not None and self.pool.retired_in_use():
+            return
+        for version, path in snapshot_versions(self.snapshot_path).items():
+            if version < self.version:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass    # still open somewhere (Windows); tried again next time
+
+    def ensure(self):
+        """Make the first copy if there is none yet, so the pool has a file to open"""
+        if self.path is None:
+            self.refresh()
+        else:
+            self.remove_old()
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        # A copy left by an earlier run may be old, so refresh right away unless ensure() just made one
+        if self.refreshes:
+            self._stop.wait(self.interval)
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+            # Old copies still being read when the refresh finished go once their queries do
+            deadline = time.monotonic() + self.interval
+            while not self._stop.wait(max(0, min(5, deadline - time.monotonic()))) and time.monotonic() < deadline:
+                self.remove_old()
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "interval_s": self.interval,
+            "refreshes": self.refreshes,
+            "age_s": round(time.time() - self.last_refresh, 1) if self.last_refresh else None,
+            "last_copy_ms": round(self.last_seconds * 1000, 1) if self.last_seconds is not None else None,
+            "bytes": self.last_bytes,
+            "last_error": self.last_error,
+        }
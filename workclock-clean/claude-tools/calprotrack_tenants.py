@@ -0,0 +1,64 @@
+"""
+CalProTrack Tenant Metrics
+Query time per company for the tenant-scoped endpoints, so /stats can show
+which tenants are expensive to serve.
+
+Only time spent running the query is counted - not time queued for a DB lane
+and not cache hits.
+"""
+
+import threading
+import time
+
+# How many tenants /stats lists, most expensive first
+TOP_TENANTS = 20
+
+
+class TenantMetrics:
+    """Query count and time per company, broken down by endpoint"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tenants = {}      # company_id -> {endpoint: [queries, total_seconds, max_seconds]}
+
+    def record(self, company_id, endpoint, seconds):
+        with self._lock:
+            endpoints = self._tenants.setdefault(company_id, {})
+            entry = endpoints.setdefault(endpoint, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+
+    def timed(self, company_id, endpoint, fn):
+        """Wrap fn(conn, *args) so its run time is recorded against company_id"""
+        def run(conn, *args):
+            started = time.perf_counter()
+            try:
+                return fn(conn, *args)
+            finally:
+                self.record(company_id, endpoint, time.perf_counter() - started)
+        return run
+
+    def stats(self, top=TOP_TENANTS):
+        """The `top` tenants by total query time"""
+        with self._lock:
+            tenants = []
+            for company_id, endpoints in self._tenants.items():
+                queries = sum(e[0] for e in endpoints.values())
+                total = sum(e[1] for e in endpoints.values())
+                tenants.append({
+                    "company_id": company_id,
+                    "queries": queries,
+                    "total_ms": round(total * 1000, 3),
+                    "avg_ms": round(total / queries * 1000, 3),
+                    "max_ms": round(max(e[2] for e in endpoints.values()) * 1000, 3),
+                    "endpoints": {
+                        name: {"queries": e[0], "total_ms": round(e[1] * 1000, 3)}
+                        for name, e in sorted(endpoints.items(), key=lambda item: -item[1][1])
+                    },
+                })
+            tenants.sort(key=lambda t: -t["total_ms"])
+            return {"tracked": len(tenants), "top": tenants[:top]}
+
+
+tenant_metrics = TenantMetrics()
@@ -0,0 +1,64 @@
+"""
+CalProTrack Time Windows
+Timestamps are stored as UTC text ("YYYY-MM-DD HH:MM:SS", same as SQLite's
+datetime('now')), so window boundaries are computed here and compared as
+plain strings. That keeps every filter a range the shift indexes can seek on.
+
+Shifts and segments also carry the same times as integer seconds since 1970
+(clock_in_epoch, clock_out_epoch, start_epoch, end_epoch - see the
+epoch_columns migration). Duration math uses those; db_epoch() converts a
+window boundary to match.
+"""
+
+from datetime import datetime, timedelta, timezone
+
+DB_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+EPOCH = datetime(1970, 1, 1)
+
+
+def utc_now():
+    """Current UTC time, without tzinfo, to match the stored timestamps"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def db_time(dt):
+    """Format a datetime the way shift timestamps are stored"""
+    return dt.strftime(DB_TIME_FORMAT)
+
+
+def parse_db_time(value):
+    """Parse a stored timestamp back into a datetime"""
+    return datetime.strptime(value[:19], DB_TIME_FORMAT)
+
+
+def db_epoch(value):
+    """Seconds since 1970 of a stored timestamp, the value its *_epoch column holds"""
+    return (parse_db_time(value) - EPOCH) // timedelta(seconds=1)
+
+
+def epoch_params(params, *names):
+    """Copy of `params` with a "<name>_epoch" entry for each named timestamp"""
+    return {**params, **{f"{name}_epoch": db_epoch(params[name]) for name in names}}
+
+
+def since_days(days, now):
+    """Start of the 'last N days' window"""
+    return db_time(now - timedelta(days=days))
+
+
+def day_start(now):
+    """Midnight (UTC) at the start of the day containing `now`"""
+    return now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def day_window(now):
+    """[start, end) of the UTC day containing `now`"""
+    start = day_start(now)
+    return db_time(start), db_time(start + timedelta(days=1))
+
+
+def ceil_day(value):
+    """First midnight at or after a stored timestamp"""
+    moment = parse_db_time(value)
+    start = day_start(moment)
+    return db_time(start if start == moment else start + timedelta(days=1))
@@ -0,0 +1,309 @@
+"""
+CalProTrack Request Timing
+Breaks every request into phases and reports them as a Server-Timing header
+and as per-route histograms on /metrics:
+
+    queue           waiting for a DB lane worker and a pooled connection
+    db              running the lane's SQL work
+    validation      checking the result against the route's response_model
+    serialization   turning the result into the JSON body
+    app             everything else (routing, dependencies, endpoint code)
+    total           request start to response headers (Server-Timing) or
+                    to the last body byte (histograms, so streams count in full)
+
+Opt-in: with CALPROTRACK_PROFILE_SLOW_MS set, a sample of requests
+(CALPROTRACK_PROFILE_SAMPLE, default 0.1) runs under a profiler -
+pyinstrument when installed, cProfile otherwise - and the profiles of those
+slower than the threshold are written to CALPROTRACK_PROFILE_DIR.
+"""
+
+import contextvars
+import functools
+import inspect
+import os
+import random
+import re
+import threading
+import time
+
+from fastapi.routing import APIRoute
+
+from calprotrack_metrics import HistogramFamily, histogram_lines
+
+PHASES = ("queue", "db", "validation", "serialization")
+PROFILE_SAMPLE = 0.1
+PROFILE_DIR = "profiles"
+
+
+class RequestTiming:
+    """Phase durations collected while one request is handled"""
+
+    __slots__ = ("started", "phases", "endpoint_done", "handler_done")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.endpoint_done = None
+        self.handler_done = None
+
+    def add(self, phase, seconds):
+        # Lane threads and the event loop can both add to one request; a lost
+        # update here would only skew one sample, so no lock
+        self.phases[phase] += seconds
+
+    def breakdown(self, until=None):
+        """Seconds per phase, including the derived serialization, app and total"""
+        total = (until or time.perf_counter()) - self.started
+        phases = dict(self.phases)
+        if self.endpoint_done is not None and self.handler_done is not None:
+            # Responses encoded inside the endpoint (calprotrack_json) have already added theirs
+            phases["serialization"] += max(0.0, self.handler_done - self.endpoint_done - phases["validation"])
+        phases["app"] = max(0.0, total - sum(phases.values()))
+        phases["total"] = total
+        return phases
+
+
+# The timing of the request being handled; lanes copy it onto their threads
+current_timing = contextvars.ContextVar("calprotrack_request_timing", default=None)
+
+
+def record_phase(phase, seconds):
+    """Add time to a phase of the current request, if there is one"""
+    timing = current_timing.get()
+    if timing is not None:
+        timing.add(phase, seconds)
+
+
+def _mark_endpoint_done(endpoint):
+    """Wrap an endpoint so the request notes when it returned (serialization starts there)"""
+    def done():
+        timing = current_timing.get()
+        if timing is not None:
+            timing.endpoint_done = time.perf_counter()
+
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                done()
+    else:
+        @functools.wraps(endpoint)
+        def wrapper(*args, **kwargs):
+            try:
+                return endpoint(*args, **kwargs)
+            finally:
+                done()
+    return wrapper
+
+
+class _TimedField:
+    """Stands in for a route's response field inside its handler, timing validate()"""
+
+    def __init__(self, field):
+        self._field = field
+
+    def __getattr__(self, name):
+        return getattr(self._field, name)
+
+    def validate(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._field.validate(*args, **kwargs)
+        finally:
+            record_phase("validation", time.perf_counter() - started)
+
+
+class TimedRoute(APIRoute):
+    """APIRoute that reports when its endpoint returned and how long response validation took"""
+
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, _mark_endpoint_done(endpoint), **kwargs)
+
+    def get_route_handler(self):
+        # The handler closes over the response field it is built with, so swap
+        # in the timed one only while building it - OpenAPI keeps the real field.
+        # (Older FastAPI versions hand the handler secure_cloned_response_field.)
+        swapped = []
+        for name in ("response_field", "secure_cloned_response_field"):
+            field = getattr(self, name, None)
+            if field is not None:
+                swapped.append((name, field))
+                setattr(self, name, _TimedField(field))
+        try:
+            handler = super().get_route_handler()
+        finally:
+            for name, field in swapped:
+                setattr(self, name, field)
+
+        async def timed_handler(request):
+            response = await handler(request)
+            timing = current_timing.get()
+            if timing is not None:
+                timing.handler_done = time.perf_counter()
+            return response
+        return timed_handler
+
+
+class RequestMetrics:
+    """Per-route latency and phase histograms"""
+
+    def __init__(self):
+        self.latency = HistogramFamily(("method", "route", "status"))
+        self.phases = HistogramFamily(("route", "phase"))
+
+    def record(self, method, route, status, phases):
+        self.latency.observe((method, route, str(status)), phases["total"])
+        for phase, seconds in phases.items():
+            if phase != "total":
+                self.phases.observe((route, phase), seconds)
+
+    def stats(self, top=10):
+        """The `top` routes by total time, with their phase averages"""
+        phase_avgs = {}
+        for (route, phase), h in self.phases.items():
+            phase_avgs.setdefault(route, {})[f"{phase}_avg_ms"] = round(h.sum / h.count * 1000, 3) if h.count else 0
+        routes = []
+        for (method, route, status), h in self.latency.items():
+            routes.append({"method": method, "route": route, "status": status,
+                           "total_ms": round(h.sum * 1000, 3), **h.summary(), **phase_avgs.get(route, {})})
+        routes.sort(key=lambda r: -r["total_ms"])
+        return {"tracked": len(routes), "top": routes[:top]}
+
+    def prometheus_lines(self):
+        return (histogram_lines("calprotrack_http_request_duration_seconds",
+                                "Request latency, start to last body byte, by route", self.latency)
+                + histogram_lines("calprotrack_http_request_phase_seconds",
+                                  "Time spent per request in each phase (queue, db, validation, serialization, app)",
+                                  self.phases))
+
+
+request_metrics = RequestMetrics()
+
+
+class SlowRequestProfiler:
+    """Profiles a sample of requests and keeps the profiles of slow ones"""
+
+    def __init__(self, threshold_ms=None, sample=PROFILE_SAMPLE, directory=PROFILE_DIR):
+        self.threshold_ms = threshold_ms
+        self.sample = sample
+        self.directory = directory
+        self.dumped = 0
+        self._busy = threading.Lock()   # one profile at a time: profilers are per-thread/global
+        try:
+            import pyinstrument
+            self._pyinstrument = pyinstrument
+        except ImportError:
+            self._pyinstrument = None
+
+    @property
+    def enabled(self):
+        return self.threshold_ms is not None
+
+    def start(self):
+        """A running profiler for this request, or None when it isn't sampled (or can't be started)"""
+        if not self.enabled or random.random() >= self.sample or not self._busy.acquire(blocking=False):
+            return None
+        try:
+            if self._pyinstrument is not None:
+                profiler = self._pyinstrument.Profiler(async_mode="enabled")
+                profiler.start()
+            else:
+                # cProfile sees the whole event loop thread, so concurrent requests
+                # show up in the profile too; lane threads don't
+                import cProfile
+                profiler = cProfile.Profile()
+                profiler.enable()
+        except Exception:
+            # e.g. another profiler is already active: run this request unprofiled
+            # and give the slot back, or no request would ever be profiled again
+            self._busy.release()
+            return None
+        return profiler
+
+    def finish(self, profiler, method, path, seconds):
+        """Stop the profiler and write its profile if the request was slow"""
+        try:
+            if self._pyinstrument is not None:
+                profiler.stop()
+            else:
+                profiler.disable()
+            if seconds * 1000 < self.threshold_ms:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            name = re.sub(r"[^A-Za-z0-9]+", "_", f"{method}_{path}").strip("_")
+            base = os.path.join(self.directory, f"{time.strftime('%Y%m%d-%H%M%S')}_{name}_{seconds * 1000:.0f}ms")
+            if self._pyinstrument is not None:
+                with open(base + ".html", "w") as f:
+                    f.write(profiler.output_html())
+            else:
+                import io
+                import pstats
+                profiler.dump_stats(base + ".prof")
+                out = io.StringIO()
+                pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(40)
+                with open(base + ".txt", "w") as f:
+                    f.write(out.getvalue())
+            self.dumped += 1
+        finally:
+            self._busy.release()
+
+
+def _env_float(name):
+    value = os.environ.get(name, "").strip()
+    return float(value) if value else None
+
+
+slow_request_profiler = SlowRequestProfiler(
+    threshold_ms=_env_float("CALPROTRACK_PROFILE_SLOW_MS"),
+    sample=_env_float("CALPROTRACK_PROFILE_SAMPLE") or PROFILE_SAMPLE,
+    directory=os.environ.get("CALPROTRACK_PROFILE_DIR", PROFILE_DIR),
+)
+
+
+def _server_timing(phases):
+    return ", ".join(f"{phase};dur={seconds * 1000:.2f}" for phase, seconds in phases.items())
+
+
+class RequestTimingMiddleware:
+    """ASGI middleware: times each request, adds Server-Timing, feeds request_metrics"""
+
+    def __init__(self, app, metrics=request_metrics, profiler=slow_request_profiler):
+        self.app = app
+        self.metrics = metrics
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        timing = RequestTiming()
+        token = current_timing.set(timing)
+        profile = self.profiler.start()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", _server_timing(timing.breakdown()).encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_timing.reset(token)
+            phases = timing.breakdown()
+            route = scope.get("route")
+            if route is not None:
+                route_path = route.path
+            else:
+                # Plain Starlette routes (/docs, /openapi.json) have fixed paths;
+                # anything else unrouted is pooled so 404 probes can't add labels
+                route_path = scope["path"] if status != 404 else "unmatched"
+            self.metrics.record(scope["method"], route_path, status, phases)
+            if profile is not None:
+                self.profiler.finish(profile, scope["method"], route_path, phases["total"])
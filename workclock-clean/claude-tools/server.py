@@ -2,10 +2,12 @@ from fastapi import FastAPI
 from pydantic import BaseModel
 from typing import List, Optional
 
+from task_store import TaskStore
+
 app = FastAPI(title="Task Manager API")
 
-# Simple in-memory storage (resets when server restarts)
-tasks = []
+# Tasks by id, saved to tasks.log (TASKS_LOG) so they survive restarts
+tasks = TaskStore()
 
 class Task(BaseModel):
     title: str
@@ -24,40 +26,33 @@ def root():
 
 @app.post("/task/create")
 def create_task(task: Task):
-    task_id = len(tasks)
-    task_data = {
-        "id": task_id,
-        "title": task.title,
-        "description": task.description,
-        "done": task.done
-    }
-    tasks.append(task_data)
+    task_data = tasks.create(task.title, task.description, task.done)
     return {"status": "created", "task": task_data}
 
 @app.get("/task/list")
 def list_tasks():
-    return {"tasks": tasks, "count": len(tasks)}
+    all_tasks = tasks.all()
+    return {"tasks": all_tasks, "count": len(all_tasks)}
 
 @app.get("/task/{task_id}")
 def get_task(task_id: int):
-    if task_id < len(tasks):
-        return tasks[task_id]
+    task = tasks.get(task_id)
+    if task is not None:
+        return task
     return {"error": "Task not found"}
 
 @app.put("/task/{task_id}/complete")
 def complete_task(task_id: int):
-    if task_id < len(tasks):
-        tasks[task_id]["done"] = True
-        return {"status": "completed", "task": tasks[task_id]}
+    task = tasks.complete(task_id)
+    if task is not None:
+        return {"status": "completed", "task": task}
     return {"error": "Task not found"}
 
 @app.delete("/task/{task_id}")
 def delete_task(task_id: int):
-    if task_id < len(tasks):
-        deleted = tasks.pop(task_id)
-        # Reindex remaining tasks
-        for i, task in enumerate(tasks):
-            task["id"] = i
+    # Ids are never reused, so the other tasks keep theirs
+    deleted = tasks.delete(task_id)
+    if deleted is not None:
         return {"status": "deleted", "task": deleted}
     return {"error": "Task not found"}
 
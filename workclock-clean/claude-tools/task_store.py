@@ -0,0 +1,207 @@
+"""
+Task Store
+The Task Manager's tasks (server.py), kept in a dict keyed by id and saved
+to an append-only log so they survive restarts.
+
+Every change is one JSON line appended to the log: a create carries the
+whole task, complete and delete just its id. Ids come from a counter that
+only goes up, so a deleted task's id is never reused and other tasks keep
+theirs. Create, complete and delete are a dict operation plus one append.
+
+On startup the log is replayed into the dict. Completed and deleted tasks
+leave lines behind, so once the log holds more than twice as many lines as
+there are tasks it is compacted: rewritten as one create per live task
+(plus the id counter) into "<log>.tmp", then renamed over the log. That
+happens on a background thread while changes keep being appended; the lines
+they add meanwhile are copied over before the rename. A crash mid-append
+leaves a torn last line, which replay cuts off; a complete line that can't
+be read is skipped with a warning.
+
+Settings (environment):
+    TASKS_LOG=path        the log (default: tasks.log next to server.py)
+    TASKS_FSYNC=1         fsync after every change (default: flush to the OS only)
+"""
+
+import json
+import os
+import threading
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DEFAULT_LOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tasks.log")
+LOG_PATH = os.environ.get("TASKS_LOG") or DEFAULT_LOG_PATH
+FSYNC = os.environ.get("TASKS_FSYNC", "").strip().lower() in ("1", "true", "yes", "on")
+
+COMPACT_MIN_LINES = 1000    # never compact logs shorter than this
+
+
+def _dumps(record):
+    if orjson is not None:
+        return orjson.dumps(record) + b"\n"
+    return (json.dumps(record, separators=(",", ":")) + "\n").encode()
+
+
+_loads = orjson.loads if orjson is not None else json.loads
+
+
+class TaskStore:
+    """Tasks by id, persisted to an append-only log"""
+
+    def __init__(self, path=LOG_PATH, fsync=FSYNC):
+        self.path = path
+        self.fsync = fsync
+        self.tasks = {}
+        self.next_id = 0
+        self.lines = 0              # lines in the log, live or not
+        self.skipped = 0            # unreadable lines replay passed over
+        self._lock = threading.Lock()
+        self._log = None
+        self._compactor = None      # the background compaction thread, while one runs
+        self._replay()
+        if self._should_compact():
+            self.compact()
+        self._log = open(self.path, "ab")
+
+    # ---- log ----
+
+    def _apply(self, record):
+        op = record["op"]
+        if op == "create":
+            task = record["task"]
+            self.tasks[task["id"]] = task
+            self.next_id = max(self.next_id, task["id"] + 1)
+        elif op == "complete":
+            task = self.tasks.get(record["id"])
+            if task is not None:
+                task["done"] = True
+        elif op == "delete":
+            self.tasks.pop(record["id"], None)
+        elif op == "next_id":
+            self.next_id = max(self.next_id, record["id"])
+
+    def _replay(self):
+        if not os.path.exists(self.path):
+            return
+        end = 0
+        with open(self.path, "rb") as log:
+            for number, line in enumerate(log, 1):
+                if not line.endswith(b"\n"):
+                    # A torn write from a crash: drop it, so the next append starts a fresh line
+                    break
+                end += len(line)
+                self.lines += 1
+                try:
+                    self._apply(_loads(line))
+                except (ValueError, KeyError, TypeError):
+                    # Left for the next compaction to drop
+                    self.skipped += 1
+                    print(f"⚠️  {self.path}:{number}: skipping unreadable line {line[:80]!r}")
+        if end < os.path.getsize(self.path):
+            os.truncate(self.path, end)
+
+    def _write(self, record):
+        self._apply(record)
+        self._log.write(_dumps(record))
+        self._log.flush()
+        if self.fsync:
+            os.fsync(self._log.fileno())
+        self.lines += 1
+        if self._compactor is None and self._should_compact():
+            self._compactor = threading.Thread(target=self._compact_in_background, name="task-log-compactor",
+                                               daemon=True)
+            self._compactor.start()
+
+    def _should_compact(self):
+        return self.lines > max(COMPACT_MIN_LINES, 2 * len(self.tasks))
+
+    def _compact_in_background(self):
+        try:
+            self.compact()
+        except OSError as e:
+            print(f"⚠️  Task log compaction failed, will retry: {e}")
+        finally:
+            self._compactor = None
+
+    def compact(self):
+        """
+        Rewrite the log as one line per live task
+
+        Only taking the snapshot and the final copy-and-rename hold the lock;
+        writing the tasks out doesn't. Replaying a create, complete or delete
+        twice changes nothing, so a change both in the snapshot and in the
+        lines copied after it is harmless.
+        """
+        with self._lock:
+            tasks = list(self.tasks.values())
+            next_id = self.next_id
+            if self._log is not None:
+                self._log.flush()
+            offset = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+            lines = self.lines
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as tmp:
+            tmp.write(_dumps({"op": "next_id", "id": next_id}))
+            for task in tasks:
+                tmp.write(_dumps({"op": "create", "task": task}))
+            with self._lock:
+                # Whatever was appended while the snapshot was being written
+                if self._log is not None:
+                    self._log.flush()
+                with open(self.path, "rb") as log:
+                    log.seek(offset)
+                    tmp.write(log.read())
+                tmp.flush()
+                os.fsync(tmp.fileno())
+                if self._log is not None:
+                    self._log.close()
+                os.replace(tmp_path, self.path)
+                self.lines = len(tasks) + 1 + self.lines - lines
+                if self._log is not None:
+                    self._log = open(self.path, "ab")
+
+    def close(self):
+        compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+        with self._lock:
+            self._log.close()
+
+    # ---- tasks ----
+
+    def create(self, title, description=None, done=False):
+        with self._lock:
+            task = {"id": self.next_id, "title": title, "description": description, "done": done}
+            self._write({"op": "create", "task": task})
+            return dict(task)
+
+    def get(self, task_id):
+        task = self.tasks.get(task_id)
+        return dict(task) if task is not None else None
+
+    def complete(self, task_id):
+        with self._lock:
+            task = self.tasks.get(task_id)
+            if task is None:
+                return None
+            if not task["done"]:
+                self._write({"op": "complete", "id": task_id})
+            return dict(task)
+
+    def delete(self, task_id):
+        with self._lock:
+            task = self.tasks.get(task_id)
+            if task is None:
+                return None
+            self._write({"op": "delete", "id": task_id})
+            return task
+
+    def all(self):
+        """Every task, oldest first"""
+        with self._lock:
+            return [dict(task) for task in self.tasks.values()]
+
+    def __len__(self):
+        return len(self.tasks)
@@ -1,8 +1,18 @@
+import pytest
 import requests
 import json
+import os
+import shutil
+import sqlite3
+import time
+from contextlib import contextmanager
 from datetime import datetime
 
 BASE_URL = "http://127.0.0.1:8001"
+TIMEOUT = 10  # seconds
+
+# One session for the whole run, so every request reuses the same connection
+session = requests.Session()
 
 def print_section(title):
     """Print a nice section header"""
@@ -13,7 +23,7 @@ def print_section(title):
 def test_connection():
     """Test if the API is running"""
     try:
-        response = requests.get(BASE_URL)
+        response = session.get(BASE_URL, timeout=TIMEOUT)
         data = response.json()
         print("✅ CalProTrack API is running!")
         print(f"   📊 Active Employees: {data['stats']['active_employees']}")
@@ -29,7 +39,7 @@ def get_active_employees():
     """Show who's currently clocked in"""
     print_section("WHO'S WORKING RIGHT NOW?")
     
-    response = requests.get(f"{BASE_URL}/active")
+    response = session.get(f"{BASE_URL}/active", timeout=TIMEOUT)
     employees = response.json()
     
     if not employees:
@@ -47,7 +57,7 @@ def get_payroll():
     """Get this week's payroll"""
     print_section("THIS WEEK'S PAYROLL (Last 7 Days)")
     
-    response = requests.get(f"{BASE_URL}/payroll?days=7")
+    response = session.get(f"{BASE_URL}/payroll?days=7", timeout=TIMEOUT)
     payroll = response.json()
     
     if not payroll:
@@ -76,7 +86,7 @@ def get_employee_hours(user_id=None):
     """Get hours for a specific employee"""
     if user_id is None:
         # Get first employee
-        response = requests.get(f"{BASE_URL}/employees")
+        response = session.get(f"{BASE_URL}/employees", timeout=TIMEOUT)
         employees = response.json()['employees']
         if not employees:
             print("   No employees found.")
@@ -85,7 +95,7 @@ def get_employee_hours(user_id=None):
     
     print_section(f"EMPLOYEE #{user_id} - LAST 30 DAYS")
     
-    response = requests.get(f"{BASE_URL}/employee/{user_id}/hours?days=30")
+    response = session.get(f"{BASE_URL}/employee/{user_id}/hours?days=30", timeout=TIMEOUT)
     data = response.json()
     
     print(f"\n   👤 {data['name']}")
@@ -98,7 +108,7 @@ def get_busy_sites():
     """Show which sites are busiest"""
     print_section("BUSIEST SITES TODAY")
     
-    response = requests.get(f"{BASE_URL}/sites/busy")
+    response = session.get(f"{BASE_URL}/sites/busy", timeout=TIMEOUT)
     sites = response.json()
     
     if not sites:
@@ -115,7 +125,7 @@ def get_today_summary():
     """Get today's summary"""
     print_section("TODAY'S SUMMARY")
     
-    response = requests.get(f"{BASE_URL}/today")
+    response = session.get(f"{BASE_URL}/today", timeout=TIMEOUT)
     data = response.json()
     
     print(f"\n   📅 Date: {data['date']}")
@@ -124,6 +134,643 @@ def get_today_summary():
     print(f"   ⏱️  Total Hours: {data['total_hours']:.2f} hrs")
     print(f"   💰 Total Pay: ${data['total_pay']:.2f}")
 
+DEMO_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "fieldtrack.db")
+
+@pytest.fixture
+def db_path(tmp_path):
+    """A migrated copy of the demo database in the test's tmp_path"""
+    from calprotrack_migrations import run_migrations
+
+    path = str(tmp_path / "fieldtrack.db")
+    shutil.copy(DEMO_DB, path)
+    run_migrations(path)
+    return path
+
+@contextmanager
+def demo_api(db_path, **overrides):
+    """A TestClient for the API over `db_path` (the db_path fixture); overrides replace module settings"""
+    import calprotrack_api_fixed as api
+    from fastapi.testclient import TestClient
+
+    overrides = {"DB_PATH": db_path, "ARCHIVE_DIR": os.path.join(os.path.dirname(db_path), "archive"), **overrides}
+    saved = {name: getattr(api, name) for name in overrides}
+    try:
+        for name, value in overrides.items():
+            setattr(api, name, value)
+        with TestClient(api.app) as client:
+            # The rollup's first refresh writes in the background; let it finish first
+            while api.app.state.rollup.last_result is None and api.app.state.rollup.last_error is None:
+                time.sleep(0.01)
+            yield client
+    finally:
+        for name, value in saved.items():
+            setattr(api, name, value)
+
+def test_query_plans(db_path):
+    """Report queries must seek on an index, never fall back to a full scan of shifts or segments"""
+    import calprotrack_api_fixed as api
+    import calprotrack_export as export
+    from calprotrack_json import check_model_queries
+    from calprotrack_time import epoch_params
+
+    checks = {
+        "/payroll": api.PAYROLL_QUERY,
+        "/employee/{id}/hours": api.EMPLOYEE_HOURS_QUERY,
+        "/today": api.TODAY_SUMMARY_QUERY,
+        "/sites/busy": api.SITES_BUSY_QUERY,
+        "/": api.ROOT_STATS_QUERY,
+        "/export/shifts": export.EXPORT_QUERY,
+        "/companies/{id}": api.COMPANY_ROOT_STATS_QUERY,
+        "/companies/{id}/active": api.COMPANY_ACTIVE_EMPLOYEES_QUERY,
+        "/companies/{id}/payroll": api.COMPANY_PAYROLL_QUERY,
+        "/companies/{id}/today": api.COMPANY_TODAY_SUMMARY_QUERY,
+        "/companies/{id}/sites/busy": api.COMPANY_SITES_BUSY_QUERY,
+        "/companies/{id}/export/shifts": export.COMPANY_EXPORT_QUERY,
+    }
+    params = {"user_id": 1, "company_id": 1, "since": "2026-01-01 09:30:00", "now": "2026-01-08 12:00:00",
+              "start": "2026-01-08 00:00:00", "end": "2026-01-09 00:00:00",
+              "rollup_start": "2026-01-02 00:00:00", "rollup_end": "2026-01-08 00:00:00",
+              "rollup_start_day": "2026-01-02", "rollup_end_day": "2026-01-08",
+              "watermark": "2026-01-08 11:59:00", "after_id": 0, "first_id": 1, "last_id": 1000}
+    params = epoch_params(params, "since", "now", "start", "end", "rollup_start", "rollup_end", "watermark")
+    scanned_tables = ("s", "shifts", "ss", "shift_segments")
+
+    conn = sqlite3.connect(db_path)
+    for name, query in checks.items():
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + query, params)]
+        scans = [step for step in plan if step.split()[0] == "SCAN" and step.split()[1] in scanned_tables]
+        assert not scans, f"{name} does a full scan: {plan}"
+    # Report rows are sent without per-row validation, so each query's columns must match its model
+    check_model_queries(conn)
+    conn.close()
+
+def test_epoch_columns(db_path, monkeypatch):
+    """The *_epoch columns follow whatever is written to the text timestamps"""
+    import calprotrack_migrations
+    from calprotrack_migrations import run_migrations
+    from calprotrack_time import db_epoch
+
+    # Backfill the existing rows again, over many small transactions
+    monkeypatch.setattr(calprotrack_migrations, "BACKFILL_BATCH", 7)
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE shifts SET clock_in_epoch = NULL, clock_out_epoch = NULL")
+    conn.execute("UPDATE shift_segments SET start_epoch = NULL, end_epoch = NULL")
+    conn.execute("DELETE FROM calprotrack_migrations WHERE name = 'epoch_backfill'")
+    conn.commit()
+    assert run_migrations(db_path) == ["epoch_backfill"]
+
+    stale = conn.execute("""
+        SELECT COUNT(*) FROM shifts
+        WHERE clock_in_epoch IS NOT CAST(strftime('%s', clock_in_at) AS INTEGER)
+           OR clock_out_epoch IS NOT CAST(strftime('%s', clock_out_at) AS INTEGER)
+    """).fetchone()[0]
+    assert stale == 0
+    # Clock in, move sites and clock out the way server.js does
+    shift_id = conn.execute("INSERT INTO shifts (company_id, user_id, clock_in_at) VALUES (1, 1, '2026-01-08 08:00:00')").lastrowid
+    segment_id = conn.execute("INSERT INTO shift_segments (company_id, shift_id, job_site_id, start_at) "
+                              "VALUES (1, ?, 1, '2026-01-08 08:00:00')", (shift_id,)).lastrowid
+    assert conn.execute("SELECT clock_in_epoch, clock_out_epoch FROM shifts WHERE id = ?",
+                        (shift_id,)).fetchone() == (db_epoch("2026-01-08 08:00:00"), None)
+    conn.execute("UPDATE shift_segments SET end_at = '2026-01-08 12:30:00' WHERE id = ?", (segment_id,))
+    conn.execute("UPDATE shifts SET clock_out_at = '2026-01-08 16:00:00' WHERE id = ?", (shift_id,))
+    assert conn.execute("SELECT end_epoch - start_epoch FROM shift_segments WHERE id = ?",
+                        (segment_id,)).fetchone()[0] == 4.5 * 3600
+    assert conn.execute("SELECT clock_out_epoch FROM shifts WHERE id = ?",
+                        (shift_id,)).fetchone()[0] == db_epoch("2026-01-08 16:00:00")
+    conn.close()
+
+def test_archive_month(db_path, tmp_path):
+    """Archiving a month moves its shifts out of the live tables without changing any report"""
+    import calprotrack_api_fixed as api
+    from calprotrack_archive import archive_before, archive_snapshot
+    from calprotrack_pool import open_connection
+    from calprotrack_rollup import rollup_window
+
+    archive_dir = str(tmp_path / "archive")
+
+    # A window whose partial first day has shifts in the demo data's first month
+    since, now = "2026-01-31 00:30:00", "2026-02-10 00:00:00"
+
+    def report():
+        conn = open_connection(db_path)
+        try:
+            with archive_snapshot(conn, archive_dir, [(since, "2026-02-01 00:00:00")]) as archives:
+                params = rollup_window(conn, since, now)
+                rows = conn.execute(api.payroll_query(False, tuple(archives)), params).fetchall()
+                return [dict(row) for row in rows], conn.execute("SELECT COUNT(*) FROM shifts").fetchone()[0]
+        finally:
+            conn.close()
+
+    before, live_before = report()
+    archived = archive_before(db_path, "2026-02", archive_dir, log=lambda *a: None)
+    after, live_after = report()
+    assert [month["month"] for month in archived] == ["2026-01"]
+    assert live_after == live_before - archived[0]["shifts"]
+    assert after == before
+
+def test_columnar_store(db_path, tmp_path):
+    """The columnar store's totals match SQL after a build and after segments close or arrive out of order"""
+    from calprotrack_columnar import ColumnarStore
+
+    store = ColumnarStore(str(tmp_path / "columnar"))
+
+    def sql_totals():
+        conn = sqlite3.connect(db_path)
+        rows = conn.execute("""
+            SELECT s.user_id, SUM(COALESCE(ss.end_epoch, s.clock_out_epoch) - ss.start_epoch), COUNT(*)
+            FROM shift_segments ss JOIN shifts s ON s.id = ss.shift_id
+            WHERE COALESCE(ss.end_epoch, s.clock_out_epoch) IS NOT NULL
+            GROUP BY s.user_id
+        """).fetchall()
+        conn.close()
+        return {user_id: (seconds, count) for user_id, seconds, count in rows}
+
+    def store_totals():
+        totals = ColumnarStore(store.path).open().totals("user_id")
+        return {key: (round(hours * 3600), count) for key, hours, count in
+                zip(totals["id"].tolist(), totals["hours"].tolist(), totals["segments"].tolist())}
+
+    store.build(db_path)
+    assert store_totals() == sql_totals()
+
+    # Close every open segment of an open shift, and add a closed segment older than everything stored
+    conn = sqlite3.connect(db_path)
+    conn.execute("""UPDATE shift_segments SET end_at = datetime(start_at, '+1 hours')
+                    WHERE end_at IS NULL AND shift_id IN (SELECT id FROM shifts WHERE clock_out_at IS NULL)""")
+    conn.execute("""INSERT INTO shift_segments (company_id, shift_id, job_site_id, start_at, end_at, created_at)
+                    SELECT company_id, shift_id, job_site_id, '2000-01-01 08:00:00', '2000-01-01 09:00:00',
+                           created_at FROM shift_segments LIMIT 1""")
+    conn.commit()
+    conn.close()
+    result = store.refresh(db_path)
+    assert result["appended"] >= 1 and result["pending"] == 0
+    assert store_totals() == sql_totals()
+
+def test_batch_bad_parameters(db_path):
+    """A batch action with bad parameters fails on its own, with a 400, and the others still run"""
+    with demo_api(db_path) as client:
+        response = client.post("/batch", json={"actions": [
+            {"action": "get_today_summary"},
+            {"action": "get_payroll", "parameters": {"days": "7"}},
+            {"action": "get_payroll", "parameters": {"days": None}},
+            {"action": "get_payroll", "parameters": {"days": "a week"}},
+            {"action": "get_payroll", "parameters": {"days": 0}},
+            {"action": "get_employee_hours", "parameters": {"days": 7}},
+            {"action": "get_employee_hours", "parameters": {"employee_id": 999999}},
+            {"action": "fire_everyone"},
+        ]})
+        assert response.status_code == 200
+        results = response.json()["results"]
+        assert "result" in results[0] and "result" in results[1]
+        assert [result.get("status") for result in results[2:]] == [400, 400, 400, 400, 404, 400]
+        assert "days" in results[2]["error"] and "employee_id" in results[5]["error"]
+
+def test_snapshot_refresh(db_path, tmp_path):
+    """A refresh moves the pool to a new snapshot file; the old one goes once its last reader is done"""
+    from calprotrack_pool import ConnectionPool
+    from calprotrack_snapshot import ReportSnapshot
+
+    snapshot = ReportSnapshot(db_path, str(tmp_path / "report.db"))
+    snapshot.ensure()
+    snapshot.pool = ConnectionPool(snapshot.path, size=2, immutable=True)
+    first = snapshot.path
+
+    reader = snapshot.pool.acquire()
+    users = reader.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO users (company_id, email, name, pass_hash, role) "
+                 "VALUES (1, 'new@example.com', 'New', 'x', 'employee')")
+    conn.commit()
+    conn.close()
+
+    snapshot.refresh()
+    assert snapshot.path != first and os.path.exists(first)   # still being read
+    assert reader.execute("SELECT COUNT(*) FROM users").fetchone()[0] == users
+    with snapshot.pool.connection() as fresh:
+        assert fresh.execute("SELECT COUNT(*) FROM users").fetchone()[0] == users + 1
+    snapshot.pool.release(reader)
+    snapshot.remove_old()
+    assert not os.path.exists(first) and os.path.exists(snapshot.path)
+    snapshot.pool.close()
+
+def test_export_pool(db_path):
+    """Exports stream from their own pool: when it's full, exports get a 503 and the rest of the API still answers"""
+    import calprotrack_api_fixed as api
+
+    with demo_api(db_path, EXPORT_POOL_SIZE=1, EXPORT_POOL_TIMEOUT=0.1) as client:
+        assert client.get("/export/shifts", params={"start": "2020-01-01"}).status_code == 200
+        export_pool = api.app.state.export_pool
+        assert export_pool.stats()["in_use"] == 0       # given back once the download finished
+        slow_download = export_pool.acquire()
+        try:
+            assert client.get("/export/shifts", params={"start": "2020-01-01"}).status_code == 503
+            assert client.get("/active").status_code == 200
+            assert api.app.state.db_pool.stats()["in_use"] == 0
+        finally:
+            export_pool.release(slow_download)
+
+def test_export_disconnect(db_path):
+    """A client that disconnects before the first chunk still gives the export connection back"""
+    import asyncio
+    import calprotrack_api_fixed as api
+
+    async def disconnect_early():
+        async def receive():
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            await asyncio.sleep(0.1)        # the disconnect wins before the body starts
+
+        scope = {"type": "http", "method": "GET", "path": "/export/shifts", "raw_path": b"/export/shifts",
+                 "query_string": b"start=2020-01-01", "headers": [], "scheme": "http", "http_version": "1.1",
+                 "server": ("testserver", 80), "client": ("testclient", 1234), "root_path": "", "app": api.app}
+        await api.app(scope, receive, send)
+
+    with demo_api(db_path, EXPORT_POOL_SIZE=1, EXPORT_POOL_TIMEOUT=0.1) as client:
+        for _ in range(2):
+            asyncio.run(disconnect_early())
+        assert api.app.state.export_pool.stats()["in_use"] == 0
+        assert client.get("/export/shifts", params={"start": "2020-01-01"}).status_code == 200
+
+def test_onsite_lookups(db_path):
+    """Watcher batches add new users without a full reload; edits wait for the periodic one"""
+    import calprotrack_onsite as onsite
+    from calprotrack_pool import open_connection
+
+    reader = open_connection(db_path)
+    state = onsite.OnSiteState()
+    state.seed(reader)
+    writer = sqlite3.connect(db_path)
+    user_id = writer.execute("INSERT INTO users (company_id, email, name, pass_hash, role) "
+                             "VALUES (1, 'new@example.com', 'New', 'x', 'employee')").lastrowid
+    old_id, old_name = writer.execute("SELECT id, name FROM users WHERE id < ? LIMIT 1", (user_id,)).fetchone()
+    writer.execute("UPDATE users SET name = 'Renamed' WHERE id = ?", (old_id,))
+    writer.commit()
+    writer.close()
+
+    state.update(reader, [])
+    assert state.users[user_id].name == "New"
+    assert state.users[old_id].name == old_name
+    state._lookups_at -= onsite.LOOKUP_REFRESH_SECONDS
+    state.update(reader, [])
+    assert state.users[old_id].name == "Renamed"
+    reader.close()
+
+def test_onsite_rows_match_models(db_path):
+    """On-site rows are built by hand, so they must validate against the models and agree with SQL, NULL addresses included"""
+    from typing import List
+    from pydantic import TypeAdapter
+    import calprotrack_api_fixed as api
+    from calprotrack_onsite import OnSiteState
+    from calprotrack_pool import open_connection
+
+    writer = sqlite3.connect(db_path)
+    writer.execute("UPDATE job_sites SET address = NULL WHERE id = (SELECT MIN(id) FROM job_sites WHERE is_active = 1)")
+    writer.commit()
+    writer.close()
+
+    conn = open_connection(db_path)
+    state = OnSiteState()
+    state.seed(conn)
+    for model, memory, sql in ((api.SiteBusyness, state.busy_sites(), api.fetch_busy_sites(conn)),
+                               (api.ActiveEmployee, state.active_employees(), api.fetch_active_employees(conn))):
+        TypeAdapter(List[model]).validate_python(memory)
+        assert [list(row) for row in memory] == [list(model.model_fields)] * len(memory)
+        assert sorted(map(str, (row.get("site_address") for row in memory))) == \
+               sorted(map(str, (row.get("site_address") for row in sql)))
+    assert None in [row["site_address"] for row in state.busy_sites()]
+    conn.close()
+
+def test_payroll_windows(db_path, tmp_path):
+    """Reversed or oversized report windows are a 400; a shift left open for days is paid day by day"""
+    import numpy as np
+    import calprotrack_api_fixed as api
+    from calprotrack_payroll import split_workdays, pay_hours
+
+    with demo_api(db_path) as client:
+        assert client.get("/payroll/detailed", params={"start": "2026-02-05", "end": "2026-02-01"}).status_code == 400
+        assert client.get("/payroll/detailed", params={"start": "2025-01-01", "end": "2026-06-01"}).status_code == 400
+        assert client.get("/payroll/detailed", params={"days": 0}).status_code == 400
+        assert client.get("/payroll/detailed", params={"days": 30}).status_code == 200
+
+    with demo_api(db_path, COLUMNAR_DIR=str(tmp_path / "columnar")) as client:
+        while not api.app.state.columnar.store.ready:
+            time.sleep(0.01)
+        for path in ("/analytics/sites/1/trend", "/companies/1/analytics/sites/1/trend"):
+            for days in (0, -5, 1000000):
+                assert client.get(path, params={"days": days}).status_code == 400
+            assert len(client.get(path, params={"days": 14}).json()) == 14
+
+    # Clocked in at midnight and not out for three days; the window is the last two
+    hour, day = 3600, 86400
+    arrays = split_workdays(np.array([1]), np.array([1]), np.array([10 * day]),
+                            np.array([10 * day]), np.array([13 * day]))
+    _, _, hours = pay_hours(*arrays, 11 * day, 13 * day)
+    # Each paid day is its own workday: 8 regular, 4 overtime and 12 double-time hours
+    assert np.allclose(hours.sum(axis=1) * hour, np.array([16, 8, 24]) * hour)
+    # A night shift stays on the day it clocked in on
+    _, _, workdays, _, _ = split_workdays(np.array([1]), np.array([1]), np.array([10 * day + 22 * hour]),
+                                          np.array([10 * day + 22 * hour]), np.array([11 * day + 6 * hour]))
+    assert workdays.tolist() == [10]
+
+def test_generate_interrupted(db_path, monkeypatch):
+    """A load stopped part way (even by Ctrl+C) still puts back the indexes it dropped"""
+    import pytest
+    import calprotrack_generate
+    from calprotrack_generate import generate
+
+    class CtrlCOnSegments:
+        """A connection that gets interrupted in the middle of its first segment batch"""
+        def __init__(self, conn):
+            self.__dict__["conn"] = conn
+
+        def __getattr__(self, name):
+            return getattr(self.conn, name)
+
+        def __setattr__(self, name, value):
+            setattr(self.conn, name, value)
+
+        def executemany(self, sql, rows):
+            if "shift_segments" in sql:
+                raise KeyboardInterrupt
+            return self.conn.executemany(sql, rows)
+
+    generate(db_path, companies=1, users=5, sites=2, days=1, shifts_per_day=2, log=lambda *a: None)
+    conn = sqlite3.connect(db_path)
+    index_sql = "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name IN ('shifts', 'shift_segments')"
+    indexes = set(conn.execute(index_sql).fetchall())
+    shifts = conn.execute("SELECT COUNT(*) FROM shifts").fetchone()[0]
+
+    open_connection = calprotrack_generate.open_connection
+    monkeypatch.setattr(calprotrack_generate, "open_connection", lambda *a, **k: CtrlCOnSegments(open_connection(*a, **k)))
+    with pytest.raises(KeyboardInterrupt):
+        generate(db_path, companies=1, users=5, sites=2, days=3, shifts_per_day=2, drop_indexes=True,
+                 log=lambda *a: None)
+    assert set(conn.execute(index_sql).fetchall()) == indexes
+    assert conn.execute("SELECT COUNT(*) FROM shifts").fetchone()[0] == shifts
+    conn.close()
+
+def test_profiler_start_failure():
+    """A profiler that fails to start leaves the request unprofiled and the profiling slot free"""
+    from types import SimpleNamespace
+    from calprotrack_timing import SlowRequestProfiler
+
+    class AlreadyActive:
+        def __init__(self, **options):
+            pass
+
+        def start(self):
+            raise RuntimeError("There is already a profiler running")
+
+    profiler = SlowRequestProfiler(threshold_ms=0, sample=1.0)
+    profiler._pyinstrument = SimpleNamespace(Profiler=AlreadyActive)
+    assert profiler.start() is None
+    assert not profiler._busy.locked()
+
+def test_task_store(tmp_path):
+    """The task log replays to the same tasks, cuts off a torn last line, skips unreadable ones and compacts"""
+    from task_store import TaskStore
+
+    path = str(tmp_path / "tasks.log")
+    store = TaskStore(path)
+    first = store.create("Write report", "quarterly")
+    second = store.create("Call client")
+    store.complete(first["id"])
+    store.complete(first["id"])                     # already done: nothing appended
+    store.delete(second["id"])
+    assert store.lines == 4
+    store.close()
+
+    with open(path, "ab") as log:
+        log.write(b'{"op":"create"}\n{"op":"delete","id"')   # unreadable, then torn by a crash
+    store = TaskStore(path)
+    assert store.all() == [{**first, "done": True}] and store.skipped == 1
+    assert open(path, "rb").read().endswith(b"\n")
+    third = store.create("Order parts")
+    assert third["id"] == 2                         # deleted ids aren't reused
+    store.close()
+
+    # Enough dead lines to compact, on a background thread
+    store = TaskStore(path)
+    created = [store.create(f"Task {i}") for i in range(600)]
+    for task in created[100:]:
+        store.delete(task["id"])
+    store.close()
+    tasks = store.all()
+    with open(path, "rb") as log:
+        assert len(log.readlines()) < 400             # down from 1,100
+    store = TaskStore(path)
+    assert store.all() == tasks and store.next_id == created[-1]["id"] + 1
+    store.close()
+
+def test_cache_invalidation(db_path):
+    """Cached /sites pages and their ETags last until a write moves data_version, then are rebuilt"""
+    import calprotrack_api_fixed as api
+    from calprotrack_cache import response_cache
+
+    with demo_api(db_path) as client:
+        first = client.get("/sites")
+        etag = first.headers["etag"]
+        hits, invalidations = response_cache.stats()["hits"], response_cache.stats()["invalidations"]
+        assert client.get("/sites", headers={"If-None-Match": etag}).status_code == 304
+        assert response_cache.stats()["hits"] == hits + 1
+
+        conn = sqlite3.connect(api.DB_PATH)
+        conn.execute("INSERT INTO job_sites (company_id, name, address) VALUES (1, 'New Site', '1 Main St')")
+        conn.commit()
+        conn.close()
+
+        second = client.get("/sites", headers={"If-None-Match": etag})
+        assert second.status_code == 200 and second.headers["etag"] != etag
+        assert len(second.json()["sites"]) == len(first.json()["sites"]) + 1
+        assert response_cache.stats()["invalidations"] > invalidations
+
+def test_company_scoping(db_path):
+    """/companies/{id}/... only returns that company's rows, 404s for unknown ones and counts its queries"""
+    import calprotrack_api_fixed as api
+    from calprotrack_tenants import tenant_metrics
+
+    with demo_api(db_path) as client:
+        conn = sqlite3.connect(api.DB_PATH)
+        company_id = conn.execute("INSERT INTO companies (name) VALUES ('Other Co')").lastrowid
+        conn.execute("INSERT INTO job_sites (company_id, name, address) VALUES (?, 'Other Site', NULL)", (company_id,))
+        conn.execute("INSERT INTO users (company_id, email, name, pass_hash, role) "
+                     "VALUES (?, 'other@example.com', 'Other', 'x', 'employee')", (company_id,))
+        conn.commit()
+        conn.close()
+
+        assert [site["name"] for site in client.get(f"/companies/{company_id}/sites").json()["sites"]] == ["Other Site"]
+        assert "Other Site" not in [site["name"] for site in client.get("/companies/1/sites").json()["sites"]]
+        assert "Other Site" in [site["name"] for site in client.get("/sites").json()["sites"]]
+        assert [e["name"] for e in client.get(f"/companies/{company_id}/employees").json()["employees"]] == ["Other"]
+        assert client.get(f"/companies/{company_id}/payroll").json() == []
+        for path in ("/companies/999999/sites", "/companies/999999/payroll", "/companies/999999/today"):
+            assert client.get(path).status_code == 404
+
+        tenants = {tenant["company_id"]: tenant for tenant in tenant_metrics.stats(top=100)["top"]}
+        assert {"/sites", "/employees", "/payroll"} <= set(tenants[company_id]["endpoints"])
+
+def test_activity_stream(db_path):
+    """A clock-in committed by another connection reaches the SSE stream of its company, and only that one"""
+    import asyncio
+    import json
+    from calprotrack_activity import ActivityWatcher, sse_stream
+
+    async def watch(db_path):
+        watcher = ActivityWatcher(db_path, interval=0.05)
+        watcher.start(asyncio.get_running_loop())
+        try:
+            while watcher._data_version is None:          # seeded: later writes become events
+                await asyncio.sleep(0.05)
+            mine, other = sse_stream(watcher, company_id=1), sse_stream(watcher, company_id=2, keepalive=0.5)
+            assert await anext(mine) == await anext(other) == "retry: 3000\n\n"
+
+            conn = sqlite3.connect(db_path)
+            shift_id = conn.execute("INSERT INTO shifts (company_id, user_id, clock_in_at) "
+                                    "VALUES (1, 1, datetime('now'))").lastrowid
+            conn.commit()
+            conn.close()
+
+            message = await asyncio.wait_for(anext(mine), timeout=5)
+            lines = dict(line.split(": ", 1) for line in message.strip().split("\n"))
+            assert lines["event"] == "activity"
+            assert {"type": "clock_in", "shift_id": shift_id} in [
+                {"type": event["type"], "shift_id": event["shift_id"]} for event in json.loads(lines["data"])]
+            assert await asyncio.wait_for(anext(other), timeout=5) == ": keepalive\n\n"
+            await mine.aclose()
+            await other.aclose()
+        finally:
+            watcher.stop()
+
+    asyncio.run(watch(db_path))
+
+def test_lane_timeout():
+    """A query past its lane's deadline is interrupted with QueryTimeout (a 504) and the lane keeps working"""
+    import asyncio
+    import calprotrack_api_fixed as api
+    from calprotrack_executor import DBLane, QueryTimeout
+    from calprotrack_pool import ConnectionPool
+
+    endless = "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT COUNT(*) FROM n"
+
+    async def run(lane):
+        started = time.perf_counter()
+        try:
+            await lane.run(lambda conn: conn.execute(endless).fetchone())
+            raise AssertionError("the endless query finished")
+        except QueryTimeout:
+            assert time.perf_counter() - started < 5
+        return await lane.run(lambda conn: conn.execute("SELECT COUNT(*) FROM users").fetchone()[0])
+
+    pool = ConnectionPool(DEMO_DB, size=1)
+    lane = DBLane("test", pool, workers=1, timeout=0.2)
+    try:
+        assert asyncio.run(run(lane)) > 0
+        assert lane.stats()["timeouts"] == 1
+    finally:
+        lane.shutdown()
+        pool.close()
+    assert api.app.exception_handlers[QueryTimeout] is api.query_timeout
+
+def test_client_retries():
+    """The client retries 503s with backoff until a call succeeds or its retries run out"""
+    import threading
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from calprotrack_connector import CalProTrackClient
+
+    statuses = []
+
+    class Flaky(BaseHTTPRequestHandler):
+        def do_GET(self):
+            status = statuses.pop(0) if statuses else 200
+            body = b'{"ok": true}' if status == 200 else b'{"detail": "busy"}'
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Flaky)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with CalProTrackClient(f"http://127.0.0.1:{server.server_port}", retries=2, backoff=0.01) as client:
+            statuses[:] = [503, 503]
+            assert client.request("GET", "/today").status_code == 200
+            assert client.stats.last["retries"] == 2
+            statuses[:] = [503, 503, 503]
+            assert client.request("GET", "/today").status_code == 503
+            assert client.stats.last["retries"] == 2
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_keyset_paging(db_path):
+    """Paging /sites with limit and next_after visits every site once, in the unpaged order"""
+    import calprotrack_api_fixed as api
+
+    with demo_api(db_path) as client:
+        conn = sqlite3.connect(api.DB_PATH)
+        conn.executemany("INSERT INTO job_sites (company_id, name, address) VALUES (1, ?, NULL)",
+                         [(f"Site {i:02d}",) for i in range(7)])
+        conn.commit()
+        conn.close()
+
+        everything = [site["id"] for site in client.get("/sites").json()["sites"]]
+        paged, after = [], None
+        while True:
+            page = client.get("/sites", params={"limit": 3, "fields": "id,name",
+                                                **({"after": after} if after else {})}).json()
+            assert all(set(site) == {"id", "name"} for site in page["sites"])
+            paged += [site["id"] for site in page["sites"]]
+            after = page["next_after"]
+            if after is None:
+                break
+        assert paged == everything
+        assert client.get("/sites", params={"fields": "id,pass_hash"}).status_code == 400
+        # Not base64, a bare number ("MQ" is 1) and a three-element list
+        for after in ("%%%", "MQ", "WyJhIiwxLDJd"):
+            assert client.get("/sites", params={"after": after}).status_code == 400
+
+def test_rollup_backdated_shifts(db_path):
+    """Shifts added or deleted in days the rollup already covers are rebuilt on the next refresh"""
+    from calprotrack_rollup import refresh_rollup
+
+    rollup_hours = "SELECT day, ROUND(SUM(hours), 4) FROM daily_user_site_rollup GROUP BY day"
+    shift_hours = """
+        SELECT substr(clock_in_at, 1, 10), ROUND(SUM(clock_out_epoch - clock_in_epoch) / 3600.0, 4) FROM shifts
+        WHERE clock_out_at IS NOT NULL AND clock_in_at < (SELECT covered_until FROM rollup_state) GROUP BY 1
+    """
+    refresh_rollup(db_path)
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("DELETE FROM shift_segments")
+    conn.execute("DELETE FROM shifts")
+    for days_ago in (2, 3, 5):
+        shift_id = conn.execute("""
+            INSERT INTO shifts (company_id, user_id, clock_in_at, clock_out_at)
+            VALUES (1, 1, datetime('now', 'start of day', ?, '+8 hours'), datetime('now', 'start of day', ?, '+16 hours'))
+        """, (f"-{days_ago} days", f"-{days_ago} days")).lastrowid
+        conn.execute("""
+            INSERT INTO shift_segments (company_id, shift_id, job_site_id, start_at, end_at)
+            SELECT company_id, id, (SELECT MIN(id) FROM job_sites), clock_in_at, clock_out_at FROM shifts WHERE id = ?
+        """, (shift_id,))
+    conn.commit()
+    assert conn.execute("SELECT COUNT(*) FROM rollup_dirty_days").fetchone()[0] > 0
+
+    result = refresh_rollup(db_path)
+    assert result["late_days_rebuilt"] >= 3
+    assert dict(conn.execute(rollup_hours).fetchall()) == dict(conn.execute(shift_hours).fetchall())
+    assert conn.execute("SELECT COUNT(*) FROM rollup_dirty_days").fetchone()[0] == 0
+
+    # A full rebuild, one day per transaction, ends up with the same rows
+    rows = conn.execute("SELECT * FROM daily_user_site_rollup ORDER BY 1, 2, 3").fetchall()
+    refresh_rollup(db_path, full=True)
+    assert conn.execute("SELECT * FROM daily_user_site_rollup ORDER BY 1, 2, 3").fetchall() == rows
+    conn.close()
+
 def main():
     print("\n" + "=" * 60)
     print("  🚀 CALPROTRACK API - BUSINESS INSIGHTS")
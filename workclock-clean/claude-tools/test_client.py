@@ -2,11 +2,15 @@ import requests
 import json
 
 BASE_URL = "http://127.0.0.1:8000"
+TIMEOUT = 10  # seconds
+
+# One session for the whole run, so every request reuses the same connection
+session = requests.Session()
 
 def test_server():
     """Check if server is running"""
     try:
-        response = requests.get(BASE_URL)
+        response = session.get(BASE_URL, timeout=TIMEOUT)
         print("✅ Server is running!")
         print(f"Response: {response.json()}\n")
         return True
@@ -20,13 +24,13 @@ def create_task(title, description=None):
     if description:
         data["description"] = description
     
-    response = requests.post(f"{BASE_URL}/task/create", json=data)
+    response = session.post(f"{BASE_URL}/task/create", json=data, timeout=TIMEOUT)
     print(f"✅ Created task: {response.json()}\n")
     return response.json()
 
 def list_tasks():
     """List all tasks"""
-    response = requests.get(f"{BASE_URL}/task/list")
+    response = session.get(f"{BASE_URL}/task/list", timeout=TIMEOUT)
     tasks = response.json()
     print(f"📋 Tasks ({tasks['count']}):")
     for task in tasks['tasks']:
@@ -39,13 +43,13 @@ def list_tasks():
 
 def complete_task(task_id):
     """Mark a task as complete"""
-    response = requests.put(f"{BASE_URL}/task/{task_id}/complete")
+    response = session.put(f"{BASE_URL}/task/{task_id}/complete", timeout=TIMEOUT)
     print(f"✅ Completed: {response.json()}\n")
     return response.json()
 
 def delete_task(task_id):
     """Delete a task"""
-    response = requests.delete(f"{BASE_URL}/task/{task_id}")
+    response = session.delete(f"{BASE_URL}/task/{task_id}", timeout=TIMEOUT)
     print(f"🗑️  Deleted: {response.json()}\n")
     return response.json()
 